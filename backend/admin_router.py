@@ -17,8 +17,8 @@ from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from sqlalchemy import func, desc
 
-from database import get_db, InviteCode, Order, SignatureLog, SignForm, PricingPlan, UserProfile
-from user_db_manager import get_user_session, ensure_user_database, get_master_engine
+from database import get_db, InviteCode, Order, SignatureLog, SignForm, PricingPlan
+from user_db_manager import get_user_session, ensure_user_database, get_master_engine, get_profile_model
 from user_router import AppUserIdentity
 from sqlalchemy import text, cast, Date
 
@@ -398,7 +398,7 @@ def list_users(
             ensure_user_database(user_key)
             user_db = get_user_session(user_key)
             try:
-                profile = user_db.query(UserProfile).first()
+                profile = user_db.query(get_profile_model()).first()
                 if profile:
                     remaining_quota = profile.remaining_quota or 0
                     total_used = profile.total_used or 0
@@ -449,7 +449,7 @@ def update_user_quota(
     user_db = get_user_session(user_key)
     
     try:
-        profile = user_db.query(UserProfile).first()
+        profile = user_db.query(get_profile_model()).first()
         if not profile:
             raise HTTPException(status_code=404, detail="用户配置不存在")
         
@@ -498,7 +498,7 @@ def reset_user(
         user_db = get_user_session(user_key)
         
         try:
-            profile = user_db.query(UserProfile).first()
+            profile = user_db.query(get_profile_model()).first()
             if profile:
                 profile.remaining_quota = 20  # 恢复默认 20 次
                 profile.total_used = 0
@@ -535,7 +535,7 @@ def clear_user_invite(
         user_db = get_user_session(user_key)
         
         try:
-            profile = user_db.query(UserProfile).first()
+            profile = user_db.query(get_profile_model()).first()
             if not profile or not profile.invite_code_used:
                 return {"success": True, "message": "用户未使用过邀请码", "invite_code": None}
             
@@ -593,7 +593,7 @@ def export_users(db: Session = Depends(get_db), _: bool = Depends(verify_admin))
             ensure_user_database(user_key)
             user_db = get_user_session(user_key)
             try:
-                profile = user_db.query(UserProfile).first()
+                profile = user_db.query(get_profile_model()).first()
                 if profile:
                     remaining_quota = profile.remaining_quota or 0
                     total_used = profile.total_used or 0
@@ -866,7 +866,7 @@ def update_invite_status(
                 user_db = get_user_session(user_key)
                 
                 try:
-                    profile = user_db.query(UserProfile).first()
+                    profile = user_db.query(get_profile_model()).first()
                     
                     if profile and profile.invite_code_used == invite.code:
                         profile.invite_expire_at = None
@@ -1184,3 +1184,30 @@ def delete_pricing_plan(
     db.commit()
 
     return {"success": True, "message": f"套餐 {plan_id} 已删除"}
+
+
+# ==================== 系统监控 API ====================
+
+@router.get("/system/stats", summary="系统运行统计")
+def get_system_stats(_: bool = Depends(verify_admin)):
+    """获取进程内的运行统计（飞书 HTTP 连接池等），用于容量规划"""
+    import feishu_breaker
+    import feishu_client
+    import feishu_cache
+    import feishu_retry
+    import feishu_shaper
+    import media_cache
+    import user_db_manager
+    from feishu_auth import feishu_auth
+
+    return {
+        "feishu_http_pools": feishu_client.get_pool_stats(),
+        "feishu_retries": feishu_retry.get_stats(),
+        "feishu_shaper": feishu_shaper.get_stats(),
+        "feishu_breakers": feishu_breaker.get_stats(),
+        "caches": feishu_cache.get_cache_stats(),
+        "media_cache": media_cache.get_stats(),
+        "tenant_token": feishu_auth.get_stats(),
+        "user_databases": user_db_manager.get_known_database_stats(),
+        "user_db_pools": user_db_manager.get_pool_stats(),
+    }
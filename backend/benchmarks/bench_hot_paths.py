@@ -0,0 +1,213 @@
+"""
+热点纯函数微基准（pytest-benchmark）
+
+覆盖每个请求里纯 Python 计算较多的路径，夹具按线上较大的表单构造：
+- 表单提交字段转换 convert_submit_fields（100 个字段，各种类型混合）
+- 记录数据转换 resolve_record_fields / collect_attachment_tokens / convert_record_fields
+  （100 个字段的表单，附件字段共 50 个附件）
+- YunGouOSPayment._generate_sign（下单参数和回调参数）
+- auth_jwt 的 create_access_token / decode_token
+- user_db_manager 用户库名：新旧命名规则的哈希计算、分片一致性哈希和 get_user_db_name 的缓存命中路径
+
+执行方式（依赖见 requirements-dev.txt）：
+cd backend
+pip install -r requirements-dev.txt
+python -m pytest benchmarks/bench_hot_paths.py --benchmark-only
+python -m pytest benchmarks/bench_hot_paths.py --benchmark-only --benchmark-save=before
+python -m pytest benchmarks/bench_hot_paths.py --benchmark-only --benchmark-compare
+"""
+import os
+import sys
+import json
+
+import pytest
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+import auth_jwt  # noqa: E402
+import form_router  # noqa: E402
+from payment.yungouos import YunGouOSPayment  # noqa: E402
+import user_db_manager  # noqa: E402
+
+FIELD_COUNT = 100
+ATTACHMENT_COUNT = 50
+
+# (input_type, 飞书字段类型, 提交值, 记录中的值)
+_FIELD_KINDS = [
+    ("text", 1, "张三丰", "张三丰"),
+    ("number", 2, "1234.5", 1234.5),
+    ("select", 3, "选项A", "选项A"),
+    ("multiselect", 4, ["选项A", "选项B", "选项C"], ["选项A", "选项B", "选项C"]),
+    ("date", 5, "2024-05-01T08:30:00Z", 1714552200000),
+    ("checkbox", 7, True, True),
+    ("phone", 13, "13800138000", "13800138000"),
+    ("url", 15, "https://example.com/path?q=1", "https://example.com/path?q=1"),
+]
+_ATTACHMENT_FIELDS = 5  # 附件字段数，ATTACHMENT_COUNT 个附件平均分布
+
+
+def _build_form_fields():
+    """100 个字段的表单配置：5 个附件字段，其余按类型轮流"""
+    form_fields = []
+    for i in range(FIELD_COUNT):
+        if i < _ATTACHMENT_FIELDS:
+            form_fields.append({
+                "field_id": f"fldatt{i:03d}", "field_name": f"附件{i}", "label": f"附件{i}",
+                "type": 17, "input_type": "attachment",
+            })
+            continue
+        input_type, field_type, _, _ = _FIELD_KINDS[i % len(_FIELD_KINDS)]
+        form_fields.append({
+            "field_id": f"fld{input_type}{i:03d}", "field_name": f"字段{i}", "label": f"字段{i}",
+            "type": field_type, "input_type": input_type, "required": i % 3 == 0,
+        })
+    return form_fields
+
+
+FORM_FIELDS = _build_form_fields()
+_KIND_BY_TYPE = {kind[0]: kind for kind in _FIELD_KINDS}
+
+
+@pytest.fixture(scope="module")
+def submit_payload():
+    """表单提交：field_map、field_id_to_name 和 100 个字段的提交值"""
+    field_map = {f["field_id"]: f for f in FORM_FIELDS}
+    field_id_to_name = {f["field_id"]: f["field_name"] for f in FORM_FIELDS}
+    extra_data = {
+        f["field_id"]: _KIND_BY_TYPE[f["input_type"]][2]
+        for f in FORM_FIELDS
+        if f["input_type"] != "attachment"
+    }
+    return extra_data, field_map, field_id_to_name
+
+
+@pytest.fixture(scope="module")
+def record_payload():
+    """记录数据：字段名称为键（与飞书返回一致），附件字段共 50 个附件"""
+    record_fields = {}
+    field_name_to_id_map = {}
+    attachment_index = 0
+    for f in FORM_FIELDS:
+        field_name_to_id_map[f["field_name"]] = f["field_id"]
+        if f["input_type"] == "attachment":
+            attachments = []
+            for _ in range(ATTACHMENT_COUNT // _ATTACHMENT_FIELDS):
+                attachments.append({
+                    "file_token": f"boxcn{attachment_index:06d}",
+                    "name": f"签名{attachment_index}.png",
+                    "url": f"https://open.feishu.cn/open-apis/drive/v1/medias/boxcn{attachment_index:06d}/download",
+                    "type": "image/png",
+                    "size": 20480,
+                })
+                attachment_index += 1
+            record_fields[f["field_name"]] = attachments
+        else:
+            record_fields[f["field_name"]] = _KIND_BY_TYPE[f["input_type"]][3]
+    # 记录中还有表单未配置的字段
+    for i in range(20):
+        record_fields[f"未配置字段{i}"] = "x" * 20
+
+    temp_urls = {
+        f"boxcn{i:06d}": f"https://internal-api-drive-stream.feishu.cn/space/api/box/stream/download/authcode/?code=boxcn{i:06d}"
+        for i in range(ATTACHMENT_COUNT)
+    }
+    return record_fields, field_name_to_id_map, temp_urls
+
+
+def test_convert_submit_fields(benchmark, submit_payload):
+    extra_data, field_map, field_id_to_name = submit_payload
+    fields = benchmark(form_router.convert_submit_fields, extra_data, field_map, field_id_to_name)
+    assert len(fields) == FIELD_COUNT - _ATTACHMENT_FIELDS
+
+
+def test_record_data_conversion(benchmark, record_payload):
+    """get_form_record_data 中 Feishu 调用之外的全部转换"""
+    record_fields, field_name_to_id_map, temp_urls = record_payload
+
+    def convert():
+        resolved = form_router.resolve_record_fields(record_fields, FORM_FIELDS, field_name_to_id_map)
+        form_router.collect_attachment_tokens(resolved)
+        return form_router.convert_record_fields(resolved, temp_urls)
+
+    data = benchmark(convert)
+    assert len(data) == FIELD_COUNT
+    assert sum(len(v) for k, v in data.items() if k.startswith("fldatt")) == ATTACHMENT_COUNT
+
+
+@pytest.fixture(scope="module")
+def payment():
+    client = YunGouOSPayment()
+    client.mch_id = "1234567890"
+    client.key = "0123456789abcdef0123456789abcdef"
+    return client
+
+
+def test_generate_sign_order(benchmark, payment):
+    params = {
+        "out_trade_no": "ORD202405010830001234",
+        "total_fee": "19.90",
+        "mch_id": payment.mch_id,
+        "body": "签名额度套餐-标准版",
+        "attach": json.dumps({"user_key": "ou_xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx::tenant", "plan_id": 2}),
+        "notify_url": "https://example.com/api/payment/notify",
+    }
+    benchmark(payment._generate_sign, params, ["out_trade_no", "total_fee", "mch_id", "body"])
+
+
+def test_generate_sign_notify(benchmark, payment):
+    """支付回调验签：所有非空参数参与签名"""
+    params = {
+        "code": "1",
+        "orderNo": "Y202405010830001234",
+        "outTradeNo": "ORD202405010830001234",
+        "payNo": "2024050122001400000000000000",
+        "money": "19.90",
+        "mchId": payment.mch_id,
+        "payChannel": "alipay",
+        "time": "2024-05-01 08:30:00",
+        "attach": "plan_2",
+        "openId": "2088000000000000",
+        "sign": "0" * 32,
+    }
+    benchmark(payment._generate_sign, params)
+
+
+def test_jwt_encode(benchmark):
+    if auth_jwt.jwt is None:
+        pytest.skip("PyJWT not installed")
+    benchmark(auth_jwt.create_access_token, 12345, "ou_0123456789abcdef0123456789abcdef", "tenant_0123456789")
+
+
+def test_jwt_decode(benchmark):
+    if auth_jwt.jwt is None:
+        pytest.skip("PyJWT not installed")
+    token = auth_jwt.create_access_token(12345, "ou_0123456789abcdef0123456789abcdef", "tenant_0123456789")
+    payload = benchmark(auth_jwt.decode_token, token)
+    assert payload["user_id"] == 12345
+
+
+USER_KEY = "ou_0123456789abcdef0123456789abcdef::tenant_0123456789"
+
+
+@pytest.mark.parametrize("naming", ["legacy_user_db_name", "new_user_db_name"])
+def test_user_db_name_hash(benchmark, naming):
+    benchmark(getattr(user_db_manager, naming), USER_KEY)
+
+
+def test_shard_for_user(benchmark):
+    """一致性哈希环查找（新用户分配分片）"""
+    benchmark(user_db_manager.shard_for_user, USER_KEY)
+
+
+def test_get_user_db_name_cached(benchmark):
+    """已解析过的用户：只走进程内缓存，不查主库"""
+    user_db_manager._db_name_cache[USER_KEY] = (
+        user_db_manager.new_user_db_name(USER_KEY), user_db_manager.DEFAULT_SHARD, float("inf")
+    )
+    try:
+        benchmark(user_db_manager.get_user_db_name, USER_KEY)
+    finally:
+        user_db_manager.forget_user_db_name(USER_KEY)
@@ -0,0 +1,149 @@
+"""
+并发提交基准测试：验证 /api/form/{form_id}/submit 不再阻塞事件循环
+
+在单个进程（单事件循环，相当于一个 uvicorn worker）内并发发起 N 次表单提交，
+飞书接口由带固定延迟的 httpx.MockTransport 模拟，数据库使用临时 SQLite 文件，
+连接池与 database.engine 一致（QueuePool 5 + 10）：并发数超过连接池上限时，
+如果接口在等待飞书期间占用连接，会卡在连接获取上。
+
+- 若提交被串行执行，总耗时 ≈ N × 单次耗时
+- 若异步客户端生效，总耗时 ≈ 单次耗时
+
+执行方式：
+cd backend
+python benchmarks/bench_submit_concurrency.py --concurrency 20 --latency 0.2
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+import httpx  # noqa: E402
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+import feishu_async_client  # noqa: E402
+import feishu_shaper  # noqa: E402
+from database import Base, SignForm, get_db, get_session_factory  # noqa: E402
+from main import app  # noqa: E402
+
+FORM_ID = "benchfrm"
+
+
+def build_fake_feishu(latency: float) -> httpx.MockTransport:
+    """构造模拟飞书接口：每个请求固定延迟 latency 秒"""
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(latency)
+        path = request.url.path
+        if path.endswith("/medias/upload_all"):
+            return httpx.Response(200, json={"code": 0, "data": {"file_token": "boxbench"}})
+        if path.endswith("/records"):
+            return httpx.Response(200, json={"code": 0, "data": {"record": {"record_id": "recbench"}}})
+        return httpx.Response(404, json={"code": 404, "msg": "not found"})
+
+    return httpx.MockTransport(handler)
+
+
+def setup_database():
+    """使用临时 SQLite 文件替代 MySQL，并插入一个测试表单"""
+    path = os.path.join(tempfile.mkdtemp(prefix="bench_submit_"), "shared.db")
+    engine = create_engine(
+        f"sqlite:///{path}",
+        connect_args={"check_same_thread": False, "timeout": 30},
+        pool_size=5,
+        max_overflow=10,
+        pool_timeout=5,  # 比线上（30 秒）短，连接被占满时尽快失败
+    )
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    db = SessionLocal()
+    db.add(SignForm(
+        form_id=FORM_ID,
+        name="benchmark",
+        app_token="bascnbench",
+        table_id="tblbench",
+        signature_field_id="fldsign",
+        extra_fields=json.dumps([
+            {"field_id": "fldname", "field_name": "姓名", "label": "姓名", "type": 1, "input_type": "text"},
+            {"field_id": "fldsign", "field_name": "签名", "label": "签名", "type": 17, "input_type": "attachment"},
+        ], ensure_ascii=False),
+        created_by=None,  # 不扣配额，避免依赖用户库
+        creator_base_token="pt-bench",
+        record_index=0,  # 直接创建新记录
+    ))
+    db.commit()
+    db.close()
+
+    def override_get_db():
+        session = SessionLocal()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_session_factory] = lambda: SessionLocal
+
+
+async def submit_once(client: httpx.AsyncClient) -> float:
+    start = time.perf_counter()
+    resp = await client.post(
+        f"/api/form/{FORM_ID}/submit",
+        data={"form_data": json.dumps({"fldname": "张三"})},
+        files={"attachment_fldsign": ("sign.png", b"\x89PNG" + b"0" * 2048, "image/png")},
+    )
+    resp.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def run(concurrency: int, latency: float):
+    setup_database()
+    # 所有提交共用同一个授权码，关闭本地限速，只测量事件循环并发
+    feishu_shaper.FEISHU_SHAPER_ENABLED = False
+    feishu_async_client._client = httpx.AsyncClient(transport=build_fake_feishu(latency))
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        # 预热
+        await submit_once(client)
+
+        start = time.perf_counter()
+        durations = await asyncio.gather(*[submit_once(client) for _ in range(concurrency)])
+        wall = time.perf_counter() - start
+
+    await feishu_async_client.aclose()
+
+    single = sorted(durations)[len(durations) // 2]
+    serial_estimate = single * concurrency
+    print(f"concurrency          : {concurrency}")
+    print(f"feishu latency/call  : {latency * 1000:.0f} ms (2 calls per submit)")
+    print(f"median submit        : {single * 1000:.1f} ms")
+    print(f"wall time            : {wall * 1000:.1f} ms")
+    print(f"serial estimate      : {serial_estimate * 1000:.1f} ms")
+    print(f"overlap factor       : {serial_estimate / wall:.1f}x")
+    if wall > serial_estimate * 0.5:
+        print("WARNING: submits appear to run sequentially")
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并发提交基准测试")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2, help="模拟飞书接口延迟（秒）")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args.concurrency, args.latency)))
+
+
+if __name__ == "__main__":
+    main()
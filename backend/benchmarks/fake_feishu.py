@@ -0,0 +1,443 @@
+"""
+本地飞书开放平台模拟服务（压测用）
+
+实现本后端用到的飞书接口：
+- POST /open-apis/auth/v3/tenant_access_token/internal
+- POST /open-apis/drive/v1/medias/upload_all、/open-apis/drive/v1/files/upload_all
+- POST /open-apis/drive/v1/{medias,files}/upload_prepare、upload_part、upload_finish
+- GET  /open-apis/drive/v1/medias/batch_get_tmp_download_url
+- GET  /open-apis/drive/v1/medias/{file_token}/download
+- GET  /open-apis/bitable/v1/apps/{app_token}/tables/{table_id}/fields
+- GET/POST /open-apis/bitable/v1/apps/{app_token}/tables/{table_id}/records
+- GET/PUT/DELETE /open-apis/bitable/v1/apps/{app_token}/tables/{table_id}/records/{record_id}
+
+支持可配置的延迟、错误注入（5xx / 指定授权码返回 91403）和频控模拟（按授权码令牌桶，
+超限返回 429 + 99991400 + x-ogw-ratelimit-reset）。数据全部保存在内存中，
+首次访问某张表时自动生成字段和记录。
+
+运行：
+cd backend
+python benchmarks/fake_feishu.py --port 9100 --latency-ms 80 --qps 50
+
+后端指向模拟服务：
+BASE_API_DOMAIN=http://127.0.0.1:9100 FEISHU_API_BASE=http://127.0.0.1:9100 uvicorn main:app
+
+运行期间可通过 GET/POST /__fake__/config 查看或修改配置，GET /__fake__/stats 查看请求统计
+"""
+import os
+import re
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from collections import defaultdict
+from typing import Any, Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+# 1x1 PNG，下载未上传过的 file_token 时返回
+PLACEHOLDER_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c63000100000500010d0a2db40000000049454e44ae426082"
+)
+
+_STATIC_SEGMENT = re.compile(r"^(v\d+|[a-z_-]+)$")
+
+CONFIG: Dict[str, Any] = {
+    "latency_ms": float(os.getenv("FAKE_FEISHU_LATENCY_MS", "50")),  # 每个请求的基础延迟
+    "jitter_ms": float(os.getenv("FAKE_FEISHU_JITTER_MS", "20")),  # 随机抖动上限
+    "error_rate": float(os.getenv("FAKE_FEISHU_ERROR_RATE", "0")),  # 随机返回 500 的比例
+    "qps": float(os.getenv("FAKE_FEISHU_QPS", "0")),  # 每个授权码的 QPS 上限，0 表示不限
+    "burst": float(os.getenv("FAKE_FEISHU_BURST", "10")),
+    "deny_token_prefix": os.getenv("FAKE_FEISHU_DENY_TOKEN_PREFIX", "pt-deny"),  # 该前缀的授权码返回 91403
+    "seed_fields": int(os.getenv("FAKE_FEISHU_SEED_FIELDS", "10")),  # 新表自动生成的文本字段数
+    "seed_records": int(os.getenv("FAKE_FEISHU_SEED_RECORDS", "20")),  # 新表自动生成的记录数
+    "seed_attachments": int(os.getenv("FAKE_FEISHU_SEED_ATTACHMENTS", "2")),  # 每条记录的附件数
+    "block_size": int(os.getenv("FAKE_FEISHU_BLOCK_SIZE", str(4 * 1024 * 1024))),  # 分片上传块大小
+    "max_media_bytes": int(os.getenv("FAKE_FEISHU_MAX_MEDIA_BYTES", str(256 * 1024 * 1024))),  # 内存中保存的媒体上限
+}
+
+app = FastAPI(title="Fake Feishu Open API")
+
+# (app_token, table_id) -> {"fields": [...], "records": {record_id: record}}
+_tables: Dict[tuple, Dict[str, Any]] = {}
+# client_token -> record_id（创建记录幂等）
+_client_tokens: Dict[str, str] = {}
+# file_token -> (content_type, bytes)
+_medias: Dict[str, tuple] = {}
+_media_bytes = 0
+# upload_id -> {"parts": {seq: bytes}, "file_name": ...}
+_uploads: Dict[str, Dict[str, Any]] = {}
+# 授权码 -> [tokens, updated_at]
+_buckets: Dict[str, list] = {}
+_stats: Dict[str, Dict[str, int]] = defaultdict(lambda: {"requests": 0, "errors": 0, "rate_limited": 0, "denied": 0})
+
+
+def _ok(data: Any = None) -> JSONResponse:
+    return JSONResponse({"code": 0, "msg": "success", "data": data if data is not None else {}})
+
+
+def _error(status: int, code: int, msg: str, headers: Optional[Dict[str, str]] = None) -> JSONResponse:
+    return JSONResponse({"code": code, "msg": msg}, status_code=status, headers=headers)
+
+
+def _endpoint(request: Request) -> str:
+    """统计用的接口名（路径中的 token/ID 替换为 *）"""
+    segments = [s if _STATIC_SEGMENT.match(s) else "*" for s in request.url.path.split("/") if s]
+    return f"{request.method} /{'/'.join(segments)}"
+
+
+def _rate_limited(token: str) -> Optional[float]:
+    """按授权码的令牌桶判断是否超限，超限时返回距离下一个令牌的秒数"""
+    qps = CONFIG["qps"]
+    if qps <= 0:
+        return None
+    now = time.monotonic()
+    bucket = _buckets.setdefault(token, [CONFIG["burst"], now])
+    bucket[0] = min(CONFIG["burst"], bucket[0] + (now - bucket[1]) * qps)
+    bucket[1] = now
+    if bucket[0] < 1:
+        return (1 - bucket[0]) / qps
+    bucket[0] -= 1
+    return None
+
+
+@app.middleware("http")
+async def simulate(request: Request, call_next):
+    """统一模拟延迟、频控、鉴权失败和随机错误"""
+    if request.url.path.startswith("/__fake__"):
+        return await call_next(request)
+
+    delay = (CONFIG["latency_ms"] + random.uniform(0, CONFIG["jitter_ms"])) / 1000
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+    stats = _stats[_endpoint(request)]
+    stats["requests"] += 1
+
+    auth = request.headers.get("Authorization", "")
+    token = auth[len("Bearer "):] if auth.startswith("Bearer ") else ""
+
+    if token:
+        reset = _rate_limited(token)
+        if reset is not None:
+            stats["rate_limited"] += 1
+            return _error(429, 99991400, "request trigger frequency limit",
+                          headers={"x-ogw-ratelimit-reset": f"{max(reset, 0.001):.3f}"})
+        if CONFIG["deny_token_prefix"] and token.startswith(CONFIG["deny_token_prefix"]):
+            stats["denied"] += 1
+            return _error(403, 91403, "Forbidden")
+
+    if CONFIG["error_rate"] and random.random() < CONFIG["error_rate"]:
+        stats["errors"] += 1
+        return _error(500, 1, "internal error (injected)")
+
+    return await call_next(request)
+
+
+# ==================== 控制接口 ====================
+
+@app.get("/__fake__/config")
+def get_config():
+    return CONFIG
+
+
+@app.post("/__fake__/config")
+async def update_config(request: Request):
+    """修改配置，如 {"latency_ms": 200, "error_rate": 0.05}"""
+    for key, value in (await request.json()).items():
+        if key in CONFIG:
+            CONFIG[key] = type(CONFIG[key])(value)
+    return CONFIG
+
+
+@app.get("/__fake__/stats")
+def get_stats():
+    return {
+        "endpoints": dict(_stats),
+        "tables": len(_tables),
+        "records": sum(len(t["records"]) for t in _tables.values()),
+        "medias": len(_medias),
+        "media_bytes": _media_bytes,
+    }
+
+
+@app.post("/__fake__/reset")
+def reset():
+    global _media_bytes
+    _tables.clear()
+    _client_tokens.clear()
+    _medias.clear()
+    _uploads.clear()
+    _buckets.clear()
+    _stats.clear()
+    _media_bytes = 0
+    return {"success": True}
+
+
+@app.get("/__fake__/tmp/{file_token}")
+def tmp_download(file_token: str):
+    """batch_get_tmp_download_url 返回的临时链接"""
+    content_type, content = _medias.get(file_token, ("image/png", PLACEHOLDER_PNG))
+    return Response(content, media_type=content_type)
+
+
+# ==================== 鉴权 ====================
+
+@app.post("/open-apis/auth/v3/tenant_access_token/internal")
+async def tenant_access_token(request: Request):
+    body = await request.json()
+    if not body.get("app_id") or not body.get("app_secret"):
+        return _error(400, 10003, "invalid param")
+    return JSONResponse({
+        "code": 0,
+        "msg": "ok",
+        "tenant_access_token": f"t-fake-{uuid.uuid4().hex[:16]}",
+        "expire": 7200,
+    })
+
+
+# ==================== 云空间上传/下载 ====================
+
+def _store_media(content: bytes, content_type: str) -> str:
+    global _media_bytes
+    file_token = f"box{uuid.uuid4().hex[:20]}"
+    if _media_bytes + len(content) <= CONFIG["max_media_bytes"]:
+        _medias[file_token] = (content_type, content)
+        _media_bytes += len(content)
+    return file_token
+
+
+@app.post("/open-apis/drive/v1/{kind}/upload_all")
+async def upload_all(kind: str, request: Request):
+    form = await request.form()
+    upload = form.get("file")
+    if upload is None or not hasattr(upload, "read"):
+        return _error(400, 1061002, "params error: file required")
+    content = await upload.read()
+    if str(len(content)) != str(form.get("size")):
+        return _error(400, 1061002, "params error: size mismatch")
+    if len(content) > 20 * 1024 * 1024:
+        return _error(400, 1061043, "file size exceed limit, use upload_prepare")
+    return _ok({"file_token": _store_media(content, upload.content_type or "application/octet-stream")})
+
+
+@app.post("/open-apis/drive/v1/{kind}/upload_prepare")
+async def upload_prepare(kind: str, request: Request):
+    body = await request.json()
+    size = int(body.get("size") or 0)
+    block_size = CONFIG["block_size"]
+    upload_id = uuid.uuid4().hex
+    _uploads[upload_id] = {"file_name": body.get("file_name"), "size": size, "parts": {}}
+    return _ok({"upload_id": upload_id, "block_size": block_size, "block_num": max((size + block_size - 1) // block_size, 1)})
+
+
+@app.post("/open-apis/drive/v1/{kind}/upload_part")
+async def upload_part(kind: str, request: Request):
+    form = await request.form()
+    upload = _uploads.get(form.get("upload_id"))
+    if upload is None:
+        return _error(400, 1061021, "upload id expire")
+    content = await form.get("file").read()
+    upload["parts"][int(form.get("seq"))] = content
+    return _ok()
+
+
+@app.post("/open-apis/drive/v1/{kind}/upload_finish")
+async def upload_finish(kind: str, request: Request):
+    body = await request.json()
+    upload = _uploads.pop(body.get("upload_id"), None)
+    if upload is None:
+        return _error(400, 1061021, "upload id expire")
+    parts = upload["parts"]
+    if len(parts) != int(body.get("block_num") or 0):
+        return _error(400, 1061002, "params error: block_num mismatch")
+    content = b"".join(parts[seq] for seq in sorted(parts))
+    return _ok({"file_token": _store_media(content, "application/octet-stream")})
+
+
+@app.get("/open-apis/drive/v1/medias/batch_get_tmp_download_url")
+def batch_get_tmp_download_url(request: Request):
+    file_tokens = request.query_params.getlist("file_tokens")
+    if len(file_tokens) > 5:
+        return _error(400, 1061002, "params error: at most 5 file_tokens")
+    base = str(request.base_url).rstrip("/")
+    return _ok({"tmp_download_urls": [
+        {"file_token": t, "tmp_download_url": f"{base}/__fake__/tmp/{t}"} for t in file_tokens
+    ]})
+
+
+@app.get("/open-apis/drive/v1/medias/{file_token}/download")
+def download_media(file_token: str):
+    content_type, content = _medias.get(file_token, ("image/png", PLACEHOLDER_PNG))
+    return Response(content, media_type=content_type)
+
+
+# ==================== 多维表格 ====================
+
+def _get_table(app_token: str, table_id: str) -> Dict[str, Any]:
+    """获取表，首次访问时按配置生成字段和记录"""
+    key = (app_token, table_id)
+    table = _tables.get(key)
+    if table is not None:
+        return table
+
+    fields = [
+        {"field_id": "fldname", "field_name": "姓名", "type": 1},
+        {"field_id": "fldsign", "field_name": "签名", "type": 17},
+    ]
+    for i in range(CONFIG["seed_fields"]):
+        fields.append({"field_id": f"fldtext{i}", "field_name": f"文本{i}", "type": 1})
+
+    records = {}
+    for n in range(CONFIG["seed_records"]):
+        record_id = f"rec{uuid.uuid4().hex[:12]}"
+        record_fields = {"姓名": f"用户{n}"}
+        record_fields["签名"] = [
+            {"file_token": _store_media(PLACEHOLDER_PNG, "image/png"), "name": f"sign_{n}_{a}.png",
+             "size": len(PLACEHOLDER_PNG), "type": "image/png"}
+            for a in range(CONFIG["seed_attachments"])
+        ]
+        for i in range(CONFIG["seed_fields"]):
+            record_fields[f"文本{i}"] = f"值{n}-{i}"
+        records[record_id] = {"record_id": record_id, "fields": record_fields}
+
+    table = {"fields": fields, "records": records}
+    _tables[key] = table
+    return table
+
+
+def _check_fields(table: Dict[str, Any], fields: Dict[str, Any]) -> Optional[JSONResponse]:
+    """校验字段名存在，不存在时返回 FieldNameNotFound"""
+    names = {f["field_name"] for f in table["fields"]}
+    for name in fields:
+        if name not in names:
+            return _error(400, 1254045, f"FieldNameNotFound: {name}")
+    return None
+
+
+def _normalize_fields(fields: Dict[str, Any]) -> Dict[str, Any]:
+    """附件字段写入时只有 file_token，读取时补全 name/size 等信息"""
+    result = {}
+    for name, value in fields.items():
+        if isinstance(value, list) and value and isinstance(value[0], dict) and "file_token" in value[0]:
+            value = [
+                {"file_token": v["file_token"], "name": v.get("name") or f"{v['file_token']}.png",
+                 "size": len(_medias.get(v["file_token"], ("", PLACEHOLDER_PNG))[1]), "type": "image/png"}
+                for v in value
+            ]
+        result[name] = value
+    return result
+
+
+@app.get("/open-apis/bitable/v1/apps/{app_token}/tables/{table_id}/fields")
+def list_fields(app_token: str, table_id: str):
+    items = _get_table(app_token, table_id)["fields"]
+    return _ok({"items": items, "total": len(items), "has_more": False})
+
+
+@app.get("/open-apis/bitable/v1/apps/{app_token}/tables/{table_id}/records")
+def list_records(app_token: str, table_id: str, request: Request):
+    table = _get_table(app_token, table_id)
+    page_size = min(int(request.query_params.get("page_size") or 20), 500)
+    offset = int(request.query_params.get("page_token") or 0)
+    field_names = request.query_params.get("field_names")
+
+    records = list(table["records"].values())
+    page = records[offset:offset + page_size]
+    if field_names:
+        wanted = set(json.loads(field_names))
+        page = [{"record_id": r["record_id"], "fields": {k: v for k, v in r["fields"].items() if k in wanted}}
+                for r in page]
+
+    next_offset = offset + len(page)
+    has_more = next_offset < len(records)
+    return _ok({
+        "items": page,
+        "total": len(records),
+        "has_more": has_more,
+        "page_token": str(next_offset) if has_more else None,
+    })
+
+
+@app.post("/open-apis/bitable/v1/apps/{app_token}/tables/{table_id}/records")
+async def create_record(app_token: str, table_id: str, request: Request):
+    table = _get_table(app_token, table_id)
+    fields = (await request.json()).get("fields") or {}
+
+    client_token = request.query_params.get("client_token")
+    if client_token and client_token in _client_tokens:
+        record = table["records"].get(_client_tokens[client_token])
+        if record:
+            return _ok({"record": record})
+
+    error = _check_fields(table, fields)
+    if error:
+        return error
+
+    record_id = f"rec{uuid.uuid4().hex[:12]}"
+    record = {"record_id": record_id, "fields": _normalize_fields(fields)}
+    table["records"][record_id] = record
+    if client_token:
+        _client_tokens[client_token] = record_id
+    return _ok({"record": record})
+
+
+@app.get("/open-apis/bitable/v1/apps/{app_token}/tables/{table_id}/records/{record_id}")
+def get_record(app_token: str, table_id: str, record_id: str):
+    record = _get_table(app_token, table_id)["records"].get(record_id)
+    if record is None:
+        return _error(400, 1254043, "RecordIdNotFound")
+    return _ok({"record": record})
+
+
+@app.put("/open-apis/bitable/v1/apps/{app_token}/tables/{table_id}/records/{record_id}")
+async def update_record(app_token: str, table_id: str, record_id: str, request: Request):
+    table = _get_table(app_token, table_id)
+    record = table["records"].get(record_id)
+    if record is None:
+        return _error(400, 1254043, "RecordIdNotFound")
+    fields = (await request.json()).get("fields") or {}
+    error = _check_fields(table, fields)
+    if error:
+        return error
+    record["fields"].update(_normalize_fields(fields))
+    return _ok({"record": record})
+
+
+@app.delete("/open-apis/bitable/v1/apps/{app_token}/tables/{table_id}/records/{record_id}")
+def delete_record(app_token: str, table_id: str, record_id: str):
+    record = _get_table(app_token, table_id)["records"].pop(record_id, None)
+    if record is None:
+        return _error(400, 1254043, "RecordIdNotFound")
+    return _ok({"deleted": True, "record_id": record_id})
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="本地飞书开放平台模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=CONFIG["latency_ms"])
+    parser.add_argument("--jitter-ms", type=float, default=CONFIG["jitter_ms"])
+    parser.add_argument("--error-rate", type=float, default=CONFIG["error_rate"])
+    parser.add_argument("--qps", type=float, default=CONFIG["qps"], help="每个授权码的 QPS 上限，0 表示不限")
+    parser.add_argument("--burst", type=float, default=CONFIG["burst"])
+    args = parser.parse_args()
+
+    CONFIG.update({
+        "latency_ms": args.latency_ms,
+        "jitter_ms": args.jitter_ms,
+        "error_rate": args.error_rate,
+        "qps": args.qps,
+        "burst": args.burst,
+    })
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
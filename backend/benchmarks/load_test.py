@@ -0,0 +1,526 @@
+"""
+端到端压测：按真实调用链路驱动 FastAPI 应用，统计各接口延迟分位数和吞吐，并与基线比较
+
+- 应用在本进程内通过 httpx.ASGITransport 调用（相当于一个 uvicorn worker），路由、依赖、
+  数据库访问和飞书客户端（含重试、整形、熔断）都走真实代码
+- 飞书接口默认由本地模拟服务 benchmarks/fake_feishu.py 承接（在后台线程中启动），
+  也可以通过 --feishu-url 指向单独运行的模拟服务
+- 数据库默认使用临时目录下的 SQLite 文件（共享库一个文件，每个用户库一个文件），
+  --db mysql 时使用 .env 中配置的 MySQL
+- 流量组合：
+    plugin: /api/user/init -> /api/quota/status -> /api/sign/upload
+    public: /api/form/{id}/config -> /api/form/{id}/record-data -> /api/form/{id}/submit
+    admin : /admin/users, /admin/forms, /admin/invites, /admin/logs
+- 输出各接口的请求数、错误率、吞吐和 p50/p95/p99；指定基线时，任一接口超出容忍范围则以退出码 1 结束
+
+基线与运行环境强相关，更换机器或调整参数后需要重新录制（--save-baseline）。
+
+注意：并发数远超共享库连接池上限（默认 5 + 10）时，同步接口在线程池中排队等待连接，
+延迟随之上升；异步接口（表单提交、签名上传）只在线程池中用短会话访问数据库，等待飞书期间不占用连接。
+
+执行方式（依赖见 requirements-dev.txt）：
+cd backend
+pip install -r requirements-dev.txt
+python benchmarks/load_test.py --duration 30
+python benchmarks/load_test.py --duration 30 --save-baseline
+python benchmarks/load_test.py --mix plugin=1,public=4,admin=0 --feishu-latency-ms 100
+python benchmarks/load_test.py --db mysql --feishu-url http://127.0.0.1:9100
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import asyncio
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+DEFAULT_BASELINE = os.path.join(CURRENT_DIR, "baselines", "load_test.json")
+DEFAULT_MIX = "plugin=3,public=6,admin=1"
+USER_AGENT = "Mozilla/5.0 (load-test) Feishu"
+SIGN_PNG = b"\x89PNG\r\n\x1a\n" + b"0" * 4096
+FORM_COUNT = 10  # 公开表单数量（每个表单使用不同的授权码和多维表格）
+
+
+# ==================== 统计 ====================
+
+class RouteStats:
+    """按接口汇总延迟和错误"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+
+    def record(self, route: str, elapsed: float, status: Optional[int], ok: bool) -> None:
+        self.latencies[route].append(elapsed)
+        self.statuses[route][status or 0] += 1
+        if not ok:
+            self.errors[route] += 1
+
+    def summary(self, wall: float) -> Dict[str, Dict[str, Any]]:
+        result = {}
+        for route, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            count = len(values)
+            result[route] = {
+                "count": count,
+                "errors": self.errors[route],
+                "error_rate": round(self.errors[route] / count, 4),
+                "throughput_rps": round(count / wall, 2),
+                "p50_ms": round(_percentile(values, 50) * 1000, 2),
+                "p95_ms": round(_percentile(values, 95) * 1000, 2),
+                "p99_ms": round(_percentile(values, 99) * 1000, 2),
+                "statuses": {str(k): v for k, v in sorted(self.statuses[route].items())},
+            }
+        return result
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    """最近秩法分位数"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+# ==================== 环境准备 ====================
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_fake_feishu(args) -> str:
+    """在后台线程启动飞书模拟服务，返回其地址"""
+    import uvicorn
+    import fake_feishu
+
+    fake_feishu.CONFIG.update({
+        "latency_ms": args.feishu_latency_ms,
+        "jitter_ms": args.feishu_jitter_ms,
+        "error_rate": args.feishu_error_rate,
+    })
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(fake_feishu.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.time() + 10
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("fake feishu server failed to start")
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+def configure_environment(args, feishu_url: str) -> None:
+    """在导入后端模块之前设置环境变量（load_dotenv 不会覆盖已存在的变量）"""
+    os.environ["BASE_API_DOMAIN"] = feishu_url
+    os.environ["FEISHU_API_BASE"] = feishu_url
+    os.environ.setdefault("FEISHU_APP_ID", "cli_loadtest")
+    os.environ.setdefault("FEISHU_APP_SECRET", "loadtest-secret")
+    os.environ["FEISHU_TOKEN_STORE"] = "memory"
+    if not args.shaper:
+        os.environ["FEISHU_SHAPER_ENABLED"] = "false"
+
+
+def setup_sqlite(app, workdir: str) -> None:
+    """共享库和用户库都替换为 SQLite 文件"""
+    from sqlalchemy import create_engine, event, text
+    from sqlalchemy.orm import sessionmaker
+
+    import user_db_manager
+    from database import Base, UserBase, get_db, get_session_factory
+
+    def _sqlite_engine(path: str):
+        # 连接池保持默认（QueuePool 5 + 10），与 database.engine 一致
+        engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False, "timeout": 30})
+
+        @event.listens_for(engine, "connect")
+        def _pragmas(dbapi_conn, _):
+            cursor = dbapi_conn.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.close()
+
+        return engine
+
+    shared_engine = _sqlite_engine(os.path.join(workdir, "shared.db"))
+    Base.metadata.create_all(bind=shared_engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=shared_engine)
+
+    def override_get_db():
+        session = SessionLocal()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_session_factory] = lambda: SessionLocal
+
+    engines: Dict[str, Any] = {}
+    lock = threading.Lock()
+
+    def get_user_engine(user_key: str):
+        with lock:
+            engine = engines.get(user_key)
+            if engine is None:
+                path = os.path.join(workdir, f"{user_db_manager.get_user_db_name(user_key)}.db")
+                engine = _sqlite_engine(path)
+                UserBase.metadata.create_all(bind=engine)
+                engines[user_key] = engine
+            return engine
+
+    # 主库也换成 SQLite 文件（只建 ensure_user_database 启动时加载的 user_databases 表），不连接 MySQL
+    master_engine = _sqlite_engine(os.path.join(workdir, "master.db"))
+    with master_engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE user_databases (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_key VARCHAR(256) UNIQUE NOT NULL,
+                open_id VARCHAR(128) NOT NULL,
+                tenant_key VARCHAR(128) NOT NULL,
+                db_name VARCHAR(64) NOT NULL,
+                db_host VARCHAR(64),
+                db_created BOOLEAN DEFAULT FALSE,
+                created_at DATETIME,
+                last_active_at DATETIME
+            )
+        """))
+    user_db_manager._master_engine = master_engine
+
+    # 库名登记使用 MySQL 专有语法（ON DUPLICATE KEY UPDATE），库名直接按新规则计算
+    user_db_manager.get_user_db_name = user_db_manager.new_user_db_name
+    user_db_manager.get_user_engine = get_user_engine
+    user_db_manager.create_user_database = lambda user_key: get_user_engine(user_key) is not None
+
+    app.state.loadtest_session = SessionLocal
+
+
+def setup_mysql(app) -> None:
+    """使用 .env 配置的 MySQL（需要已经可以连接）"""
+    import user_db_manager
+    from database import SessionLocal, init_db
+
+    init_db()
+    user_db_manager.init_master_database()
+    app.state.loadtest_session = SessionLocal
+
+
+def seed_forms(app, run_id: str) -> List[str]:
+    """创建公开表单：记录条 1 已存在，启用显示数据"""
+    from database import SignForm
+
+    extra_fields = json.dumps([
+        {"field_id": "fldname", "field_name": "姓名", "label": "姓名", "type": 1, "input_type": "text"},
+        {"field_id": "fldsign", "field_name": "签名", "label": "签名", "type": 17, "input_type": "attachment"},
+    ], ensure_ascii=False)
+
+    form_ids = []
+    db = app.state.loadtest_session()
+    try:
+        for i in range(FORM_COUNT):
+            form_id = f"lt{run_id[:8]}{i:02d}"
+            db.add(SignForm(
+                form_id=form_id,
+                name=f"load test {i}",
+                app_token=f"bascnload{i:02d}",
+                table_id="tblload",
+                signature_field_id="fldsign",
+                extra_fields=extra_fields,
+                created_by=None,  # 不扣创建者配额
+                creator_base_token=f"pt-load-form-{i:02d}",
+                record_index=1,
+                show_data=True,
+            ))
+            form_ids.append(form_id)
+        db.commit()
+    finally:
+        db.close()
+    return form_ids
+
+
+# ==================== 场景 ====================
+
+class LoadContext:
+    def __init__(self, client, stats: RouteStats, form_ids: List[str], admin_password: str, run_id: str):
+        self.client = client
+        self.stats = stats
+        self.form_ids = form_ids
+        self.admin_password = admin_password
+        self.run_id = run_id
+
+
+async def _call(ctx: LoadContext, route: str, method: str, url: str, **kwargs):
+    """发起请求并记录耗时；非 2xx 或异常计为错误，返回响应（错误时返回 None）"""
+    start = time.perf_counter()
+    try:
+        resp = await ctx.client.request(method, url, **kwargs)
+    except Exception:
+        ctx.stats.record(route, time.perf_counter() - start, None, False)
+        return None
+    ok = 200 <= resp.status_code < 300
+    ctx.stats.record(route, time.perf_counter() - start, resp.status_code, ok)
+    return resp if ok else None
+
+
+async def plugin_flow(ctx: LoadContext, n: int) -> None:
+    """插件用户：初始化 -> 查询配额 -> 上传签名（每次迭代使用新用户，避免初始化限流）"""
+    # 初始化限流按 user_id 前 16 位计，序号放在前面保证不同用户互不影响
+    user_id = f"ou_{n}_{ctx.run_id[:12]}"
+    resp = await _call(
+        ctx, "POST /api/user/init", "POST", "/api/user/init",
+        json={"feishu_user_id": user_id, "tenant_key": "tenant_load", "fingerprint": f"fp-{n}"},
+        headers={"User-Agent": USER_AGENT},
+    )
+    if resp is None:
+        return
+
+    headers = {"Authorization": f"Bearer {resp.json()['token']}", "User-Agent": USER_AGENT}
+    await _call(ctx, "GET /api/quota/status", "GET", "/api/quota/status", headers=headers)
+    await _call(
+        ctx, "POST /api/sign/upload", "POST", "/api/sign/upload",
+        headers={**headers, "X-Base-Token": f"pt-load-user-{n}"},
+        data={"file_name": "sign.png", "folder_token": "fldcnload", "has_quota": "0"},
+        files={"file": ("sign.png", SIGN_PNG, "image/png")},
+    )
+
+
+async def public_flow(ctx: LoadContext, n: int) -> None:
+    """外部表单：加载配置 -> 加载预填充数据 -> 提交签名"""
+    form_id = ctx.form_ids[n % len(ctx.form_ids)]
+    await _call(ctx, "GET /api/form/{id}/config", "GET", f"/api/form/{form_id}/config")
+    await _call(ctx, "GET /api/form/{id}/record-data", "GET", f"/api/form/{form_id}/record-data")
+    await _call(
+        ctx, "POST /api/form/{id}/submit", "POST", f"/api/form/{form_id}/submit",
+        data={"form_data": json.dumps({"fldname": f"签名人{n}"}, ensure_ascii=False)},
+        files={"attachment_fldsign": ("sign.png", SIGN_PNG, "image/png")},
+    )
+
+
+async def admin_flow(ctx: LoadContext, n: int) -> None:
+    """管理后台：浏览各列表页"""
+    headers = {"X-Admin-Token": ctx.admin_password}
+    for path in ("/admin/users", "/admin/forms", "/admin/invites", "/admin/logs"):
+        await _call(ctx, f"GET {path}", "GET", path, params={"page": 1, "page_size": 20}, headers=headers)
+
+
+SCENARIOS = {
+    "plugin": plugin_flow,
+    "public": public_flow,
+    "admin": admin_flow,
+}
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """解析流量组合，如 plugin=3,public=6,admin=1"""
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario: {name}")
+        mix[name] = float(weight or 1)
+    if not any(w > 0 for w in mix.values()):
+        raise argparse.ArgumentTypeError("mix must contain a positive weight")
+    return mix
+
+
+async def run_load(ctx: LoadContext, mix: Dict[str, float], concurrency: int, duration: float,
+                   iterations: int, seed: int) -> float:
+    """并发执行场景，直到达到时长或迭代次数，返回实际耗时"""
+    names = [name for name, w in mix.items() if w > 0]
+    weights = [mix[name] for name in names]
+    rng = random.Random(seed)
+    counter = iter(range(iterations if iterations else sys.maxsize))
+    deadline = time.perf_counter() + duration if not iterations else None
+
+    async def worker():
+        while True:
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            n = next(counter, None)
+            if n is None:
+                return
+            await SCENARIOS[rng.choices(names, weights)[0]](ctx, n)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return time.perf_counter() - start
+
+
+# ==================== 基线比较 ====================
+
+def compare_with_baseline(results: Dict[str, Any], baseline: Dict[str, Any], args) -> List[str]:
+    """返回回退项列表（为空表示通过）"""
+    regressions = []
+    for key in ("mix", "concurrency", "db", "feishu_latency_ms"):
+        if baseline["meta"].get(key) != results["meta"].get(key):
+            print(f"WARNING: baseline {key}={baseline['meta'].get(key)!r} differs from this run ({results['meta'].get(key)!r})")
+
+    for route, base in baseline["routes"].items():
+        current = results["routes"].get(route)
+        if current is None:
+            regressions.append(f"{route}: not exercised in this run")
+            continue
+        metrics = [("p95_ms", args.latency_tolerance)]
+        # 样本太少时 p99 基本就是最大值，波动很大，不参与比较
+        if min(base["count"], current["count"]) >= args.p99_min_samples:
+            metrics.append(("p99_ms", args.p99_tolerance))
+        for metric, tolerance in metrics:
+            limit = base[metric] * (1 + tolerance) + args.min_latency_delta_ms
+            if current[metric] > limit:
+                regressions.append(f"{route}: {metric} {current[metric]:.1f} > {limit:.1f} (baseline {base[metric]:.1f})")
+        limit = base["throughput_rps"] * (1 - args.throughput_tolerance)
+        if current["throughput_rps"] < limit:
+            regressions.append(
+                f"{route}: throughput {current['throughput_rps']:.2f} rps < {limit:.2f} (baseline {base['throughput_rps']:.2f})"
+            )
+        limit = base["error_rate"] + args.error_rate_tolerance
+        if current["error_rate"] > limit:
+            regressions.append(f"{route}: error_rate {current['error_rate']:.2%} > {limit:.2%} (baseline {base['error_rate']:.2%})")
+    return regressions
+
+
+def print_report(results: Dict[str, Any]) -> None:
+    meta = results["meta"]
+    print(f"db={meta['db']} feishu_latency={meta['feishu_latency_ms']}ms concurrency={meta['concurrency']} "
+          f"mix={meta['mix']} wall={meta['wall_s']}s")
+    print(f"{'route':<36} {'count':>7} {'err%':>6} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for route, r in results["routes"].items():
+        print(f"{route:<36} {r['count']:>7} {r['error_rate'] * 100:>5.1f}% {r['throughput_rps']:>8.2f} "
+              f"{r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f}")
+
+
+# ==================== 入口 ====================
+
+async def run(args) -> int:
+    import httpx
+
+    # 逐请求日志会显著拖慢压测，只保留警告
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    feishu_url = args.feishu_url or start_fake_feishu(args)
+    configure_environment(args, feishu_url)
+
+    import feishu_async_client
+    from admin_router import get_admin_password
+    from main import app
+
+    workdir = tempfile.mkdtemp(prefix="feishu-loadtest-")
+    if args.db == "sqlite":
+        setup_sqlite(app, workdir)
+    else:
+        setup_mysql(app)
+
+    run_id = uuid.uuid4().hex
+    form_ids = seed_forms(app, run_id)
+    stats = RouteStats()
+
+    # form_router.log_to_file 写到当前目录下的 debug.log，压测期间切到临时目录，避免在仓库里留下日志文件
+    original_cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=60) as client:
+            ctx = LoadContext(client, stats, form_ids, get_admin_password(), run_id)
+            if args.warmup:
+                # 预热：每个场景各跑若干次，不计入统计
+                ctx.stats = RouteStats()
+                n = 0
+                for _ in range(args.warmup):
+                    for name in args.mix:
+                        n -= 1
+                        await SCENARIOS[name](ctx, n)
+                ctx.stats = stats
+            wall = await run_load(ctx, args.mix, args.concurrency, args.duration, args.iterations, args.seed)
+        await feishu_async_client.aclose()
+    finally:
+        os.chdir(original_cwd)
+
+    results = {
+        "meta": {
+            "db": args.db,
+            "feishu_latency_ms": args.feishu_latency_ms if not args.feishu_url else None,
+            "concurrency": args.concurrency,
+            "mix": ",".join(f"{k}={v:g}" for k, v in args.mix.items()),
+            "wall_s": round(wall, 2),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "routes": stats.summary(wall),
+    }
+    print_report(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save-baseline to record one")
+        return 0
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare_with_baseline(results, baseline, args)
+    if regressions:
+        print("PERFORMANCE REGRESSION:")
+        for item in regressions:
+            print(f"  - {item}")
+        return 1
+    print("OK: within baseline thresholds")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端压测与性能回退检查")
+    parser.add_argument("--db", choices=["sqlite", "mysql"], default="sqlite")
+    parser.add_argument("--feishu-url", default=None, help="外部飞书模拟服务地址，默认在进程内启动")
+    parser.add_argument("--feishu-latency-ms", type=float, default=50.0)
+    parser.add_argument("--feishu-jitter-ms", type=float, default=20.0)
+    parser.add_argument("--feishu-error-rate", type=float, default=0.0)
+    parser.add_argument("--shaper", action="store_true", help="启用飞书请求整形（默认关闭，只测量应用本身）")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=30.0, help="压测时长（秒）")
+    parser.add_argument("--iterations", type=int, default=0, help="固定迭代次数（优先于 --duration）")
+    parser.add_argument("--warmup", type=int, default=2, help="每个场景的预热次数")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=None, help="结果 JSON 输出路径")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为基线")
+    parser.add_argument("--latency-tolerance", type=float, default=0.3, help="p95 允许上升的比例")
+    parser.add_argument("--p99-tolerance", type=float, default=0.5, help="p99 允许上升的比例")
+    parser.add_argument("--p99-min-samples", type=int, default=200, help="样本数不少于该值时才比较 p99")
+    parser.add_argument("--min-latency-delta-ms", type=float, default=5.0, help="忽略小于该值的延迟波动")
+    parser.add_argument("--throughput-tolerance", type=float, default=0.2, help="吞吐允许下降的比例")
+    parser.add_argument("--error-rate-tolerance", type=float, default=0.01, help="错误率允许上升的绝对值")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
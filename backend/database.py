@@ -40,11 +40,12 @@ Base = declarative_base()
 # 这些模型用于用户独立数据库，不包含 user_key 字段（因为整个库属于单个用户）
 UserBase = declarative_base()
 
+# 主库 feishu_master 中由 user_db_manager 建表（DDL 见 user_db_manager）的模型
+MasterBase = declarative_base()
 
-class UserProfile(UserBase):
-    """用户配置表（用户库专用，每个用户库一条记录）"""
-    __tablename__ = "user_profile"
-    
+
+class UserProfileColumns:
+    """用户配置字段（UserProfile 与 ConsolidatedUserProfile 共用）"""
     id = Column(Integer, primary_key=True, autoincrement=True)
     open_id = Column(String(128), nullable=False)
     tenant_key = Column(String(128), nullable=False)
@@ -71,6 +72,22 @@ class UserProfile(UserBase):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
 
+class UserProfile(UserProfileColumns, UserBase):
+    """用户配置表（用户库专用，每个用户库一条记录）"""
+    __tablename__ = "user_profile"
+
+
+class ConsolidatedUserProfile(UserProfileColumns, MasterBase):
+    """
+    用户配置表（consolidated 模式，主库 user_profiles，所有用户共用一张表，按 user_key 区分）
+
+    按 user_key 分区，主键为 (id, user_key)；使用哪个模型由 user_db_manager.get_profile_model() 决定
+    """
+    __tablename__ = "user_profiles"
+    
+    user_key = Column(String(256), primary_key=True, nullable=False)
+
+
 class UserInviteCode(UserBase):
     """邀请码表（用户库专用）"""
     __tablename__ = "invite_codes"
@@ -320,6 +337,15 @@ def get_db():
         db.close()
 
 
+def get_session_factory():
+    """
+    获取会话工厂（FastAPI 依赖注入用）
+
+    异步接口在等待飞书期间不应占用数据库连接：用工厂按需开短会话，并放到线程池中执行
+    """
+    return SessionLocal
+
+
 def init_db():
     """初始化数据库（创建表）"""
     Base.metadata.create_all(bind=engine)
@@ -0,0 +1,339 @@
+"""
+飞书异步 HTTP 客户端模块
+- 基于 httpx.AsyncClient 的共享连接池，供 async 路由使用，避免阻塞事件循环
+- 提供与 form_router 中同步辅助函数一一对应的异步版本
+- 连接池大小和超时复用 feishu_client 的配置，重试、限速和熔断策略与同步客户端一致（feishu_retry / feishu_shaper / feishu_breaker）
+"""
+import json
+import uuid
+import asyncio
+import logging
+from typing import Optional, Any, List, AsyncIterator
+
+import httpx
+
+import auth_service
+import feishu_cache
+import feishu_client
+import feishu_breaker
+import feishu_retry
+import feishu_shaper
+
+logger = logging.getLogger(__name__)
+
+# 飞书记录列表接口单页最大条数
+MAX_PAGE_SIZE = 500
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _to_httpx_timeout(timeout: Any) -> httpx.Timeout:
+    """将 requests 风格的超时（秒或 (connect, read) 元组）转换为 httpx.Timeout"""
+    if timeout is None:
+        timeout = feishu_client.DEFAULT_TIMEOUT
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        return httpx.Timeout(read, connect=connect)
+    return httpx.Timeout(timeout)
+
+
+def get_client() -> httpx.AsyncClient:
+    """获取共享的 AsyncClient（首次调用时创建）"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=None,
+                max_keepalive_connections=feishu_client.FEISHU_HTTP_POOL_MAXSIZE,
+            ),
+            timeout=_to_httpx_timeout(feishu_client.DEFAULT_TIMEOUT),
+        )
+        logger.info("Created async Feishu HTTP client")
+    return _client
+
+
+async def aclose() -> None:
+    """关闭共享的 AsyncClient（应用关闭时调用）"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def request(method: str, url: str, timeout: Any = None, idempotent: Optional[bool] = None, **kwargs) -> httpx.Response:
+    """
+    通过共享连接池发送异步请求（幂等请求遇到临时错误时按 feishu_retry 策略自动重试）
+
+    Args:
+        method: HTTP 方法
+        url: 请求地址
+        timeout: 超时（秒或 (connect, read) 元组），为空时使用默认超时
+        idempotent: 是否允许自动重试，为空时按 HTTP 方法判断（POST 默认不重试）
+        **kwargs: 透传给 httpx.AsyncClient.request
+
+    Returns:
+        httpx.Response
+    """
+    client = get_client()
+    retryable = feishu_retry.is_idempotent(method, idempotent)
+    endpoint = feishu_retry.endpoint_key(method, url)
+    feishu_retry.get_budget(endpoint).record_request()
+
+    attempt = 0
+    while True:
+        breaker = feishu_breaker.before_request(url, kwargs.get("headers"))
+        await feishu_shaper.wait_async(url, kwargs.get("headers"), kwargs.get("data"))
+        try:
+            resp = await client.request(method, url, timeout=_to_httpx_timeout(timeout), **kwargs)
+        except httpx.TransportError as e:
+            feishu_breaker.record_result(breaker, None)
+            attempt += 1
+            if not retryable or not feishu_retry.should_retry(endpoint, attempt):
+                raise
+            delay = feishu_retry.compute_delay(attempt - 1)
+            logger.warning(f"{endpoint} failed ({e!r}), retry {attempt} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            continue
+        except Exception:
+            feishu_breaker.record_result(breaker, None)
+            raise
+
+        body = feishu_retry.response_body(resp) if retryable or breaker else None
+        transient = feishu_retry.is_retryable_response(resp.status_code, body)
+        feishu_breaker.record_response(breaker, resp.status_code, body, transient)
+
+        if retryable and transient:
+            attempt += 1
+            if feishu_retry.should_retry(endpoint, attempt):
+                delay = feishu_retry.compute_delay(attempt - 1, resp.headers)
+                logger.warning(f"{endpoint} returned retryable error (status={resp.status_code}), retry {attempt} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+        return resp
+
+
+async def get(url: str, **kwargs) -> httpx.Response:
+    """GET 请求"""
+    return await request("GET", url, **kwargs)
+
+
+async def post(url: str, **kwargs) -> httpx.Response:
+    """POST 请求"""
+    return await request("POST", url, **kwargs)
+
+
+async def put(url: str, **kwargs) -> httpx.Response:
+    """PUT 请求"""
+    return await request("PUT", url, **kwargs)
+
+
+async def open_stream(url: str, headers: dict, timeout: Any = None) -> httpx.Response:
+    """
+    以流式方式发起 GET 请求
+
+    调用方负责在读取完毕后调用 response.aclose()
+    """
+    breaker = feishu_breaker.before_request(url, headers)
+    await feishu_shaper.wait_async(url, headers)
+    client = get_client()
+    req = client.build_request("GET", url, headers=headers, timeout=_to_httpx_timeout(timeout))
+    try:
+        resp = await client.send(req, stream=True)
+    except Exception:
+        feishu_breaker.record_result(breaker, None)
+        raise
+    # 流式响应不读取响应体，只按状态码判断
+    feishu_breaker.record_response(breaker, resp.status_code, None, resp.status_code in feishu_retry.RETRYABLE_STATUS)
+    return resp
+
+
+# ==================== 多维表格辅助函数（异步版） ====================
+
+async def upload_to_bitable(app_token: str, file_data: bytes, file_name: str, base_token: str) -> str:
+    """上传文件到多维表格并返回 file_token"""
+    url = auth_service.get_base_api_url("/open-apis/drive/v1/medias/upload_all")
+
+    headers = auth_service.get_base_authorization_header(base_token)
+
+    files = {
+        "file": (file_name, file_data, "image/png")
+    }
+
+    data = {
+        "file_name": file_name,
+        "parent_type": "bitable_file",
+        "parent_node": app_token,
+        "size": str(len(file_data))
+    }
+
+    resp = await post(url, headers=headers, files=files, data=data, timeout=feishu_client.UPLOAD_TIMEOUT)
+    result = resp.json()
+
+    if result.get("code") != 0:
+        error_code = result.get("code")
+        error_msg = result.get("msg", "")
+        if error_code == 1061004 or "forbidden" in error_msg.lower():
+            raise PermissionError(f"上传文件权限不足 (1061004): {result}")
+        raise Exception(f"上传文件失败: {result}")
+
+    return result["data"]["file_token"]
+
+
+async def create_bitable_record(app_token: str, table_id: str, fields: dict, base_token: str) -> str:
+    """在多维表格中创建记录"""
+    url = auth_service.get_base_api_url(f"/open-apis/bitable/v1/apps/{app_token}/tables/{table_id}/records")
+
+    headers = auth_service.get_base_authorization_header(base_token)
+    headers["Content-Type"] = "application/json"
+
+    # client_token 保证重复提交只创建一条记录，因此可以安全重试
+    params = {"client_token": str(uuid.uuid4())}
+    resp = await post(url, headers=headers, json={"fields": fields}, params=params, idempotent=True)
+    result = resp.json()
+
+    if result.get("code") != 0:
+        if feishu_cache.is_field_not_found_error(result):
+            feishu_cache.invalidate_table_schema(app_token, table_id)
+        raise Exception(f"创建记录失败: {result}")
+
+    feishu_cache.invalidate_record_count(app_token, table_id)
+
+    return result["data"]["record"]["record_id"]
+
+
+async def update_bitable_record(app_token: str, table_id: str, record_id: str, fields: dict, base_token: str) -> str:
+    """更新多维表格中的记录"""
+    url = auth_service.get_base_api_url(f"/open-apis/bitable/v1/apps/{app_token}/tables/{table_id}/records/{record_id}")
+
+    headers = auth_service.get_base_authorization_header(base_token)
+    headers["Content-Type"] = "application/json"
+
+    resp = await put(url, headers=headers, json={"fields": fields})
+    result = resp.json()
+
+    if result.get("code") != 0:
+        if feishu_cache.is_field_not_found_error(result):
+            feishu_cache.invalidate_table_schema(app_token, table_id)
+        raise Exception(f"更新记录失败: {result}")
+
+    return result["data"]["record"]["record_id"]
+
+
+async def aiter_bitable_records(
+    app_token: str,
+    table_id: str,
+    base_token: str,
+    page_size: int = MAX_PAGE_SIZE,
+    field_names: Optional[List[str]] = None,
+    limit: Optional[int] = None,
+) -> AsyncIterator[dict]:
+    """
+    逐页遍历多维表格记录（异步生成器，内存中只保留当前页）
+
+    Args:
+        page_size: 每页条数（最大 500）
+        field_names: 只返回指定字段（字段名列表），为空时返回全部字段
+        limit: 最多返回的记录条数，达到后不再请求后续页
+    """
+    url = auth_service.get_base_api_url(f"/open-apis/bitable/v1/apps/{app_token}/tables/{table_id}/records")
+
+    headers = auth_service.get_base_authorization_header(base_token)
+
+    yielded = 0
+    page_token = None
+
+    while limit is None or yielded < limit:
+        params = {"page_size": page_size if limit is None else min(page_size, limit - yielded)}
+        if page_token:
+            params["page_token"] = page_token
+        if field_names is not None:
+            params["field_names"] = json.dumps(field_names, ensure_ascii=False)
+
+        resp = await get(url, headers=headers, params=params)
+        result = resp.json()
+
+        if result.get("code") != 0:
+            raise Exception(f"获取记录列表失败: {result}")
+
+        data = result.get("data", {})
+        records = data.get("items") or []
+        for record in records:
+            yield record
+        yielded += len(records)
+
+        # 检查是否还有下一页
+        page_token = data.get("page_token")
+        if not page_token or not records:
+            break
+
+
+async def get_bitable_records(app_token: str, table_id: str, base_token: str, page_size: int = MAX_PAGE_SIZE) -> list:
+    """获取多维表格中的所有记录"""
+    return [record async for record in aiter_bitable_records(app_token, table_id, base_token, page_size=page_size)]
+
+
+async def get_bitable_record_by_index(app_token: str, table_id: str, record_index: int, base_token: str) -> Optional[str]:
+    """
+    根据记录条索引获取对应的记录ID
+    record_index: 1表示第一条记录，2表示第二条，以此类推
+    返回: 记录ID，如果不存在则返回None
+    """
+    if record_index <= 0:
+        return None
+
+    try:
+        # 逐页翻到目标索引所在的页即停止，不再拉取整张表
+        position = 0
+        async for record in aiter_bitable_records(app_token, table_id, base_token, limit=record_index):
+            position += 1
+            if position == record_index:
+                return record.get("record_id")
+        return None
+    except Exception as e:
+        logger.warning(f"[get_bitable_record_by_index] Error: {e}")
+        return None
+
+
+async def get_table_fields(app_token: str, table_id: str, base_token: str) -> list:
+    """获取多维表格字段列表"""
+    url = auth_service.get_base_api_url(f"/open-apis/bitable/v1/apps/{app_token}/tables/{table_id}/fields")
+    headers = auth_service.get_base_authorization_header(base_token)
+
+    resp = await get(url, headers=headers, params={"page_size": 100})
+    result = resp.json()
+
+    if result.get("code") != 0:
+        raise Exception(f"获取字段列表失败: {result}")
+
+    return result["data"]["items"]
+
+
+async def get_table_fields_cached(app_token: str, table_id: str, base_token: str) -> list:
+    """获取多维表格字段列表（优先读取表结构缓存）"""
+    fields = feishu_cache.get_cached_table_fields(app_token, table_id, base_token)
+    if fields is None:
+        fields = await get_table_fields(app_token, table_id, base_token)
+        feishu_cache.set_cached_table_fields(app_token, table_id, base_token, fields)
+    return fields
+
+
+async def get_temp_download_url(file_token: str, base_token: str) -> Optional[str]:
+    """
+    获取飞书文件的临时下载链接（下载接口 302 跳转的地址，不缓存）
+    返回: 临时下载URL（短期有效，有效期以飞书为准，不要长期保存），失败返回None
+    """
+    try:
+        url = auth_service.get_open_api_url(f"/open-apis/drive/v1/medias/{file_token}/download")
+        headers = auth_service.get_base_authorization_header(base_token)
+
+        resp = await get(url, headers=headers, follow_redirects=False, timeout=5)
+
+        # 如果返回302重定向，说明有临时链接
+        if resp.status_code == 302:
+            return resp.headers.get('Location')
+
+        return None
+
+    except Exception as e:
+        logger.warning(f"[get_temp_download_url] Error: {e}")
+        return None
@@ -5,10 +5,16 @@ Handles tenant_access_token management for server-to-server API calls.
 import os
 import time
 import logging
+from threading import Lock
 from typing import Optional, Dict, Any
 import requests
 from fastapi import HTTPException
+from dotenv import load_dotenv
 
+import feishu_client
+from token_store import TokenStore, create_token_store
+
+load_dotenv()
 logger = logging.getLogger(__name__)
 
 # 从环境变量获取飞书应用凭证
@@ -22,6 +28,11 @@ class FeishuAuthService:
         "tenant_access_token": "",
         "expire": 0,
     }
+    # 进程内刷新锁（single-flight）
+    _refresh_lock = Lock()
+    # 跨 worker 共享的令牌存储
+    _store: Optional[TokenStore] = None
+    _stats = {"refreshes": 0, "store_hits": 0}
 
     def __new__(cls):
         if cls._instance is None:
@@ -33,18 +44,66 @@ class FeishuAuthService:
         return cls._instance
 
     def get_tenant_access_token(self) -> str:
-        """获取有效的 tenant_access_token，自动处理刷新"""
+        """
+        获取有效的 tenant_access_token，自动处理刷新
+
+        - 进程内：持锁刷新（single-flight），并发请求只触发一次刷新
+        - 跨 worker：先读共享令牌存储，持存储锁刷新，其他 worker 直接复用
+        """
         if not FEISHU_APP_ID or not FEISHU_APP_SECRET:
             raise RuntimeError("飞书应用凭证未配置，无法获取tenant_access_token。多维表格插件请使用用户的PersonalBaseToken。")
         
-        now = int(time.time())
-        
         # 如果 token 未过期，直接返回缓存的 token
-        if self._token_info["expire"] > now + 60:  # 提前1分钟刷新
+        if self._is_valid(self._token_info):
             return self._token_info["tenant_access_token"]
         
-        # 否则获取新 token
-        return self._refresh_tenant_access_token()
+        with self._refresh_lock:
+            # 等锁期间可能已被其他线程刷新
+            if self._is_valid(self._token_info):
+                return self._token_info["tenant_access_token"]
+            
+            store = self._get_store()
+            key = f"tenant_access_token:{FEISHU_APP_ID}"
+            
+            # 其他 worker 可能已刷新并写入共享存储
+            token_info = store.get(key)
+            if self._is_valid(token_info):
+                self._stats["store_hits"] += 1
+                self._token_info = token_info
+                return token_info["tenant_access_token"]
+            
+            with store.lock(key):
+                token_info = store.get(key)
+                if self._is_valid(token_info):
+                    self._stats["store_hits"] += 1
+                    self._token_info = token_info
+                    return token_info["tenant_access_token"]
+                
+                # 否则获取新 token 并写入共享存储
+                token = self._refresh_tenant_access_token()
+                store.set(key, self._token_info)
+                return token
+
+    @staticmethod
+    def _is_valid(token_info: Optional[Dict[str, Any]]) -> bool:
+        """token 存在且距离过期超过 1 分钟"""
+        if not token_info or not token_info.get("tenant_access_token"):
+            return False
+        return token_info.get("expire", 0) > int(time.time()) + 60  # 提前1分钟刷新
+
+    def _get_store(self) -> TokenStore:
+        """共享令牌存储（首次使用时创建）"""
+        if self._store is None:
+            self._store = create_token_store()
+        return self._store
+
+    def get_stats(self) -> Dict[str, Any]:
+        """令牌刷新统计"""
+        return {
+            **self._stats,
+            "store": self._store.name if self._store is not None else None,
+            "expires_in": max(self._token_info.get("expire", 0) - int(time.time()), 0),
+        }
 
     def _refresh_tenant_access_token(self) -> str:
         """从飞书服务器获取新的 tenant_access_token"""
@@ -56,7 +115,8 @@ class FeishuAuthService:
         }
         
         try:
-            response = requests.post(url, headers=headers, json=data, timeout=10)
+            # 获取 token 不产生副作用，允许自动重试
+            response = feishu_client.post(url, headers=headers, json=data, timeout=10, idempotent=True)
             response.raise_for_status()
             result = response.json()
             
@@ -72,6 +132,7 @@ class FeishuAuthService:
                 "expire": int(time.time()) + result["expire"] - 300,
             }
             
+            self._stats["refreshes"] += 1
             logger.info("Refreshed tenant_access_token")
             return self._token_info["tenant_access_token"]
             
@@ -0,0 +1,228 @@
+"""
+飞书接口熔断模块
+- 按 (授权码, 接口类别) 维护熔断器，连续出现鉴权/权限错误（401/403/91403/1061004 等）后打开
+- 熔断打开期间直接抛出 CircuitOpenError（PermissionError 子类），不再请求飞书，沿用现有的权限错误处理
+- 打开一段时间后进入半开状态，只放行一个探测请求：成功则关闭，失败则重新打开
+- 网络错误、5xx 等与授权无关的失败不计入熔断
+"""
+import os
+import time
+import logging
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Iterable, Mapping, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# 连续鉴权失败多少次后打开熔断
+FEISHU_BREAKER_FAILURE_THRESHOLD = int(os.getenv("FEISHU_BREAKER_FAILURE_THRESHOLD", "3"))
+# 熔断打开后多久进入半开状态放行探测请求（秒）
+FEISHU_BREAKER_OPEN_SECONDS = float(os.getenv("FEISHU_BREAKER_OPEN_SECONDS", "60"))
+# 最多保留的熔断器数量（按最近使用淘汰）
+FEISHU_BREAKER_MAX_ENTRIES = int(os.getenv("FEISHU_BREAKER_MAX_ENTRIES", "10000"))
+
+# 视为鉴权/权限失败的 HTTP 状态码和飞书错误码
+AUTH_FAILURE_STATUS = {401, 403}
+AUTH_FAILURE_CODES = {
+    91403,     # 无权限（Forbidden）
+    1061004,   # 上传文件权限不足
+    1254302,   # 多维表格无访问权限（RolePermNotAllow）
+    99991661,  # 缺少访问凭证
+    99991663,  # 访问凭证无效
+}
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(PermissionError):
+    """熔断打开时抛出，调用方按权限不足处理"""
+
+    def __init__(self, endpoint_class: str, retry_after: float):
+        self.endpoint_class = endpoint_class
+        self.retry_after = retry_after
+        super().__init__(
+            f"授权码权限不足，{endpoint_class} 接口已熔断 (permission denied, retry after {retry_after:.0f}s)"
+        )
+
+
+class CircuitBreaker:
+    """单个 (授权码, 接口类别) 的熔断器"""
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+
+    def retry_after(self, now: float) -> float:
+        return max(self.opened_at + FEISHU_BREAKER_OPEN_SECONDS - now, 0.0)
+
+
+_breakers: "OrderedDict[Tuple[str, str], CircuitBreaker]" = OrderedDict()
+_stats = {"opened": 0, "closed": 0, "rejected": 0, "probes": 0}
+_lock = Lock()
+
+
+def endpoint_class(url: str) -> str:
+    """按接口路径划分类别：upload / record / schema / media / other"""
+    if "/upload_" in url:
+        return "upload"
+    if "/bitable/" in url:
+        if "/records" in url:
+            return "record"
+        if "/fields" in url:
+            return "schema"
+        return "bitable"
+    if "/medias/" in url:
+        return "media"
+    return "other"
+
+
+def _token_of(headers: Optional[Mapping[str, str]]) -> Optional[str]:
+    if not headers:
+        return None
+    auth = headers.get("Authorization") or headers.get("authorization") or ""
+    if auth.startswith("Bearer "):
+        return auth[len("Bearer "):]
+    return None
+
+
+def breaker_key(url: str, headers: Optional[Mapping[str, str]]) -> Optional[Tuple[str, str]]:
+    """熔断器键：(授权码, 接口类别)；请求没有 Bearer 授权头时返回 None（不熔断）"""
+    token = _token_of(headers)
+    if not token:
+        return None
+    return token, endpoint_class(url)
+
+
+def _get(key: Tuple[str, str]) -> CircuitBreaker:
+    breaker = _breakers.get(key)
+    if breaker is None:
+        breaker = CircuitBreaker()
+        _breakers[key] = breaker
+        while len(_breakers) > FEISHU_BREAKER_MAX_ENTRIES:
+            _breakers.popitem(last=False)
+    else:
+        _breakers.move_to_end(key)
+    return breaker
+
+
+def is_open(token: str, endpoint_classes: Iterable[str]) -> bool:
+    """
+    指定授权码在任一接口类别上是否处于熔断（且还未到探测时间）
+
+    用于在执行耗时操作（如上传附件）前提前失败，返回 True 时计入 rejected
+    """
+    now = time.monotonic()
+    with _lock:
+        for cls in endpoint_classes:
+            breaker = _breakers.get((token, cls))
+            if breaker is None:
+                continue
+            if (breaker.state == OPEN and breaker.retry_after(now) > 0) or (
+                breaker.state == HALF_OPEN and breaker.probe_in_flight
+            ):
+                _stats["rejected"] += 1
+                return True
+    return False
+
+
+def before_request(url: str, headers: Optional[Mapping[str, str]]) -> Optional[Tuple[str, str]]:
+    """
+    请求前检查熔断状态
+
+    Returns:
+        熔断器键（请求结束后传给 record_result），请求无需熔断时返回 None
+
+    Raises:
+        CircuitOpenError: 熔断打开，或半开状态下已有探测请求在进行
+    """
+    key = breaker_key(url, headers)
+    if key is None:
+        return None
+
+    now = time.monotonic()
+    with _lock:
+        breaker = _get(key)
+        if breaker.state == OPEN:
+            if breaker.retry_after(now) > 0:
+                _stats["rejected"] += 1
+                raise CircuitOpenError(key[1], breaker.retry_after(now))
+            breaker.state = HALF_OPEN
+        if breaker.state == HALF_OPEN:
+            if breaker.probe_in_flight:
+                _stats["rejected"] += 1
+                raise CircuitOpenError(key[1], FEISHU_BREAKER_OPEN_SECONDS)
+            breaker.probe_in_flight = True
+            _stats["probes"] += 1
+            logger.info(f"Circuit half-open for {key[1]}, sending probe")
+    return key
+
+
+def is_auth_failure(status_code: int, body: Any = None) -> bool:
+    """响应是否为鉴权/权限失败"""
+    if status_code in AUTH_FAILURE_STATUS:
+        return True
+    return isinstance(body, dict) and body.get("code") in AUTH_FAILURE_CODES
+
+
+def record_result(key: Optional[Tuple[str, str]], auth_failure: Optional[bool]) -> None:
+    """
+    记录请求结果
+
+    Args:
+        key: before_request 返回的熔断器键
+        auth_failure: True 鉴权失败；False 成功；None 与授权无关的失败（网络错误等），不计入熔断
+    """
+    if key is None:
+        return
+
+    now = time.monotonic()
+    with _lock:
+        breaker = _get(key)
+        was_probe = breaker.probe_in_flight
+        breaker.probe_in_flight = False
+        if auth_failure is None:
+            return
+
+        if not auth_failure:
+            if breaker.state != CLOSED:
+                _stats["closed"] += 1
+                logger.info(f"Circuit closed for {key[1]}")
+            breaker.state = CLOSED
+            breaker.failures = 0
+            return
+
+        breaker.failures += 1
+        if was_probe or breaker.failures >= FEISHU_BREAKER_FAILURE_THRESHOLD:
+            if breaker.state != OPEN:
+                _stats["opened"] += 1
+                logger.warning(f"Circuit opened for {key[1]} after {breaker.failures} auth failures")
+            breaker.state = OPEN
+            breaker.opened_at = now
+
+
+def record_response(key: Optional[Tuple[str, str]], status_code: int, body: Any, transient: bool) -> None:
+    """按响应记录结果：鉴权失败计入熔断，频控/5xx 等临时错误不计入，其余视为成功"""
+    if key is None:
+        return
+    if is_auth_failure(status_code, body):
+        record_result(key, True)
+    elif transient:
+        record_result(key, None)
+    else:
+        record_result(key, False)
+
+
+def get_stats() -> Dict[str, Any]:
+    """熔断统计：各状态的熔断器数量和累计次数"""
+    with _lock:
+        states = {CLOSED: 0, OPEN: 0, HALF_OPEN: 0}
+        for breaker in _breakers.values():
+            states[breaker.state] += 1
+        return {**_stats, "breakers": len(_breakers), "states": states}
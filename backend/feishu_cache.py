@@ -0,0 +1,199 @@
+"""
+飞书数据缓存模块
+- 提供线程安全、带 TTL 和 LRU 容量上限的进程内缓存
+- 多维表格字段列表（表结构）缓存：按 (app_token, table_id, 授权码摘要) 缓存，字段变更错误时立即失效
+  （键中带授权码摘要，没有该表权限的授权码不能读到其他授权码缓存的结果）
+- 多维表格记录数缓存：按 (app_token, table_id, 授权码摘要) 短时间缓存，新增记录后立即失效
+- 附件临时下载链接缓存：按 file_token 缓存到链接过期前
+"""
+import os
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# 飞书字段不存在的错误码（字段被删除或改名）
+FIELD_NOT_FOUND_CODE = 1254045
+
+# 表结构缓存配置
+TABLE_SCHEMA_CACHE_TTL = int(os.getenv("TABLE_SCHEMA_CACHE_TTL", "300"))  # 秒
+TABLE_SCHEMA_CACHE_MAXSIZE = int(os.getenv("TABLE_SCHEMA_CACHE_MAXSIZE", "512"))
+
+# 记录数缓存配置（短 TTL，表单设计器切换表时使用）
+RECORD_COUNT_CACHE_TTL = int(os.getenv("RECORD_COUNT_CACHE_TTL", "30"))  # 秒
+RECORD_COUNT_CACHE_MAXSIZE = int(os.getenv("RECORD_COUNT_CACHE_MAXSIZE", "1024"))
+
+# 临时下载链接缓存配置：链接有效期内缓存，提前一段时间过期以免返回即将失效的链接
+# 飞书文档给出的 batch_get_tmp_download_url 链接有效期为 24 小时，但未随响应返回过期时间，
+# 这里按 1 小时保守估计（默认缓存 3600 - 600 = 50 分钟），确保缓存一定早于链接失效
+TMP_DOWNLOAD_URL_VALID_SECONDS = int(os.getenv("TMP_DOWNLOAD_URL_VALID_SECONDS", "3600"))
+TMP_DOWNLOAD_URL_EXPIRE_MARGIN = int(os.getenv("TMP_DOWNLOAD_URL_EXPIRE_MARGIN", "600"))
+TMP_DOWNLOAD_URL_CACHE_MAXSIZE = int(os.getenv("TMP_DOWNLOAD_URL_CACHE_MAXSIZE", "10000"))
+
+
+class TTLCache:
+    """带过期时间的 LRU 缓存（线程安全）"""
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (expire_at, value)
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """读取缓存，未命中或已过期返回 None"""
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expire_at, value = item
+            if expire_at <= now:
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """写入缓存，ttl 为空时使用默认过期时间"""
+        expire_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expire_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        """使某个键失效"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate_prefix(self, prefix: Tuple) -> int:
+        """使所有以 prefix 开头的元组键失效，返回失效的条目数"""
+        n = len(prefix)
+        with self._lock:
+            keys = [k for k in self._data if isinstance(k, tuple) and k[:n] == prefix]
+            for k in keys:
+                del self._data[k]
+        return len(keys)
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+def token_digest(base_token: str) -> str:
+    """授权码摘要（sha256 前 16 位），用作缓存键的一部分，缓存中不保存授权码原文"""
+    return hashlib.sha256((base_token or "").strip().encode("utf-8")).hexdigest()[:16]
+
+
+# ==================== 表结构缓存 ====================
+
+table_schema_cache = TTLCache("table_schema", TABLE_SCHEMA_CACHE_MAXSIZE, TABLE_SCHEMA_CACHE_TTL)
+
+
+def get_cached_table_fields(app_token: str, table_id: str, base_token: str) -> Optional[list]:
+    """读取缓存的字段列表，未命中返回 None"""
+    return table_schema_cache.get((app_token, table_id, token_digest(base_token)))
+
+
+def set_cached_table_fields(app_token: str, table_id: str, base_token: str, fields: list) -> None:
+    """缓存字段列表"""
+    table_schema_cache.set((app_token, table_id, token_digest(base_token)), fields)
+
+
+def invalidate_table_schema(app_token: str, table_id: str) -> None:
+    """字段变更时使表结构缓存失效（表结构对所有授权码都已变化，清除该表下全部授权码的缓存）"""
+    table_schema_cache.invalidate_prefix((app_token, table_id))
+    logger.info(f"Invalidated table schema cache for {app_token}/{table_id}")
+
+
+def is_field_not_found_error(result: Any) -> bool:
+    """判断飞书返回（响应 dict 或错误信息）是否为字段不存在错误"""
+    if isinstance(result, dict):
+        return result.get("code") == FIELD_NOT_FOUND_CODE or "FieldNameNotFound" in str(result.get("msg", ""))
+    text = str(result)
+    return str(FIELD_NOT_FOUND_CODE) in text or "FieldNameNotFound" in text
+
+
+# ==================== 记录数缓存 ====================
+
+record_count_cache = TTLCache("record_count", RECORD_COUNT_CACHE_MAXSIZE, RECORD_COUNT_CACHE_TTL)
+
+
+def get_cached_record_count(app_token: str, table_id: str, base_token: str) -> Optional[int]:
+    """读取缓存的记录数，未命中返回 None"""
+    return record_count_cache.get((app_token, table_id, token_digest(base_token)))
+
+
+def set_cached_record_count(app_token: str, table_id: str, base_token: str, count: int) -> None:
+    """缓存记录数"""
+    record_count_cache.set((app_token, table_id, token_digest(base_token)), count)
+
+
+def invalidate_record_count(app_token: str, table_id: str) -> None:
+    """新增记录后使记录数缓存失效（清除该表下全部授权码的缓存）"""
+    record_count_cache.invalidate_prefix((app_token, table_id))
+
+
+# ==================== 临时下载链接缓存 ====================
+
+tmp_download_url_cache = TTLCache(
+    "tmp_download_url",
+    TMP_DOWNLOAD_URL_CACHE_MAXSIZE,
+    max(TMP_DOWNLOAD_URL_VALID_SECONDS - TMP_DOWNLOAD_URL_EXPIRE_MARGIN, 0),
+)
+
+
+def get_cached_tmp_download_url(file_token: str, base_token: str) -> Optional[str]:
+    """
+    读取缓存的临时下载链接，未命中返回 None
+    键包含授权码摘要：链接是用该授权码换来的，不同授权码之间不共享，
+    避免持有 file_token 但无权访问对应多维表格的调用方拿到链接
+    """
+    return tmp_download_url_cache.get((file_token, token_digest(base_token)))
+
+
+def set_cached_tmp_download_url(file_token: str, base_token: str, url: str) -> None:
+    """缓存临时下载链接（到期前自动失效）"""
+    tmp_download_url_cache.set((file_token, token_digest(base_token)), url)
+
+
+def get_cache_stats() -> Dict[str, Any]:
+    """所有缓存的统计信息"""
+    return {
+        table_schema_cache.name: table_schema_cache.stats(),
+        record_count_cache.name: record_count_cache.stats(),
+        tmp_download_url_cache.name: tmp_download_url_cache.stats(),
+    }
@@ -0,0 +1,207 @@
+"""
+飞书 HTTP 客户端模块
+- 按域名（scheme + host）维护共享的 requests.Session 连接池，复用 TCP/TLS 连接（Keep-Alive）
+- 统一默认超时，避免调用方遗漏 timeout 导致工作线程被长期占用
+- 提供连接池统计信息，便于容量规划和排查
+- 幂等请求遇到频控/临时错误时自动退避重试（见 feishu_retry）
+- 按授权码和 app_token 在本地排队限速（见 feishu_shaper）
+- 授权码连续鉴权失败时按接口类别熔断，快速失败（见 feishu_breaker）
+"""
+import os
+import time
+import logging
+from threading import Lock
+from typing import Dict, Any, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+import feishu_breaker
+import feishu_retry
+import feishu_shaper
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# 每个域名的连接池大小（同一域名上允许保持的最大空闲连接数）
+FEISHU_HTTP_POOL_MAXSIZE = int(os.getenv("FEISHU_HTTP_POOL_MAXSIZE", "20"))
+# 连接池满时是否阻塞等待（False 表示临时新建连接，用完即关闭）
+FEISHU_HTTP_POOL_BLOCK = os.getenv("FEISHU_HTTP_POOL_BLOCK", "false").lower() == "true"
+
+# 默认超时（秒）：(连接超时, 读取超时)
+FEISHU_HTTP_CONNECT_TIMEOUT = float(os.getenv("FEISHU_HTTP_CONNECT_TIMEOUT", "5"))
+FEISHU_HTTP_READ_TIMEOUT = float(os.getenv("FEISHU_HTTP_READ_TIMEOUT", "30"))
+DEFAULT_TIMEOUT = (FEISHU_HTTP_CONNECT_TIMEOUT, FEISHU_HTTP_READ_TIMEOUT)
+# 文件上传的读取超时更长
+FEISHU_HTTP_UPLOAD_TIMEOUT = float(os.getenv("FEISHU_HTTP_UPLOAD_TIMEOUT", "60"))
+UPLOAD_TIMEOUT = (FEISHU_HTTP_CONNECT_TIMEOUT, FEISHU_HTTP_UPLOAD_TIMEOUT)
+
+# host -> Session
+_sessions: Dict[str, requests.Session] = {}
+# host -> 调用统计
+_host_stats: Dict[str, Dict[str, int]] = {}
+_sessions_lock = Lock()
+
+
+def _host_of(url: str) -> str:
+    """提取 URL 的 scheme://host[:port] 作为连接池键"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _create_session() -> requests.Session:
+    """创建带连接池的 Session"""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=1,  # 每个 Session 只服务一个域名
+        pool_maxsize=FEISHU_HTTP_POOL_MAXSIZE,
+        pool_block=FEISHU_HTTP_POOL_BLOCK,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(url: str) -> requests.Session:
+    """
+    获取目标 URL 所在域名的共享 Session
+
+    Args:
+        url: 请求地址（只使用其 scheme 和 host 部分）
+
+    Returns:
+        该域名专用的 requests.Session
+    """
+    host = _host_of(url)
+    session = _sessions.get(host)
+    if session is not None:
+        return session
+
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = _create_session()
+            _sessions[host] = session
+            _host_stats[host] = {"requests": 0, "errors": 0}
+            logger.info(f"Created HTTP connection pool for {host} (maxsize={FEISHU_HTTP_POOL_MAXSIZE})")
+        return session
+
+
+def request(method: str, url: str, timeout: Any = None, idempotent: Optional[bool] = None, **kwargs) -> requests.Response:
+    """
+    通过共享连接池发送请求（幂等请求遇到临时错误时按 feishu_retry 策略自动重试）
+
+    Args:
+        method: HTTP 方法
+        url: 请求地址
+        timeout: 超时（秒或 (connect, read) 元组），为空时使用默认超时
+        idempotent: 是否允许自动重试，为空时按 HTTP 方法判断（POST 默认不重试）
+        **kwargs: 透传给 requests.Session.request
+
+    Returns:
+        requests.Response
+    """
+    session = get_session(url)
+    stats = _host_stats.setdefault(_host_of(url), {"requests": 0, "errors": 0})
+    retryable = feishu_retry.is_idempotent(method, idempotent)
+    endpoint = feishu_retry.endpoint_key(method, url)
+    feishu_retry.get_budget(endpoint).record_request()
+
+    attempt = 0
+    while True:
+        breaker = feishu_breaker.before_request(url, kwargs.get("headers"))
+        feishu_shaper.wait_sync(url, kwargs.get("headers"), kwargs.get("data"))
+        stats["requests"] += 1
+        try:
+            resp = session.request(method, url, timeout=timeout or DEFAULT_TIMEOUT, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            stats["errors"] += 1
+            feishu_breaker.record_result(breaker, None)
+            attempt += 1
+            if not retryable or not feishu_retry.should_retry(endpoint, attempt):
+                raise
+            delay = feishu_retry.compute_delay(attempt - 1)
+            logger.warning(f"{endpoint} failed ({e}), retry {attempt} in {delay:.2f}s")
+            time.sleep(delay)
+            continue
+        except requests.RequestException:
+            stats["errors"] += 1
+            feishu_breaker.record_result(breaker, None)
+            raise
+
+        body = feishu_retry.response_body(resp) if retryable or breaker else None
+        transient = feishu_retry.is_retryable_response(resp.status_code, body)
+        feishu_breaker.record_response(breaker, resp.status_code, body, transient)
+
+        if retryable and transient:
+            attempt += 1
+            if feishu_retry.should_retry(endpoint, attempt):
+                delay = feishu_retry.compute_delay(attempt - 1, resp.headers)
+                logger.warning(f"{endpoint} returned retryable error (status={resp.status_code}), retry {attempt} in {delay:.2f}s")
+                resp.close()
+                time.sleep(delay)
+                continue
+        return resp
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    """GET 请求"""
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    """POST 请求"""
+    return request("POST", url, **kwargs)
+
+
+def put(url: str, **kwargs) -> requests.Response:
+    """PUT 请求"""
+    return request("PUT", url, **kwargs)
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """
+    获取各域名连接池的统计信息
+
+    Returns:
+        {host: {requests, errors, connections_created, idle_connections, pool_maxsize}}
+    """
+    result = {}
+    with _sessions_lock:
+        items = list(_sessions.items())
+
+    for host, session in items:
+        stats = dict(_host_stats.get(host, {}))
+        connections_created = 0
+        idle_connections = 0
+        adapter = session.get_adapter(host)
+        pools = getattr(adapter.poolmanager, "pools", None)
+        if pools is not None:
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                connections_created += getattr(pool, "num_connections", 0)
+                if pool.pool is not None:
+                    idle_connections += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+        stats.update({
+            "connections_created": connections_created,
+            "idle_connections": idle_connections,
+            "pool_maxsize": FEISHU_HTTP_POOL_MAXSIZE,
+        })
+        result[host] = stats
+    return result
+
+
+def close_all() -> None:
+    """关闭所有连接池（应用关闭时调用）"""
+    with _sessions_lock:
+        for host, session in _sessions.items():
+            try:
+                session.close()
+            except Exception as e:
+                logger.warning(f"Failed to close HTTP session for {host}: {e}")
+        _sessions.clear()
+        _host_stats.clear()
@@ -0,0 +1,196 @@
+"""
+飞书接口重试策略模块
+- 带随机抖动的指数退避，优先遵循 x-ogw-ratelimit-reset / Retry-After 响应头
+- 只自动重试幂等操作（GET/PUT/DELETE 等，或调用方显式标记 idempotent=True 的请求）
+- 可重试条件：连接错误/超时、HTTP 429/5xx、飞书频控和并发冲突错误码
+- 按接口（方法 + 去掉 token/ID 的路径）维护重试预算，避免故障期间重试放大流量
+"""
+import os
+import re
+import time
+import random
+import logging
+from collections import deque
+from email.utils import parsedate_to_datetime
+from threading import Lock
+from typing import Any, Deque, Dict, Mapping, Optional
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# 单次调用的最大重试次数（不含首次请求）
+FEISHU_RETRY_MAX_RETRIES = int(os.getenv("FEISHU_RETRY_MAX_RETRIES", "3"))
+# 指数退避的初始等待和上限（秒）
+FEISHU_RETRY_BASE_DELAY = float(os.getenv("FEISHU_RETRY_BASE_DELAY", "0.2"))
+FEISHU_RETRY_MAX_DELAY = float(os.getenv("FEISHU_RETRY_MAX_DELAY", "10"))
+# 重试预算：统计窗口内重试数不超过请求数的一定比例，且至少允许每秒若干次
+FEISHU_RETRY_BUDGET_RATIO = float(os.getenv("FEISHU_RETRY_BUDGET_RATIO", "0.2"))
+FEISHU_RETRY_BUDGET_MIN_PER_SEC = float(os.getenv("FEISHU_RETRY_BUDGET_MIN_PER_SEC", "1"))
+FEISHU_RETRY_BUDGET_WINDOW = float(os.getenv("FEISHU_RETRY_BUDGET_WINDOW", "10"))  # 秒
+
+# 可重试的飞书错误码
+RETRYABLE_CODES = {
+    99991400,  # 应用/租户请求频率超限
+    1254290,   # 多维表格请求过于频繁（TooManyRequest）
+    1254291,   # 多维表格写冲突（同一数据表并发写入）
+}
+# 可重试的 HTTP 状态码
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# 幂等的 HTTP 方法
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+# 路径中保留的段（接口名、版本号），其余视为 token/ID 替换为 *
+_STATIC_SEGMENT = re.compile(r"^(v\d+|[a-z_-]+)$")
+
+
+def endpoint_key(method: str, url: str) -> str:
+    """接口标识：方法 + 去掉 token/ID 的路径，如 POST /open-apis/bitable/v1/apps/*/tables/*/records"""
+    parts = urlsplit(url)
+    segments = [s if _STATIC_SEGMENT.match(s) else "*" for s in parts.path.split("/") if s]
+    return f"{method.upper()} {parts.netloc}/{'/'.join(segments)}"
+
+
+def is_idempotent(method: str, idempotent: Optional[bool] = None) -> bool:
+    """是否允许自动重试：显式标记优先，否则按 HTTP 方法判断"""
+    if idempotent is not None:
+        return idempotent
+    return method.upper() in IDEMPOTENT_METHODS
+
+
+def is_retryable_response(status_code: int, body: Any) -> bool:
+    """根据状态码和响应体判断是否为可重试的临时错误"""
+    if status_code in RETRYABLE_STATUS:
+        return True
+    if isinstance(body, dict) and body.get("code") in RETRYABLE_CODES:
+        return True
+    return False
+
+
+def _parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """解析飞书 x-ogw-ratelimit-reset（秒）或标准 Retry-After（秒或 HTTP 日期）"""
+    for name in ("x-ogw-ratelimit-reset", "Retry-After"):
+        value = headers.get(name)
+        if not value:
+            continue
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            pass
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+def compute_delay(attempt: int, headers: Optional[Mapping[str, str]] = None) -> float:
+    """
+    第 attempt 次重试前的等待时间（秒）
+
+    服务端给出重置时间时以其为准（加少量抖动），否则使用全抖动指数退避
+    """
+    retry_after = _parse_retry_after(headers) if headers is not None else None
+    if retry_after is not None:
+        return min(retry_after + random.uniform(0, FEISHU_RETRY_BASE_DELAY), FEISHU_RETRY_MAX_DELAY)
+    return random.uniform(0, min(FEISHU_RETRY_BASE_DELAY * (2 ** attempt), FEISHU_RETRY_MAX_DELAY))
+
+
+class RetryBudget:
+    """
+    单个接口的重试预算（滑动窗口）
+    窗口内允许的重试数 = max(请求数 × ratio, 每秒最少重试数 × 窗口长度)
+    """
+
+    def __init__(self, ratio: float, min_per_sec: float, window: float):
+        self.ratio = ratio
+        self.min_retries = min_per_sec * window
+        self.window = window
+        self._requests: Deque[float] = deque()
+        self._retries: Deque[float] = deque()
+        self._lock = Lock()
+        self.total_requests = 0
+        self.total_retries = 0
+        self.exhausted = 0
+
+    def _expire(self, now: float) -> None:
+        cutoff = now - self.window
+        while self._requests and self._requests[0] < cutoff:
+            self._requests.popleft()
+        while self._retries and self._retries[0] < cutoff:
+            self._retries.popleft()
+
+    def record_request(self) -> None:
+        """记录一次首次请求"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            self._requests.append(now)
+            self.total_requests += 1
+
+    def try_acquire(self) -> bool:
+        """申请一次重试，预算耗尽返回 False"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            allowed = max(len(self._requests) * self.ratio, self.min_retries)
+            if len(self._retries) >= allowed:
+                self.exhausted += 1
+                return False
+            self._retries.append(now)
+            self.total_retries += 1
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.total_requests,
+                "retries": self.total_retries,
+                "budget_exhausted": self.exhausted,
+            }
+
+
+_budgets: Dict[str, RetryBudget] = {}
+_budgets_lock = Lock()
+
+
+def get_budget(endpoint: str) -> RetryBudget:
+    """获取接口对应的重试预算（首次使用时创建）"""
+    budget = _budgets.get(endpoint)
+    if budget is None:
+        with _budgets_lock:
+            budget = _budgets.get(endpoint)
+            if budget is None:
+                budget = RetryBudget(FEISHU_RETRY_BUDGET_RATIO, FEISHU_RETRY_BUDGET_MIN_PER_SEC, FEISHU_RETRY_BUDGET_WINDOW)
+                _budgets[endpoint] = budget
+    return budget
+
+
+def should_retry(endpoint: str, attempt: int) -> bool:
+    """第 attempt 次重试是否允许（次数上限 + 接口重试预算）"""
+    if attempt > FEISHU_RETRY_MAX_RETRIES:
+        return False
+    if not get_budget(endpoint).try_acquire():
+        logger.warning(f"Retry budget exhausted for {endpoint}")
+        return False
+    return True
+
+
+def response_body(resp: Any) -> Any:
+    """尽量解析响应 JSON（用于判断飞书错误码），失败返回 None"""
+    content_type = resp.headers.get("Content-Type", "")
+    if "json" not in content_type:
+        return None
+    try:
+        return resp.json()
+    except ValueError:
+        return None
+
+
+def get_stats() -> Dict[str, Any]:
+    """各接口的请求、重试和预算耗尽次数"""
+    with _budgets_lock:
+        items = list(_budgets.items())
+    return {endpoint: budget.stats() for endpoint, budget in items}
@@ -0,0 +1,207 @@
+"""
+飞书请求整形模块（客户端限流）
+- 按授权码（请求头中的 Bearer token，如 PersonalBaseToken）和多维表格 app_token 分别维护令牌桶
+- 发往飞书的请求先在本地排队，按配置的 QPS 平滑发出，避免触发飞书的频控
+- 令牌桶采用预约方式：每次请求预约一个令牌并得到需要等待的时间，同步/异步客户端共用
+- 统计排队深度和等待时间，便于调整限速参数
+"""
+import os
+import re
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# 是否启用请求整形
+FEISHU_SHAPER_ENABLED = os.getenv("FEISHU_SHAPER_ENABLED", "true").lower() == "true"
+# 每个授权码的 QPS 和突发容量
+FEISHU_SHAPER_TOKEN_QPS = float(os.getenv("FEISHU_SHAPER_TOKEN_QPS", "10"))
+FEISHU_SHAPER_TOKEN_BURST = float(os.getenv("FEISHU_SHAPER_TOKEN_BURST", "20"))
+# 每个多维表格（app_token）的 QPS 和突发容量
+FEISHU_SHAPER_APP_QPS = float(os.getenv("FEISHU_SHAPER_APP_QPS", "10"))
+FEISHU_SHAPER_APP_BURST = float(os.getenv("FEISHU_SHAPER_APP_BURST", "20"))
+# 单个请求最长排队时间（秒），超过时不再排队直接发出（交给重试层处理频控）
+FEISHU_SHAPER_MAX_WAIT = float(os.getenv("FEISHU_SHAPER_MAX_WAIT", "30"))
+# 最多保留的令牌桶数量（按最近使用淘汰）
+FEISHU_SHAPER_MAX_BUCKETS = int(os.getenv("FEISHU_SHAPER_MAX_BUCKETS", "10000"))
+
+_APP_TOKEN_IN_PATH = re.compile(r"/apps/([^/?]+)")
+
+
+class TokenBucket:
+    """预约式令牌桶：令牌可以透支，透支部分换算为调用方需要等待的时间"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def wait_time(self) -> float:
+        """补充令牌后，预约一个令牌需要等待的秒数（不扣减，调用方需持有外部锁）"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def take(self) -> None:
+        """扣减一个令牌（在 wait_time 之后调用，调用方需持有外部锁）"""
+        self.tokens -= 1
+
+
+class _KindStats:
+    """同一类键（token / app）的排队统计"""
+
+    def __init__(self):
+        self.requests = 0
+        self.delayed = 0
+        self.overflow = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "delayed": self.delayed,
+            "overflow": self.overflow,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "avg_wait_ms": round(self.total_wait / self.delayed * 1000, 2) if self.delayed else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 2),
+        }
+
+
+_LIMITS = {
+    "token": (FEISHU_SHAPER_TOKEN_QPS, FEISHU_SHAPER_TOKEN_BURST),
+    "app": (FEISHU_SHAPER_APP_QPS, FEISHU_SHAPER_APP_BURST),
+}
+_buckets: "OrderedDict[Tuple[str, str], TokenBucket]" = OrderedDict()
+_stats: Dict[str, _KindStats] = {kind: _KindStats() for kind in _LIMITS}
+_lock = Lock()
+
+
+def extract_keys(url: str, headers: Optional[Mapping[str, str]] = None, data: Any = None) -> List[Tuple[str, str]]:
+    """
+    从请求中提取限流键
+
+    - token: Authorization 头中的 Bearer token
+    - app: URL 路径中的 /apps/{app_token}，或上传到多维表格时表单中的 parent_node
+    """
+    keys = []
+    if headers:
+        auth = headers.get("Authorization") or headers.get("authorization") or ""
+        if auth.startswith("Bearer "):
+            keys.append(("token", auth[len("Bearer "):]))
+
+    match = _APP_TOKEN_IN_PATH.search(url)
+    if match:
+        keys.append(("app", match.group(1)))
+    elif isinstance(data, dict) and data.get("parent_type") == "bitable_file" and data.get("parent_node"):
+        keys.append(("app", data["parent_node"]))
+    return keys
+
+
+def _get_bucket(key: Tuple[str, str]) -> TokenBucket:
+    bucket = _buckets.get(key)
+    if bucket is None:
+        rate, burst = _LIMITS[key[0]]
+        bucket = TokenBucket(rate, burst)
+        _buckets[key] = bucket
+        while len(_buckets) > FEISHU_SHAPER_MAX_BUCKETS:
+            _buckets.popitem(last=False)
+    else:
+        _buckets.move_to_end(key)
+    return bucket
+
+
+def reserve(keys: List[Tuple[str, str]]) -> float:
+    """
+    为一次请求在所有相关令牌桶上预约令牌，返回需要等待的秒数
+
+    先检查所有令牌桶，全部都在 FEISHU_SHAPER_MAX_WAIT 以内才一起扣减令牌；
+    任一令牌桶需要等待更久时不排队、直接放行，且不占用任何令牌桶的容量（不影响后续请求）
+    """
+    if not FEISHU_SHAPER_ENABLED or not keys:
+        return 0.0
+
+    with _lock:
+        buckets = []
+        wait = 0.0
+        overflow = []
+        for key in keys:
+            _stats[key[0]].requests += 1
+            bucket = _get_bucket(key)
+            key_wait = bucket.wait_time()
+            if key_wait > FEISHU_SHAPER_MAX_WAIT:
+                overflow.append(key[0])
+            buckets.append(bucket)
+            wait = max(wait, key_wait)
+
+        if overflow:
+            for kind in overflow:
+                _stats[kind].overflow += 1
+                logger.warning(f"Feishu request queue for {kind} exceeds {FEISHU_SHAPER_MAX_WAIT}s, sending without shaping")
+            return 0.0
+
+        for bucket in buckets:
+            bucket.take()
+
+        if wait > 0:
+            for kind in {key[0] for key in keys}:
+                stats = _stats[kind]
+                stats.delayed += 1
+                stats.queue_depth += 1
+                stats.max_queue_depth = max(stats.max_queue_depth, stats.queue_depth)
+                stats.total_wait += wait
+                stats.max_wait = max(stats.max_wait, wait)
+    return wait
+
+
+def release(keys: List[Tuple[str, str]], wait: float) -> None:
+    """排队结束（调用方等待完 reserve 返回的时间后调用）"""
+    if wait <= 0:
+        return
+    with _lock:
+        for kind in {key[0] for key in keys}:
+            _stats[kind].queue_depth -= 1
+
+
+def wait_sync(url: str, headers: Optional[Mapping[str, str]] = None, data: Any = None) -> None:
+    """同步请求前排队"""
+    keys = extract_keys(url, headers, data)
+    wait = reserve(keys)
+    if wait > 0:
+        try:
+            time.sleep(wait)
+        finally:
+            release(keys, wait)
+
+
+async def wait_async(url: str, headers: Optional[Mapping[str, str]] = None, data: Any = None) -> None:
+    """异步请求前排队（不阻塞事件循环）"""
+    keys = extract_keys(url, headers, data)
+    wait = reserve(keys)
+    if wait > 0:
+        try:
+            await asyncio.sleep(wait)
+        finally:
+            release(keys, wait)
+
+
+def get_stats() -> Dict[str, Any]:
+    """排队统计"""
+    with _lock:
+        return {
+            "enabled": FEISHU_SHAPER_ENABLED,
+            "buckets": len(_buckets),
+            **{kind: stats.as_dict() for kind, stats in _stats.items()},
+        }
@@ -0,0 +1,238 @@
+"""
+飞书文件上传模块
+- 小文件使用 upload_all 一次性上传
+- 超过阈值（飞书 upload_all 上限 20MB）时使用分片上传：upload_prepare / upload_part / upload_finish
+- 分片直接从 UploadFile（SpooledTemporaryFile）按块读取，内存中只保留当前分片
+- 单个分片失败时按指数退避重试，不必重传整个文件
+"""
+import os
+import zlib
+import asyncio
+import logging
+from typing import Any, Dict
+
+from fastapi.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
+from dotenv import load_dotenv
+
+import auth_service
+import feishu_async_client
+import feishu_client
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# 飞书 upload_all 接口单文件上限 20MB，超过时改用分片上传
+FEISHU_UPLOAD_MULTIPART_THRESHOLD = int(os.getenv("FEISHU_UPLOAD_MULTIPART_THRESHOLD", str(20 * 1024 * 1024)))
+# 单个分片的最大重试次数
+FEISHU_UPLOAD_PART_MAX_RETRIES = int(os.getenv("FEISHU_UPLOAD_PART_MAX_RETRIES", "3"))
+# 分片重试的初始退避时间（秒），每次翻倍
+FEISHU_UPLOAD_PART_RETRY_BACKOFF = float(os.getenv("FEISHU_UPLOAD_PART_RETRY_BACKOFF", "0.5"))
+
+# 上传权限不足的错误码
+UPLOAD_FORBIDDEN_CODE = 1061004
+
+# 上传接口前缀：云空间文件（files）和素材（medias，多维表格附件使用）
+FILES_API_PATH = "/open-apis/drive/v1/files"
+MEDIAS_API_PATH = "/open-apis/drive/v1/medias"
+
+
+def _raise_for_result(result: Dict[str, Any], action: str) -> None:
+    """飞书返回非 0 时抛出异常，权限不足抛出 PermissionError"""
+    if result.get("code") == 0:
+        return
+    error_msg = result.get("msg", "")
+    if result.get("code") == UPLOAD_FORBIDDEN_CODE or "forbidden" in error_msg.lower():
+        raise PermissionError(f"上传文件权限不足 ({UPLOAD_FORBIDDEN_CODE}): {result}")
+    raise Exception(f"{action}失败: {result}")
+
+
+def _file_size(file) -> int:
+    """定位到文件末尾计算大小，之后恢复原位置（同步磁盘操作）"""
+    position = file.tell()
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+    file.seek(position)
+    return size
+
+
+async def get_upload_size(upload: UploadFile) -> int:
+    """
+    获取上传文件大小（优先使用 UploadFile.size）
+
+    没有 size 时定位到文件末尾计算；SpooledTemporaryFile 超过内存阈值后落盘，seek/tell 放到线程池执行
+    """
+    if upload.size is not None:
+        return upload.size
+    return await run_in_threadpool(_file_size, upload.file)
+
+
+async def upload_all(
+    api_prefix: str,
+    headers: dict,
+    file_data: bytes,
+    file_name: str,
+    parent_type: str,
+    parent_node: str,
+    content_type: str = "image/png",
+) -> str:
+    """一次性上传（适用于 20MB 以内的文件），返回 file_token"""
+    files = {"file": (file_name, file_data, content_type)}
+    data = {
+        "file_name": file_name,
+        "parent_type": parent_type,
+        "parent_node": parent_node,
+        "size": str(len(file_data)),
+    }
+
+    resp = await feishu_async_client.post(
+        f"{api_prefix}/upload_all", headers=headers, files=files, data=data, timeout=feishu_client.UPLOAD_TIMEOUT
+    )
+    result = resp.json()
+    _raise_for_result(result, "上传文件")
+
+    data = result.get("data") or {}
+    return data.get("file_token") or data.get("token")
+
+
+async def _upload_part(
+    api_prefix: str,
+    headers: dict,
+    upload_id: str,
+    seq: int,
+    chunk: bytes,
+    content_type: str,
+) -> None:
+    """上传单个分片，失败时按指数退避重试（权限错误不重试）"""
+    data = {
+        "upload_id": upload_id,
+        "seq": str(seq),
+        "size": str(len(chunk)),
+        "checksum": str(zlib.adler32(chunk)),
+    }
+
+    attempt = 0
+    while True:
+        try:
+            resp = await feishu_async_client.post(
+                f"{api_prefix}/upload_part",
+                headers=headers,
+                files={"file": (f"part_{seq}", chunk, content_type)},
+                data=data,
+                timeout=feishu_client.UPLOAD_TIMEOUT,
+            )
+            _raise_for_result(resp.json(), f"上传分片 {seq} ")
+            return
+        except PermissionError:
+            raise
+        except Exception as e:
+            attempt += 1
+            if attempt > FEISHU_UPLOAD_PART_MAX_RETRIES:
+                raise
+            delay = FEISHU_UPLOAD_PART_RETRY_BACKOFF * (2 ** (attempt - 1))
+            logger.warning(f"Upload part {seq} of {upload_id} failed (attempt {attempt}), retrying in {delay}s: {e}")
+            await asyncio.sleep(delay)
+
+
+async def upload_multipart(
+    api_prefix: str,
+    headers: dict,
+    upload: UploadFile,
+    file_size: int,
+    file_name: str,
+    parent_type: str,
+    parent_node: str,
+    content_type: str = "application/octet-stream",
+) -> str:
+    """
+    分片上传，返回 file_token
+
+    分片大小和数量由 upload_prepare 返回的 block_size / block_num 决定，
+    逐块从 upload 中读取并上传，不会一次性读入整个文件
+    """
+    json_headers = dict(headers)
+    json_headers["Content-Type"] = "application/json"
+
+    resp = await feishu_async_client.post(
+        f"{api_prefix}/upload_prepare",
+        headers=json_headers,
+        json={
+            "file_name": file_name,
+            "parent_type": parent_type,
+            "parent_node": parent_node,
+            "size": file_size,
+        },
+    )
+    result = resp.json()
+    _raise_for_result(result, "预上传")
+
+    prepare = result["data"]
+    upload_id = prepare["upload_id"]
+    block_size = int(prepare["block_size"])
+    block_num = int(prepare["block_num"])
+    logger.info(f"Multipart upload {upload_id}: size={file_size}, block_size={block_size}, block_num={block_num}")
+
+    await upload.seek(0)
+    for seq in range(block_num):
+        chunk = await upload.read(block_size)
+        if not chunk:
+            raise Exception(f"上传分片失败: 文件在第 {seq} 个分片处提前结束")
+        await _upload_part(api_prefix, headers, upload_id, seq, chunk, content_type)
+
+    resp = await feishu_async_client.post(
+        f"{api_prefix}/upload_finish",
+        headers=json_headers,
+        json={"upload_id": upload_id, "block_num": block_num},
+    )
+    result = resp.json()
+    _raise_for_result(result, "完成分片上传")
+
+    return result["data"]["file_token"]
+
+
+async def upload_file(
+    api_prefix: str,
+    headers: dict,
+    upload: UploadFile,
+    file_name: str,
+    parent_type: str,
+    parent_node: str,
+    content_type: str = "image/png",
+) -> str:
+    """
+    上传 UploadFile 并返回 file_token，按文件大小自动选择 upload_all 或分片上传
+
+    Args:
+        api_prefix: 接口前缀完整 URL（如 .../open-apis/drive/v1/medias）
+        headers: 鉴权请求头
+        upload: 上传的文件
+        file_name: 文件名
+        parent_type: 上传点类型（folder / bitable_file 等）
+        parent_node: 上传点 token
+        content_type: 文件 MIME 类型
+
+    Raises:
+        PermissionError: 上传权限不足
+        Exception: 其他上传失败
+    """
+    file_size = await get_upload_size(upload)
+    if file_size > FEISHU_UPLOAD_MULTIPART_THRESHOLD:
+        return await upload_multipart(
+            api_prefix, headers, upload, file_size, file_name, parent_type, parent_node, content_type
+        )
+
+    await upload.seek(0)
+    file_data = await upload.read()
+    return await upload_all(api_prefix, headers, file_data, file_name, parent_type, parent_node, content_type)
+
+
+async def upload_file_to_bitable(app_token: str, upload: UploadFile, file_name: str, base_token: str) -> str:
+    """上传文件到多维表格（附件素材）并返回 file_token，大文件自动分片"""
+    return await upload_file(
+        auth_service.get_base_api_url(MEDIAS_API_PATH),
+        auth_service.get_base_authorization_header(base_token),
+        upload,
+        file_name,
+        "bitable_file",
+        app_token,
+    )
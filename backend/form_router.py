@@ -3,21 +3,30 @@
 """
 import json
 import uuid
+import asyncio
 import os
-import requests
 import time
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Iterator, Dict
 
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Request
-from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, FileResponse, Response
+from starlette.background import BackgroundTask
+from starlette.datastructures import UploadFile as StarletteUploadFile
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, sessionmaker
 
-from database import get_db, SignForm
+from database import get_db, get_session_factory, SignForm
 import quota_service
 from user_db_manager import ensure_user_database, get_user_session
 from auth_dependencies import get_current_user_info
+import feishu_client
+import feishu_async_client
+import feishu_breaker
+import feishu_cache
+import feishu_upload
+import media_cache
 
 router = APIRouter(
     prefix="/api/form", 
@@ -44,6 +53,18 @@ FIELD_TYPE_MAP = {
 # 不支持的字段类型（人员、公式等）
 UNSUPPORTED_FIELD_TYPES = {11, 20, 21, 22}
 
+# 飞书记录列表接口单页最大条数
+MAX_PAGE_SIZE = 500
+
+# 飞书记录不存在的错误码（记录已被删除）
+RECORD_NOT_FOUND_CODE = 1254043
+
+# 批量获取临时下载链接接口单次最多支持的 file_token 数量
+TMP_DOWNLOAD_URL_BATCH_SIZE = 5
+
+# 表单提交时附件并发上传数
+SUBMIT_UPLOAD_CONCURRENCY = int(os.getenv("SUBMIT_UPLOAD_CONCURRENCY", "4"))
+
 
 # ==================== 请求/响应模型 ====================
 
@@ -121,7 +142,7 @@ def upload_to_bitable(app_token: str, file_data: bytes, file_name: str, base_tok
         "size": str(len(file_data))
     }
     
-    resp = requests.post(url, headers=headers, files=files, data=data)
+    resp = feishu_client.post(url, headers=headers, files=files, data=data, timeout=feishu_client.UPLOAD_TIMEOUT)
     result = resp.json()
     
     if result.get("code") != 0:
@@ -141,12 +162,18 @@ def create_bitable_record(app_token: str, table_id: str, fields: dict, base_toke
     headers = auth_service.get_base_authorization_header(base_token)
     headers["Content-Type"] = "application/json"
     
-    resp = requests.post(url, headers=headers, json={"fields": fields})
+    # client_token 保证重复提交只创建一条记录，因此可以安全重试
+    params = {"client_token": str(uuid.uuid4())}
+    resp = feishu_client.post(url, headers=headers, json={"fields": fields}, params=params, idempotent=True)
     result = resp.json()
     
     if result.get("code") != 0:
+        if feishu_cache.is_field_not_found_error(result):
+            feishu_cache.invalidate_table_schema(app_token, table_id)
         raise Exception(f"创建记录失败: {result}")
     
+    feishu_cache.invalidate_record_count(app_token, table_id)
+    
     return result["data"]["record"]["record_id"]
 
 
@@ -157,45 +184,96 @@ def update_bitable_record(app_token: str, table_id: str, record_id: str, fields:
     headers = auth_service.get_base_authorization_header(base_token)
     headers["Content-Type"] = "application/json"
     
-    resp = requests.put(url, headers=headers, json={"fields": fields})
+    resp = feishu_client.put(url, headers=headers, json={"fields": fields})
     result = resp.json()
     
     if result.get("code") != 0:
+        if feishu_cache.is_field_not_found_error(result):
+            feishu_cache.invalidate_table_schema(app_token, table_id)
         raise Exception(f"更新记录失败: {result}")
     
     return result["data"]["record"]["record_id"]
 
 
-def get_bitable_records(app_token: str, table_id: str, base_token: str, page_size: int = 500) -> list:
-    """获取多维表格中的所有记录"""
+def iter_bitable_records(
+    app_token: str,
+    table_id: str,
+    base_token: str,
+    page_size: int = MAX_PAGE_SIZE,
+    field_names: Optional[List[str]] = None,
+    limit: Optional[int] = None,
+) -> Iterator[dict]:
+    """
+    逐页遍历多维表格记录（生成器，内存中只保留当前页）
+    
+    Args:
+        page_size: 每页条数（最大 500）
+        field_names: 只返回指定字段（字段名列表），为空时返回全部字段
+        limit: 最多返回的记录条数，达到后不再请求后续页
+    """
     url = auth_service.get_base_api_url(f"/open-apis/bitable/v1/apps/{app_token}/tables/{table_id}/records")
     
     headers = auth_service.get_base_authorization_header(base_token)
     
-    all_records = []
+    yielded = 0
     page_token = None
     
-    while True:
-        params = {"page_size": page_size}
+    while limit is None or yielded < limit:
+        params = {"page_size": page_size if limit is None else min(page_size, limit - yielded)}
         if page_token:
             params["page_token"] = page_token
+        if field_names is not None:
+            params["field_names"] = json.dumps(field_names, ensure_ascii=False)
         
-        resp = requests.get(url, headers=headers, params=params)
+        resp = feishu_client.get(url, headers=headers, params=params)
         result = resp.json()
         
         if result.get("code") != 0:
             raise Exception(f"获取记录列表失败: {result}")
         
         data = result.get("data", {})
-        records = data.get("items", [])
-        all_records.extend(records)
+        records = data.get("items") or []
+        for record in records:
+            yield record
+        yielded += len(records)
         
         # 检查是否还有下一页
         page_token = data.get("page_token")
         if not page_token or not records:
             break
+
+
+def get_bitable_records(app_token: str, table_id: str, base_token: str, page_size: int = MAX_PAGE_SIZE) -> list:
+    """获取多维表格中的所有记录"""
+    return list(iter_bitable_records(app_token, table_id, base_token, page_size=page_size))
+
+
+def get_bitable_record_count(app_token: str, table_id: str, base_token: str) -> int:
+    """
+    获取多维表格的记录总数
+    优先读取首页响应中的 total（只请求 1 条记录），缺失时退化为仅翻页计数
+    """
+    cached = feishu_cache.get_cached_record_count(app_token, table_id, base_token)
+    if cached is not None:
+        return cached
+    
+    url = auth_service.get_base_api_url(f"/open-apis/bitable/v1/apps/{app_token}/tables/{table_id}/records")
+    headers = auth_service.get_base_authorization_header(base_token)
     
-    return all_records
+    resp = feishu_client.get(url, headers=headers, params={"page_size": 1})
+    result = resp.json()
+    
+    if result.get("code") != 0:
+        raise Exception(f"获取记录数量失败: {result}")
+    
+    data = result.get("data", {})
+    total = data.get("total")
+    if total is None:
+        # 接口未返回 total 时，逐页累加条数（不保留记录内容）
+        total = sum(1 for _ in iter_bitable_records(app_token, table_id, base_token))
+    
+    feishu_cache.set_cached_record_count(app_token, table_id, base_token, total)
+    return total
 
 
 def get_bitable_record_by_index(app_token: str, table_id: str, record_index: int, base_token: str) -> Optional[str]:
@@ -204,18 +282,27 @@ def get_bitable_record_by_index(app_token: str, table_id: str, record_index: int
     record_index: 1表示第一条记录，2表示第二条，以此类推
     返回: 记录ID，如果不存在则返回None
     """
+    if record_index <= 0:
+        return None
+    
     try:
-        records = get_bitable_records(app_token, table_id, base_token)
-        
-        if record_index > 0 and record_index <= len(records):
-            return records[record_index - 1].get("record_id")
-        
+        # 逐页翻到目标索引所在的页即停止，不再拉取整张表
+        records = iter_bitable_records(app_token, table_id, base_token, limit=record_index)
+        for position, record in enumerate(records, start=1):
+            if position == record_index:
+                return record.get("record_id")
         return None
     except Exception as e:
         log_to_file(f"[get_bitable_record_by_index] Error: {e}")
         return None
 
 
+def is_record_not_found_error(error: Exception) -> bool:
+    """判断更新记录失败是否因为记录已不存在（缓存的 record_id 失效）"""
+    error_str = str(error)
+    return str(RECORD_NOT_FOUND_CODE) in error_str or "RecordIdNotFound" in error_str
+
+
 def get_bitable_record_data(app_token: str, table_id: str, record_id: str, base_token: str) -> Optional[dict]:
     """
     根据记录ID获取单条记录的完整数据
@@ -225,7 +312,7 @@ def get_bitable_record_data(app_token: str, table_id: str, record_id: str, base_
         url = auth_service.get_base_api_url(f"/open-apis/bitable/v1/apps/{app_token}/tables/{table_id}/records/{record_id}")
         headers = auth_service.get_base_authorization_header(base_token)
         
-        resp = requests.get(url, headers=headers)
+        resp = feishu_client.get(url, headers=headers)
         result = resp.json()
         
         if result.get("code") != 0:
@@ -247,7 +334,7 @@ def get_table_fields(app_token: str, table_id: str, base_token: str) -> list:
     url = auth_service.get_base_api_url(f"/open-apis/bitable/v1/apps/{app_token}/tables/{table_id}/fields")
     headers = auth_service.get_base_authorization_header(base_token)
     
-    resp = requests.get(url, headers=headers, params={"page_size": 100})
+    resp = feishu_client.get(url, headers=headers, params={"page_size": 100})
     result = resp.json()
     
     if result.get("code") != 0:
@@ -256,18 +343,27 @@ def get_table_fields(app_token: str, table_id: str, base_token: str) -> list:
     return result["data"]["items"]
 
 
+def get_table_fields_cached(app_token: str, table_id: str, base_token: str) -> list:
+    """获取多维表格字段列表（优先读取表结构缓存）"""
+    fields = feishu_cache.get_cached_table_fields(app_token, table_id, base_token)
+    if fields is None:
+        fields = get_table_fields(app_token, table_id, base_token)
+        feishu_cache.set_cached_table_fields(app_token, table_id, base_token, fields)
+    return fields
+
+
 def get_temp_download_url(file_token: str, base_token: str) -> Optional[str]:
     """
-    获取飞书文件的临时下载链接
-    返回: 临时下载URL（有效期约1小时），失败返回None
+    获取飞书文件的临时下载链接（下载接口 302 跳转的地址，不缓存）
+    返回: 临时下载URL（短期有效，有效期以飞书为准，不要长期保存），失败返回None
     """
     try:
         # 使用飞书 Drive API 获取临时下载链接
-        url = f"https://open.feishu.cn/open-apis/drive/v1/medias/{file_token}/download"
+        url = auth_service.get_open_api_url(f"/open-apis/drive/v1/medias/{file_token}/download")
         headers = auth_service.get_base_authorization_header(base_token)
         
         # 先尝试获取文件信息
-        resp = requests.get(url, headers=headers, allow_redirects=False, timeout=5)
+        resp = feishu_client.get(url, headers=headers, allow_redirects=False, timeout=5)
         
         # 如果返回302重定向，说明有临时链接
         if resp.status_code == 302:
@@ -282,6 +378,294 @@ def get_temp_download_url(file_token: str, base_token: str) -> Optional[str]:
         return None
 
 
+def get_temp_download_urls(file_tokens: List[str], base_token: str) -> Dict[str, Optional[str]]:
+    """
+    批量获取飞书文件的临时下载链接（batch_get_tmp_download_url，飞书文档给出的有效期为 24 小时）
+    已缓存且未临近过期的链接直接复用（按授权码隔离，缓存时长见 feishu_cache.TMP_DOWNLOAD_URL_VALID_SECONDS），
+    其余按批次一次请求多个 file_token
+    返回: {file_token: 临时下载URL}，获取失败的 file_token 对应 None
+    """
+    result: Dict[str, Optional[str]] = {}
+    missing = []
+    for file_token in dict.fromkeys(file_tokens):
+        cached = feishu_cache.get_cached_tmp_download_url(file_token, base_token)
+        if cached:
+            result[file_token] = cached
+        else:
+            result[file_token] = None
+            missing.append(file_token)
+    
+    if not missing:
+        return result
+    
+    url = auth_service.get_open_api_url("/open-apis/drive/v1/medias/batch_get_tmp_download_url")
+    headers = auth_service.get_base_authorization_header(base_token)
+    
+    for i in range(0, len(missing), TMP_DOWNLOAD_URL_BATCH_SIZE):
+        batch = missing[i:i + TMP_DOWNLOAD_URL_BATCH_SIZE]
+        try:
+            resp = feishu_client.get(url, headers=headers, params=[("file_tokens", t) for t in batch], timeout=5)
+            data = resp.json()
+            if data.get("code") != 0:
+                log_to_file(f"[get_temp_download_urls] API Error: {data}")
+                continue
+            for item in (data.get("data") or {}).get("tmp_download_urls") or []:
+                file_token = item.get("file_token")
+                tmp_url = item.get("tmp_download_url")
+                if file_token and tmp_url:
+                    result[file_token] = tmp_url
+                    feishu_cache.set_cached_tmp_download_url(file_token, base_token, tmp_url)
+        except Exception as e:
+            log_to_file(f"[get_temp_download_urls] Error: {e}")
+    
+    return result
+
+
+def resolve_record_fields(record_fields: dict, form_fields: List[dict], field_name_to_id_map: Dict[str, str]) -> List[tuple]:
+    """
+    把记录字段（键为字段名称或字段ID）解析为 (field_id, 表单字段配置, 值)，只保留表单中配置的字段
+
+    Args:
+        record_fields: 飞书记录的 fields
+        form_fields: 表单字段配置列表
+        field_name_to_id_map: 字段名称到字段ID的映射
+    """
+    field_id_map = {f.get("field_id"): f for f in form_fields}
+    resolved_fields = []
+    for field_key, value in record_fields.items():
+        field_id = None
+        if field_key.startswith("fld"):
+            field_id = field_key
+        elif field_key in field_name_to_id_map:
+            field_id = field_name_to_id_map[field_key]
+        
+        if not field_id or field_id not in field_id_map:
+            continue
+        resolved_fields.append((field_id, field_id_map[field_id], value))
+    return resolved_fields
+
+
+def collect_attachment_tokens(resolved_fields: List[tuple]) -> List[str]:
+    """收集已解析字段中所有附件的 file_token"""
+    file_tokens = []
+    for _, field_config, value in resolved_fields:
+        if field_config.get("input_type") == "attachment" and isinstance(value, list):
+            for item in value:
+                if isinstance(item, dict) and (item.get("file_token") or item.get("token")):
+                    file_tokens.append(item.get("file_token") or item.get("token"))
+    return file_tokens
+
+
+def convert_record_fields(resolved_fields: List[tuple], temp_urls: Dict[str, Optional[str]]) -> dict:
+    """
+    把已解析的记录字段转换为前端表单使用的格式 {field_id: value}
+
+    Args:
+        resolved_fields: resolve_record_fields 的结果
+        temp_urls: 附件 file_token 到临时下载链接的映射
+    """
+    converted_data = {}
+    for field_id, field_config, value in resolved_fields:
+        input_type = field_config.get("input_type", "text")
+        
+        # 根据字段类型转换数据
+        if value is None:
+            converted_data[field_id] = None
+        elif input_type == "number":
+            try:
+                converted_data[field_id] = float(value) if value else None
+            except:
+                converted_data[field_id] = None
+        elif input_type == "checkbox":
+            converted_data[field_id] = bool(value)
+        elif input_type == "multiselect":
+            if isinstance(value, list):
+                converted_data[field_id] = [str(item) for item in value]
+            else:
+                converted_data[field_id] = [str(value)] if value else []
+        elif input_type == "date":
+            if isinstance(value, (int, float)) and value > 0:
+                dt = datetime.fromtimestamp(value / 1000)
+                converted_data[field_id] = dt.strftime("%Y-%m-%d")
+            else:
+                converted_data[field_id] = None
+        elif input_type == "attachment":
+            if isinstance(value, list) and len(value) > 0:
+                attachments = []
+                for item in value:
+                    if isinstance(item, dict):
+                        file_token = item.get("file_token") or item.get("token")
+                        temp_url = temp_urls.get(file_token) if file_token else None
+                        
+                        # 返回完整附件信息供前端展示
+                        attachments.append({
+                            "file_token": file_token,
+                            "name": item.get("name", "unknown"),
+                            "url": item.get("url", ""),
+                            "temp_url": temp_url,  # 临时下载链接
+                            "type": item.get("type", "")
+                        })
+                converted_data[field_id] = attachments if attachments else None
+            else:
+                converted_data[field_id] = None
+        else:
+            converted_data[field_id] = str(value) if value else ""
+    return converted_data
+
+
+def convert_submit_fields(extra_data: dict, field_map: dict, field_id_to_name: dict) -> dict:
+    """
+    把表单提交的字段值转换为飞书记录字段格式（按字段名称），跳过空值（保留 0 和 False）
+
+    Args:
+        extra_data: 提交的字段值 {field_id: value}
+        field_map: 字段ID到表单字段配置的映射
+        field_id_to_name: 字段ID到飞书字段名称的映射
+    """
+    fields = {}
+    for key, value in extra_data.items():
+        if not value and value != 0 and value != False:
+            continue  # 跳过空值（但保留 0 和 False）
+        
+        field_config = field_map.get(key, {})
+        field_type = field_config.get("type", 1)
+        input_type = field_config.get("input_type", "text")
+        
+        # 获取字段名称（飞书API需要字段名称）
+        field_name = field_id_to_name.get(key) or key
+        
+        # 根据字段类型转换数据格式
+        if input_type == "select" or field_type == 3:
+            # 单选：转为字符串
+            fields[field_name] = str(value) if value else ""
+        elif input_type == "multiselect" or field_type == 4:
+            # 多选：确保是列表格式
+            if isinstance(value, list):
+                fields[field_name] = value
+            else:
+                fields[field_name] = [str(value)] if value else []
+        elif input_type == "date" or field_type == 5:
+            # 日期：转为时间戳（毫秒）
+            if isinstance(value, (int, float)):
+                fields[field_name] = int(value)
+            elif isinstance(value, str):
+                try:
+                    dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+                    fields[field_name] = int(dt.timestamp() * 1000)
+                except:
+                    fields[field_name] = value
+            else:
+                fields[field_name] = value
+        elif input_type == "number" or field_type == 2:
+            # 数字
+            try:
+                fields[field_name] = float(value) if '.' in str(value) else int(value)
+            except:
+                fields[field_name] = value
+        elif input_type == "checkbox" or field_type == 7:
+            # 复选框：布尔值
+            fields[field_name] = bool(value)
+        else:
+            # 文本、电话、邮箱、URL 等直接使用字符串
+            fields[field_name] = str(value)
+    return fields
+
+
+async def upload_files_concurrently(app_token: str, uploads: List[tuple], base_token: str) -> List[str]:
+    """
+    并发上传多个文件到多维表格（并发数受 SUBMIT_UPLOAD_CONCURRENCY 限制）
+    uploads: [(upload_file, file_name)]，超过阈值的大文件自动分片上传
+    返回: 与 uploads 顺序一致的 file_token 列表
+    失败时按提交顺序取第一个错误：权限不足返回 403，其他错误返回 500
+    """
+    semaphore = asyncio.Semaphore(SUBMIT_UPLOAD_CONCURRENCY)
+    
+    async def upload_one(upload_file: StarletteUploadFile, file_name: str) -> str:
+        async with semaphore:
+            return await feishu_upload.upload_file_to_bitable(app_token, upload_file, file_name, base_token)
+    
+    results = await asyncio.gather(
+        *[upload_one(upload_file, file_name) for upload_file, file_name in uploads],
+        return_exceptions=True
+    )
+    
+    for result in results:
+        if isinstance(result, PermissionError):
+            log_to_file(f"[Form Submit] Upload permission error: {result}")
+            raise HTTPException(status_code=403, detail="上传文件权限不足，请检查授权码权限")
+        if isinstance(result, BaseException):
+            error_str = str(result)
+            log_to_file(f"[Form Submit] Upload failed: {error_str}")
+            raise HTTPException(status_code=500, detail=f"上传文件失败: {error_str}")
+    
+    return results
+
+
+def load_active_form(session_factory: sessionmaker, form_id: str) -> Optional[SignForm]:
+    """读取启用中的表单后立即归还连接（返回的对象已脱离会话，只读）"""
+    db = session_factory()
+    try:
+        return db.query(SignForm).filter(
+            SignForm.form_id == form_id,
+            SignForm.is_active.is_(True)
+        ).first()
+    finally:
+        db.close()
+
+
+def load_form(session_factory: sessionmaker, form_id: str) -> Optional[SignForm]:
+    """读取表单（不限启用状态）后立即归还连接（返回的对象已脱离会话，只读）"""
+    db = session_factory()
+    try:
+        return db.query(SignForm).filter(SignForm.form_id == form_id).first()
+    finally:
+        db.close()
+
+
+def update_form(session_factory: sessionmaker, form_id: str, **values) -> None:
+    """用短会话更新表单字段"""
+    db = session_factory()
+    try:
+        db.query(SignForm).filter(SignForm.form_id == form_id).update(values, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def consume_form_quota(session_factory: sessionmaker, form_id: str, user_key: Optional[str], file_token: str) -> bool:
+    """扣除表单创建者 1 次额度并累加提交计数；额度不足时返回 False（不计数）"""
+    db = session_factory()
+    try:
+        if user_key:
+            if "::" in user_key:
+                open_id_val, tenant_key_val = user_key.split("::")
+                ensure_user_database(user_key)
+                user_db = get_user_session(user_key)
+                try:
+                    ok = quota_service.consume_quota(
+                        user_db, 
+                        db, 
+                        open_id=open_id_val, 
+                        tenant_key=tenant_key_val, 
+                        file_token=file_token,
+                        file_name=f"外链表单签名_{form_id}.png"
+                    )
+                finally:
+                    user_db.close()
+                if not ok:
+                    return False
+            else:
+                log_to_file(f"[Form Submit] Invalid user_key format: {user_key}, skipping quota deduction")
+
+        db.query(SignForm).filter(SignForm.form_id == form_id).update(
+            {SignForm.submit_count: SignForm.submit_count + 1}, synchronize_session=False
+        )
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+
 # ==================== API 路由 ====================
 
 @router.get("/table-fields")
@@ -297,7 +681,7 @@ def get_table_fields_api(
         token = base_token
         if not token:
             raise ValueError("需要提供 base_token")
-        raw_fields = get_table_fields(app_token, table_id, token)
+        raw_fields = get_table_fields_cached(app_token, table_id, token)
         
         # 转换为前端可用格式
         fields = []
@@ -342,8 +726,8 @@ def get_record_count_api(
         token = base_token
         if not token:
             raise ValueError("需要提供 base_token")
-        records = get_bitable_records(app_token, table_id, token)
-        return {"success": True, "count": len(records)}
+        count = get_bitable_record_count(app_token, table_id, token)
+        return {"success": True, "count": count}
     except ValueError:
         raise HTTPException(status_code=401, detail="请先配置授权码")
     except Exception as e:
@@ -368,12 +752,12 @@ def create_form(
     
     # 如果启用了预填数据，提前获取并缓存 record_id
     cached_record_id = None
-    if req.show_data and req.record_index and req.record_index > 0:
+    if req.show_data and req.record_index and req.record_index > 0 and req.base_token:
         cached_record_id = get_bitable_record_by_index(
             req.app_token,
             req.table_id,
             req.record_index,
-            None
+            req.base_token
         )
     
     form = SignForm(
@@ -550,7 +934,7 @@ def get_form_record_data(form_id: str, db: Session = Depends(get_db)):
         # 获取字段列表，建立字段名称到字段ID的映射
         field_name_to_id_map = {}
         try:
-            raw_fields = get_table_fields(form.app_token, form.table_id, base_token)
+            raw_fields = get_table_fields_cached(form.app_token, form.table_id, base_token)
             for f in raw_fields:
                 field_name = f.get("field_name", "")
                 field_id = f.get("field_id", "")
@@ -559,72 +943,20 @@ def get_form_record_data(form_id: str, db: Session = Depends(get_db)):
         except Exception as e:
             log_to_file(f"[get_form_record_data] 获取字段列表失败: {e}")
         
-        # 转换数据格式，只返回表单中配置的字段
-        converted_data = {}
-        field_id_map = {f.get("field_id"): f for f in form_fields}
+        # 只保留表单中配置的字段
+        resolved_fields = resolve_record_fields(record_fields, form_fields, field_name_to_id_map)
         
-        for field_key, value in record_fields.items():
-            field_id = None
-            if field_key.startswith("fld"):
-                field_id = field_key
-            elif field_key in field_name_to_id_map:
-                field_id = field_name_to_id_map[field_key]
-            
-            if not field_id or field_id not in field_id_map:
-                continue
-            
-            field_config = field_id_map[field_id]
-            input_type = field_config.get("input_type", "text")
-            
-            # 根据字段类型转换数据
-            if value is None:
-                converted_data[field_id] = None
-            elif input_type == "number":
-                try:
-                    converted_data[field_id] = float(value) if value else None
-                except:
-                    converted_data[field_id] = None
-            elif input_type == "checkbox":
-                converted_data[field_id] = bool(value)
-            elif input_type == "multiselect":
-                if isinstance(value, list):
-                    converted_data[field_id] = [str(item) for item in value]
-                else:
-                    converted_data[field_id] = [str(value)] if value else []
-            elif input_type == "date":
-                if isinstance(value, (int, float)) and value > 0:
-                    dt = datetime.fromtimestamp(value / 1000)
-                    converted_data[field_id] = dt.strftime("%Y-%m-%d")
-                else:
-                    converted_data[field_id] = None
-            elif input_type == "attachment":
-                if isinstance(value, list) and len(value) > 0:
-                    attachments = []
-                    for item in value:
-                        if isinstance(item, dict):
-                            file_token = item.get("file_token") or item.get("token")
-                            # 尝试获取临时下载链接
-                            temp_url = None
-                            if file_token:
-                                try:
-                                    # 获取临时下载链接（有效期通常为1小时）
-                                    temp_url = get_temp_download_url(file_token, base_token)
-                                except Exception as e:
-                                    log_to_file(f"[get_form_record_data] 获取临时链接失败: {e}")
-                            
-                            # 返回完整附件信息供前端展示
-                            attachments.append({
-                                "file_token": file_token,
-                                "name": item.get("name", "unknown"),
-                                "url": item.get("url", ""),
-                                "temp_url": temp_url,  # 临时下载链接
-                                "type": item.get("type", "")
-                            })
-                    converted_data[field_id] = attachments if attachments else None
-                else:
-                    converted_data[field_id] = None
-            else:
-                converted_data[field_id] = str(value) if value else ""
+        # 一次性批量获取记录中所有附件的临时下载链接（有效期内走缓存）
+        file_tokens = collect_attachment_tokens(resolved_fields)
+        temp_urls = {}
+        if file_tokens:
+            try:
+                temp_urls = get_temp_download_urls(file_tokens, base_token)
+            except Exception as e:
+                log_to_file(f"[get_form_record_data] 获取临时链接失败: {e}")
+        
+        # 转换数据格式
+        converted_data = convert_record_fields(resolved_fields, temp_urls)
         
         return {
             "success": True,
@@ -644,14 +976,15 @@ async def submit_form(
     form_id: str,
     signature: Optional[UploadFile] = File(None),
     form_data: str = Form(default="{}"),
-    db: Session = Depends(get_db)
+    session_factory: sessionmaker = Depends(get_session_factory)
 ):
-    """提交签名表单"""
+    """
+    提交签名表单
+
+    数据库读写都用短会话放到线程池执行，等待飞书期间不占用连接、不阻塞事件循环
+    """
     # 查找表单
-    form = db.query(SignForm).filter(
-        SignForm.form_id == form_id,
-        SignForm.is_active.is_(True)
-    ).first()
+    form = await run_in_threadpool(load_active_form, session_factory, form_id)
     
     if not form:
         raise HTTPException(status_code=404, detail="表单不存在")
@@ -664,6 +997,11 @@ async def submit_form(
     if not base_token:
         raise HTTPException(status_code=401, detail="表单创建者未配置授权码")
     
+    # 授权码已因连续权限错误熔断时直接失败，不再上传附件
+    if feishu_breaker.is_open(base_token.strip(), ("upload", "record")):
+        log_to_file(f"[Form Submit] Circuit open for creator token of form {form_id}, failing fast")
+        raise HTTPException(status_code=403, detail="权限不足，请检查授权码权限")
+    
     try:
         log_to_file(f"[Form Submit] Using creator's base token")
         
@@ -722,6 +1060,9 @@ async def submit_form(
         # 处理附件字段（支持多字段）
         uploaded_attachment_tokens = {}  # field_id -> file_token
 
+        # 先收集所有待上传文件，再并发上传
+        pending_uploads = []  # [(field_id, upload_file, upload_name)]，field_id 为 None 表示旧版 signature
+
         # 1) 新版：attachment_{fieldId}
         try:
             form_obj = await request.form()
@@ -730,58 +1071,53 @@ async def submit_form(
                     continue
                 if not k.startswith('attachment_'):
                     continue
-                if not isinstance(v, UploadFile):
+                # request.form() 返回的是 Starlette 的 UploadFile（FastAPI 的 UploadFile 是其子类）
+                if not isinstance(v, StarletteUploadFile):
                     continue
 
                 field_id = k[len('attachment_'):]
                 if not field_id:
                     continue
 
-                file_bytes = await v.read()
-                if not file_bytes:
+                # 不在此处读取文件内容，上传时按大小选择一次性上传或分片上传
+                if not await feishu_upload.get_upload_size(v):
                     continue
 
                 upload_name = v.filename or f"attachment_{field_id}.png"
-                try:
-                    token = upload_to_bitable(form.app_token, file_bytes, upload_name, base_token)
-                    uploaded_attachment_tokens[field_id] = token
-                except PermissionError as perm_err:
-                    log_to_file(f"[Form Submit] Upload permission error: {perm_err}")
-                    raise HTTPException(status_code=403, detail="上传文件权限不足，请检查授权码权限")
-                except Exception as upload_err:
-                    error_str = str(upload_err)
-                    log_to_file(f"[Form Submit] Upload failed: {error_str}")
-                    raise HTTPException(status_code=500, detail=f"上传文件失败: {error_str}")
+                pending_uploads.append((field_id, v, upload_name))
         except Exception as e:
             # 如果解析 multipart 失败，不影响旧逻辑
             log_to_file(f"[Form Submit] Parse multipart failed: {e}")
 
         # 2) 旧版兼容：signature 单文件，写入第一个附件字段
-        file_token = None
         if signature and signature.filename:
-            signature_data = await signature.read()
-            if signature_data:
+            if await feishu_upload.get_upload_size(signature):
                 file_name = f"signature_{datetime.now().strftime('%Y%m%d%H%M%S')}.png"
-                try:
-                    file_token = upload_to_bitable(form.app_token, signature_data, file_name, base_token)
-                except PermissionError as perm_err:
-                    log_to_file(f"[Form Submit] Upload permission error: {perm_err}")
-                    raise HTTPException(status_code=403, detail="上传文件权限不足，请检查授权码权限")
-                except Exception as upload_err:
-                    error_str = str(upload_err)
-                    log_to_file(f"[Form Submit] Upload failed: {error_str}")
-                    raise HTTPException(status_code=500, detail=f"上传文件失败: {error_str}")
-
-                # 查找附件类型字段
-                attachment_field_id = form.signature_field_id
-                if not attachment_field_id:
-                    for fc in field_configs:
-                        if fc.get("input_type") == "attachment" or fc.get("type") == 17:
-                            attachment_field_id = fc.get("field_id")
-                            break
+                pending_uploads.append((None, signature, file_name))
 
-                if attachment_field_id and file_token:
-                    uploaded_attachment_tokens[attachment_field_id] = file_token
+        tokens = await upload_files_concurrently(
+            form.app_token,
+            [(upload_file, upload_name) for _, upload_file, upload_name in pending_uploads],
+            base_token
+        )
+
+        file_token = None
+        for (field_id, _, _), token in zip(pending_uploads, tokens):
+            if field_id is not None:
+                uploaded_attachment_tokens[field_id] = token
+                continue
+
+            file_token = token
+            # 查找附件类型字段
+            attachment_field_id = form.signature_field_id
+            if not attachment_field_id:
+                for fc in field_configs:
+                    if fc.get("input_type") == "attachment" or fc.get("type") == 17:
+                        attachment_field_id = fc.get("field_id")
+                        break
+
+            if attachment_field_id and file_token:
+                uploaded_attachment_tokens[attachment_field_id] = file_token
 
         # ===== 服务端兜底：附件必填校验 =====
         # 若某附件字段被设置 required，则必须在本次请求中提交对应 attachment_{fieldId}
@@ -812,82 +1148,57 @@ async def submit_form(
             fields[field_name] = [{"file_token": token}]
         
         # 处理其他字段数据（根据类型转换格式）
-        for key, value in extra_data.items():
-            if not value and value != 0 and value != False:
-                continue  # 跳过空值（但保留 0 和 False）
-            
-            field_config = field_map.get(key, {})
-            field_type = field_config.get("type", 1)
-            input_type = field_config.get("input_type", "text")
-            
-            # 获取字段名称（飞书API需要字段名称）
-            field_name = field_id_to_name.get(key) or key
-            
-            # 根据字段类型转换数据格式
-            if input_type == "select" or field_type == 3:
-                # 单选：转为字符串
-                fields[field_name] = str(value) if value else ""
-            elif input_type == "multiselect" or field_type == 4:
-                # 多选：确保是列表格式
-                if isinstance(value, list):
-                    fields[field_name] = value
-                else:
-                    fields[field_name] = [str(value)] if value else []
-            elif input_type == "date" or field_type == 5:
-                # 日期：转为时间戳（毫秒）
-                if isinstance(value, (int, float)):
-                    fields[field_name] = int(value)
-                elif isinstance(value, str):
-                    try:
-                        dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
-                        fields[field_name] = int(dt.timestamp() * 1000)
-                    except:
-                        fields[field_name] = value
-                else:
-                    fields[field_name] = value
-            elif input_type == "number" or field_type == 2:
-                # 数字
-                try:
-                    fields[field_name] = float(value) if '.' in str(value) else int(value)
-                except:
-                    fields[field_name] = value
-            elif input_type == "checkbox" or field_type == 7:
-                # 复选框：布尔值
-                fields[field_name] = bool(value)
-            else:
-                # 文本、电话、邮箱、URL 等直接使用字符串
-                fields[field_name] = str(value)
+        fields.update(convert_submit_fields(extra_data, field_map, field_id_to_name))
         
         # 根据 record_index 决定是更新还是创建记录
         # record_index=0 表示创建新记录，>0 表示更新对应索引的记录
         record_id = None
         record_index = form.record_index  # 不再默认为1，允许0表示创建新记录
         
-        # 如果 record_index > 0，尝试获取对应的记录ID
+        # 如果 record_index > 0，优先使用缓存的 record_id，没有时再按索引解析并缓存
         if record_index > 0:
-            try:
-                target_record_id = get_bitable_record_by_index(
-                    form.app_token, 
-                    form.table_id, 
-                    record_index, 
-                    base_token
-                )
-                if target_record_id:
-                    record_id = target_record_id
-                    log_to_file(f"[Form Submit] Found existing record at index {record_index}: {target_record_id}")
-            except Exception as e:
-                log_to_file(f"[Form Submit] Failed to get record by index {record_index}: {e}")
-                # 如果获取失败，继续创建新记录
+            record_id = form.record_id
+            if not record_id:
+                try:
+                    target_record_id = await feishu_async_client.get_bitable_record_by_index(
+                        form.app_token, 
+                        form.table_id, 
+                        record_index, 
+                        base_token
+                    )
+                    if target_record_id:
+                        record_id = target_record_id
+                        form.record_id = target_record_id
+                        await run_in_threadpool(update_form, session_factory, form_id, record_id=target_record_id)
+                        log_to_file(f"[Form Submit] Found existing record at index {record_index}: {target_record_id}")
+                except Exception as e:
+                    log_to_file(f"[Form Submit] Failed to get record by index {record_index}: {e}")
+                    # 如果获取失败，继续创建新记录
         
         # 创建或更新多维表格记录
         try:
             if record_id:
                 log_to_file(f"[Form Submit] Updating record {record_id}")
-                record_id = update_bitable_record(form.app_token, form.table_id, record_id, fields, base_token)
+                try:
+                    record_id = await feishu_async_client.update_bitable_record(form.app_token, form.table_id, record_id, fields, base_token)
+                except Exception as update_err:
+                    if not is_record_not_found_error(update_err):
+                        raise
+                    # 缓存的 record_id 已失效（记录被删除），重新按索引解析一次
+                    log_to_file(f"[Form Submit] Cached record {record_id} not found, re-resolving index {record_index}")
+                    record_id = await feishu_async_client.get_bitable_record_by_index(
+                        form.app_token, form.table_id, record_index, base_token
+                    )
+                    form.record_id = record_id
+                    await run_in_threadpool(update_form, session_factory, form_id, record_id=record_id)
+                    if record_id:
+                        record_id = await feishu_async_client.update_bitable_record(form.app_token, form.table_id, record_id, fields, base_token)
+                    else:
+                        record_id = await feishu_async_client.create_bitable_record(form.app_token, form.table_id, fields, base_token)
                 log_to_file(f"[Form Submit] Record updated successfully: {record_id}")
             else:
                 log_to_file(f"[Form Submit] Creating new record")
-                record_id = create_bitable_record(form.app_token, form.table_id, fields, base_token)
+                record_id = await feishu_async_client.create_bitable_record(form.app_token, form.table_id, fields, base_token)
                 log_to_file(f"[Form Submit] Record created successfully: {record_id}")
         except Exception as e:
             error_str = str(e)
@@ -905,9 +1216,10 @@ async def submit_form(
             if "1254045" in error_str or "FieldNameNotFound" in error_str:
                 print(f"[Form Submit] Field not found, attempting auto-repair for form {form_id}")
                 try:
-                    # 获取最新字段列表
+                    # 获取最新字段列表（先使表结构缓存失效，确保拿到最新结构）
+                    feishu_cache.invalidate_table_schema(form.app_token, form.table_id)
                     log_to_file(f"[Form Submit] Fetching table fields...")
-                    table_fields = get_table_fields(form.app_token, form.table_id, base_token)
+                    table_fields = await feishu_async_client.get_table_fields_cached(form.app_token, form.table_id, base_token)
                     log_to_file(f"[Form Submit] Got {len(table_fields)} fields")
                     
                     # 打印所有字段的简要信息
@@ -989,16 +1301,16 @@ async def submit_form(
                         # 重试创建或更新记录
                         try:
                             if record_id:
-                                record_id = update_bitable_record(form.app_token, form.table_id, record_id, fields, base_token)
+                                record_id = await feishu_async_client.update_bitable_record(form.app_token, form.table_id, record_id, fields, base_token)
                             else:
-                                record_id = create_bitable_record(form.app_token, form.table_id, fields, base_token)
+                                record_id = await feishu_async_client.create_bitable_record(form.app_token, form.table_id, fields, base_token)
                         except Exception as retry_err:
                             log_to_file(f"[Form Submit] Retry failed: {retry_err}")
                             raise retry_err
                         
                         # 如果成功，更新数据库
                         form.signature_field_id = new_field_id
-                        db.commit()
+                        await run_in_threadpool(update_form, session_factory, form_id, signature_field_id=new_field_id)
                         log_to_file(f"[Form Submit] Auto-repair successful, updated form config")
                     else:
                         print(f"[Form Submit] No suitable new attachment field found (all match old ID or none exist)")
@@ -1010,35 +1322,12 @@ async def submit_form(
             else:
                 raise e  # 其他错误，直接抛出
         
-        # 扣除创建者的配额
+        # 扣除创建者的配额，更新提交计数
         user_key = form.created_by
-        if user_key:
-            ensure_user_database(user_key)
-            user_db = get_user_session(user_key)
-            try:
-                if "::" in user_key:
-                    open_id_val, tenant_key_val = user_key.split("::")
-                    # 消耗 1 次额度
-                    ok = quota_service.consume_quota(
-                        user_db, 
-                        db, 
-                        open_id=open_id_val, 
-                        tenant_key=tenant_key_val, 
-                        file_token=file_token,
-                        file_name=f"外链表单签名_{form_id}.png"
-                    )
-                else:
-                    log_to_file(f"[Form Submit] Invalid user_key format: {user_key}, skipping quota deduction")
-                    ok = True
-                if not ok:
-                    log_to_file(f"[Form Submit] Quota insufficient for user {user_key}")
-                    raise HTTPException(status_code=402, detail="NO_QUOTA")
-            finally:
-                user_db.close()
-
-        # 更新提交计数
-        form.submit_count += 1
-        db.commit()
+        ok = await run_in_threadpool(consume_form_quota, session_factory, form_id, user_key, file_token)
+        if not ok:
+            log_to_file(f"[Form Submit] Quota insufficient for user {user_key}")
+            raise HTTPException(status_code=402, detail="NO_QUOTA")
         
         return {
             "success": True,
@@ -1105,14 +1394,31 @@ def delete_form(
 
 
 @router.get("/proxy/media/{form_id}/{file_token}")
-async def proxy_media(form_id: str, file_token: str, db: Session = Depends(get_db)):
-    """代理获取飞书媒体文件（使用表单创建者的授权码）"""
+async def proxy_media(
+    request: Request,
+    form_id: str,
+    file_token: str,
+    session_factory: sessionmaker = Depends(get_session_factory),
+):
+    """
+    代理获取飞书媒体文件（使用表单创建者的授权码，file_token 内容不可变，命中本地缓存直接返回）
+
+    数据库查询和磁盘缓存读写都在线程池中执行，不阻塞事件循环，下载期间也不占用数据库连接
+    """
     try:
         # 1. 查找表单以获取授权码
-        form = db.query(SignForm).filter(SignForm.form_id == form_id).first()
+        form = await run_in_threadpool(load_form, session_factory, form_id)
         if not form:
             log_to_file(f"[Proxy Media] Form not found: {form_id}")
             raise HTTPException(status_code=404, detail="表单不存在")
+        
+        # 2. 浏览器已缓存 / 本地磁盘缓存命中（按表单隔离，只命中经由本表单授权取到的文件）
+        cache_headers = media_cache.cache_headers(form_id, file_token)
+        if request.headers.get("if-none-match") == cache_headers["ETag"]:
+            return Response(status_code=304, headers=cache_headers)
+        cached = await run_in_threadpool(media_cache.lookup, form_id, file_token)
+        if cached:
+            return FileResponse(cached.path, media_type=cached.content_type, headers=cache_headers)
             
         base_token = form.creator_base_token
         log_to_file(f"[Proxy Media] Form {form_id}, base_token exists: {bool(base_token)}, length: {len(base_token) if base_token else 0}")
@@ -1126,8 +1432,9 @@ async def proxy_media(form_id: str, file_token: str, db: Session = Depends(get_d
             headers_list.append(("creator_base_token", auth_service.get_base_authorization_header(base_token)))
         
         # 方式2: 尝试使用服务端 tenant_access_token（如果配置了）
+        # 刷新 token 时会加文件锁/Redis 锁并同步请求飞书，放到线程池执行，避免阻塞事件循环
         try:
-            service_headers = auth_service.get_auth_header()
+            service_headers = await run_in_threadpool(auth_service.get_auth_header)
             log_to_file(f"[Proxy Media] Trying service tenant_access_token")
             headers_list.append(("service_token", service_headers))
         except Exception as e:
@@ -1136,24 +1443,35 @@ async def proxy_media(form_id: str, file_token: str, db: Session = Depends(get_d
         if not headers_list:
             raise HTTPException(status_code=403, detail="未配置授权码")
 
-        url = f"https://open.feishu.cn/open-apis/drive/v1/medias/{file_token}/download"
+        url = auth_service.get_open_api_url(f"/open-apis/drive/v1/medias/{file_token}/download")
         log_to_file(f"[Proxy Media] Requesting: {url}")
         
         # 尝试所有认证方式
         last_error = None
         for auth_type, headers in headers_list:
+            # 该认证方式近期持续鉴权失败（熔断中），跳过
+            if feishu_breaker.is_open(feishu_breaker.breaker_key(url, headers)[0], ("media",)):
+                log_to_file(f"[Proxy Media] Skipping {auth_type}: circuit open")
+                last_error = f"{auth_type}: circuit open"
+                continue
             try:
                 log_to_file(f"[Proxy Media] Trying {auth_type}...")
-                r = requests.get(url, headers=headers, stream=True, timeout=10)
+                r = await feishu_async_client.open_stream(url, headers=headers, timeout=10)
                 
                 if r.status_code == 200:
                     log_to_file(f"[Proxy Media] Success with {auth_type}: {file_token}")
+                    content_type = r.headers.get("Content-Type", "application/octet-stream")
+                    # 边返回给客户端边写入磁盘缓存
                     return StreamingResponse(
-                        r.iter_content(chunk_size=8192), 
-                        media_type=r.headers.get("Content-Type", "application/octet-stream")
+                        media_cache.stream_and_store(form_id, file_token, r.aiter_bytes(chunk_size=8192), content_type),
+                        media_type=content_type,
+                        headers=cache_headers,
+                        background=BackgroundTask(r.aclose)
                     )
                 else:
-                    log_to_file(f"[Proxy Media] {auth_type} failed: {r.status_code} {r.text[:200]}")
+                    body = await r.aread()
+                    await r.aclose()
+                    log_to_file(f"[Proxy Media] {auth_type} failed: {r.status_code} {body[:200]!r}")
                     last_error = f"{auth_type}: {r.status_code}"
             except Exception as e:
                 log_to_file(f"[Proxy Media] {auth_type} exception: {e}")
@@ -4,13 +4,13 @@ import uuid
 import logging
 from typing import Optional
 
-import requests
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, Depends
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import RedirectResponse, JSONResponse, HTMLResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, sessionmaker
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -119,6 +119,17 @@ async def startup_event():
         logger.error(f"Failed to initialize database tables: {e}")
         # 不抛出异常，允许应用继续启动（表可能已存在）
 
+    # 补齐旧版本主库缺少的列和表（user_databases.db_host、user_database_pool），多个 worker 同时执行也是安全的
+    from user_db_manager import ensure_master_schema
+    try:
+        ensure_master_schema()
+    except Exception as e:
+        logger.error(f"Failed to upgrade master database schema: {e}")
+
+    # 后台预建空闲用户库（USER_DB_SPARE_POOL_SIZE > 0 时）
+    from user_db_manager import start_spare_provisioner
+    start_spare_provisioner()
+
 
 # CORS 配置
 # 生产环境应设置 CORS_ORIGINS 环境变量，如 "https://example.com,https://app.example.com"
@@ -137,7 +148,7 @@ app.add_middleware(
 
 # 导入数据库模块（用于配额检查）
 try:
-    from database import get_db
+    from database import get_db, get_session_factory
     import quota_service
     DB_AVAILABLE = True
     logger.info("Database module loaded successfully")
@@ -153,6 +164,11 @@ try:
 except ImportError as e:
     logger.error(f"Auth service module failed to load: {e}")
 
+# 导入共享的飞书 HTTP 客户端（连接池）
+import feishu_client
+import feishu_async_client
+import feishu_upload
+
 # 导入认证依赖
 try:
     from auth_dependencies import get_current_user_info
@@ -168,6 +184,35 @@ USER_TOKENS = {}
 
 # ===== Upload signature =====
 
+def _check_can_sign(session_factory, open_id: str, tenant_key: str) -> dict:
+    """检查本地配额（短会话，在线程池中执行）"""
+    from user_db_manager import ensure_user_database, get_user_session
+    user_key = f"{open_id}::{tenant_key}"
+    ensure_user_database(user_key)
+    db = session_factory()
+    user_db = get_user_session(user_key)
+    try:
+        # 传入 shared_db (db)
+        return quota_service.check_can_sign(user_db, db, open_id, tenant_key)
+    finally:
+        user_db.close()
+        db.close()
+
+
+def _consume_sign_quota(session_factory, open_id: str, tenant_key: str, file_token: str, file_name: str) -> None:
+    """扣除本地配额（短会话，在线程池中执行）"""
+    from user_db_manager import ensure_user_database, get_user_session
+    user_key = f"{open_id}::{tenant_key}"
+    ensure_user_database(user_key)
+    db = session_factory()
+    user_db = get_user_session(user_key)
+    try:
+        quota_service.consume_quota(user_db, db, open_id, tenant_key, file_token, file_name)
+    finally:
+        user_db.close()
+        db.close()
+
+
 @app.post("/api/sign/upload", tags=["签名"], summary="上传签名文件")
 async def upload_signature(
     request: Request,
@@ -176,7 +221,7 @@ async def upload_signature(
     folder_token: str = Form(..., min_length=1, description="目标文件夹 token（必填）"),
     has_quota: int = Form(0, description="飞书官方付费权益 (1=有权益, 0=无)"),
     user_info: dict = Depends(get_current_user_info),
-    db: Session = Depends(get_db),
+    session_factory: sessionmaker = Depends(get_session_factory),
 ):
     """
     上传签名文件到飞书云空间（使用授权码模式）。
@@ -205,25 +250,18 @@ async def upload_signature(
         logger.info(f"Feishu official quota valid for {open_id}, skipping local quota check")
         consume_quota_after = False
     elif DB_AVAILABLE:
-        from user_db_manager import ensure_user_database, get_user_session
-        user_key = f"{open_id}::{tenant_key}"
-        ensure_user_database(user_key)
-        user_db = get_user_session(user_key)
-        try:
-            # 传入 shared_db (db)
-            chk = quota_service.check_can_sign(user_db, db, open_id, tenant_key)
-            if not chk["can_sign"]:
-                raise HTTPException(status_code=402, detail="NO_QUOTA")
-            consume_quota_after = chk.get("consume_quota", True)
-        finally:
-            user_db.close()
+        # 数据库读写放到线程池，不阻塞事件循环
+        chk = await run_in_threadpool(_check_can_sign, session_factory, open_id, tenant_key)
+        if not chk["can_sign"]:
+            raise HTTPException(status_code=402, detail="NO_QUOTA")
+        consume_quota_after = chk.get("consume_quota", True)
     else:
         logger.warning("Database not available, skipping quota check")
         consume_quota_after = False
 
-    # 2) 读取文件内容 (不再保存本地存档)
-    content = await file.read()
-    if not content:
+    # 2) 检查文件大小 (不再保存本地存档；大文件分片上传，不一次性读入内存)
+    file_size = await feishu_upload.get_upload_size(file)
+    if not file_size:
         raise HTTPException(status_code=400, detail="EMPTY_FILE")
     
     local_path = None  # 不再使用本地路径
@@ -250,77 +288,41 @@ async def upload_signature(
     parent_node = folder_token
     logger.info(f"Using folder_token: {folder_token}")
 
-    # 使用 Open API 域名（Drive API 专用）
-    url_upload = auth_service.get_open_api_url("/open-apis/drive/v1/files/upload_all")
-    
-    file_size = len(content)
-    form_data = {
-        "file_name": file_name,
-        "parent_type": parent_type,
-        "parent_node": parent_node,
-        "size": str(file_size),
-    }
-
-    files = {"file": (file_name, content, file.content_type or "image/png")}
-    
-    logger.info(f"Uploading to Feishu Base API: url={url_upload}, folder={parent_node}")
-    
+    # 4) 上传：20MB 以内 upload_all，超过时分片上传（逐块读取，单个分片失败自动重试）
+    logger.info(f"Uploading to Feishu: size={file_size}, folder={parent_node}")
     try:
-        r = requests.post(
-            url_upload,
-            data=form_data,
-            files=files,
-            headers=headers,
-            timeout=30
+        file_token = await feishu_upload.upload_file(
+            auth_service.get_open_api_url(feishu_upload.FILES_API_PATH),
+            headers,
+            file,
+            file_name,
+            parent_type,
+            parent_node,
+            file.content_type or "image/png",
         )
-        logger.info(f"Feishu response: status={r.status_code}")
-        if r.status_code != 200:
-            # 记录详细错误信息
-            try:
-                error_data = r.json()
-                logger.error(f"Feishu API error details: {error_data}")
-            except:
-                logger.error(f"Feishu API error (non-JSON): {r.text[:500]}")
     except Exception as e:
-        logger.error(f"Upload request exception: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"upload request failed: {str(e)}")
-
-    # 4) 解析响应
-    if r.status_code != 200:
-        try:
-            error_detail = r.json()
-        except:
-            error_detail = r.text[:200]
-        raise HTTPException(status_code=500, detail=f"upload_all failed: status={r.status_code}, detail={error_detail}")
-    
-    try:
-        data = r.json()
-    except:
-        raise HTTPException(status_code=500, detail="upload_all response is not valid JSON")
-
-    if data.get("code") != 0:
-        raise HTTPException(status_code=500, detail=f"upload_all failed: {data}")
-
-    d = data.get("data") or {}
-    file_token = d.get("file_token") or d.get("token")
+        logger.error(f"Upload failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"upload failed: {str(e)}")
     if not file_token:
         raise HTTPException(status_code=500, detail="no file_token in response")
 
     # 5) 消耗配额
     if consume_quota_after and DB_AVAILABLE:
-        from user_db_manager import ensure_user_database, get_user_session
-        user_key = f"{open_id}::{tenant_key}"
-        ensure_user_database(user_key)
-        user_db = get_user_session(user_key)
-        try:
-            quota_service.consume_quota(user_db, db, open_id, tenant_key, file_token, file_name)
-        finally:
-            user_db.close()
+        await run_in_threadpool(_consume_sign_quota, session_factory, open_id, tenant_key, file_token, file_name)
 
     return {"file_token": file_token, "local_path": local_path}
 
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭时释放飞书 HTTP 连接池，停止空闲用户库补充线程"""
+    feishu_client.close_all()
+    await feishu_async_client.aclose()
+    from user_db_manager import stop_spare_provisioner
+    stop_spare_provisioner()
+
+
 # Health check
 
 # Health check
@@ -0,0 +1,244 @@
+"""
+媒体文件磁盘缓存模块
+- 飞书附件（签名图片）上传后内容不可变，按 (表单, file_token) 缓存到本地磁盘
+  （缓存和 ETag 按表单隔离：通过某个表单取到的文件，不能经由其他表单的代理地址直接命中）
+- 缓存目录总大小超过上限时按最近访问时间（LRU）淘汰；上限针对整个目录（多个 worker 共用），
+  各进程定期从磁盘重新统计总大小，淘汰时以磁盘扫描结果为准
+- 未命中时边向客户端输出边写入磁盘，写完后原子替换，避免读到半个文件
+- lookup 等同步函数会访问磁盘，异步调用方应放到线程池执行；stream_and_store 内部的磁盘写入已在线程池中进行
+"""
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+from dataclasses import dataclass
+from threading import Lock
+from typing import AsyncIterator, Dict, Any, Optional
+
+from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# 缓存目录和容量上限
+MEDIA_CACHE_DIR = os.getenv("MEDIA_CACHE_DIR") or os.path.join(os.path.dirname(__file__), "cache", "media")
+MEDIA_CACHE_MAX_BYTES = int(os.getenv("MEDIA_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))  # 1GB
+# 淘汰时清理到上限的比例，避免每次写入都触发淘汰
+MEDIA_CACHE_EVICT_TARGET = 0.9
+# 从磁盘重新统计目录总大小的间隔（秒），计入其他 worker 写入的文件
+MEDIA_CACHE_RESCAN_SECONDS = int(os.getenv("MEDIA_CACHE_RESCAN_SECONDS", "60"))
+# 浏览器缓存时间（内容不可变，可长期缓存）
+MEDIA_CACHE_MAX_AGE = int(os.getenv("MEDIA_CACHE_MAX_AGE", str(365 * 24 * 3600)))
+
+_lock = Lock()
+_evict_lock = Lock()  # 同一进程内同时只有一个线程执行淘汰
+_total_bytes: Optional[int] = None  # 缓存目录总大小：扫描磁盘得到，其间累加本进程的写入
+_scanned_at = 0.0
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+
+@dataclass
+class CachedMedia:
+    """命中的缓存文件"""
+    path: str
+    content_type: str
+    size: int
+
+
+def _key(scope: str, file_token: str) -> str:
+    return hashlib.sha256(f"{scope}:{file_token}".encode("utf-8")).hexdigest()
+
+
+def _data_path(key: str) -> str:
+    return os.path.join(MEDIA_CACHE_DIR, f"{key}.bin")
+
+
+def _meta_path(key: str) -> str:
+    return os.path.join(MEDIA_CACHE_DIR, f"{key}.json")
+
+
+def make_etag(scope: str, file_token: str) -> str:
+    """强 ETag：file_token 对应的内容不会变化"""
+    return f'"{_key(scope, file_token)[:32]}"'
+
+
+def cache_headers(scope: str, file_token: str) -> Dict[str, str]:
+    """媒体响应的缓存头"""
+    return {
+        "ETag": make_etag(scope, file_token),
+        "Cache-Control": f"public, max-age={MEDIA_CACHE_MAX_AGE}, immutable",
+    }
+
+
+def _scan_total_bytes() -> int:
+    total = 0
+    if not os.path.isdir(MEDIA_CACHE_DIR):
+        return 0
+    for entry in os.scandir(MEDIA_CACHE_DIR):
+        if entry.name.endswith(".bin"):
+            try:
+                total += entry.stat().st_size
+            except OSError:
+                pass
+    return total
+
+
+def _ensure_initialized() -> None:
+    global _total_bytes, _scanned_at
+    if _total_bytes is None:
+        with _lock:
+            if _total_bytes is None:
+                os.makedirs(MEDIA_CACHE_DIR, exist_ok=True)
+                _total_bytes = _scan_total_bytes()
+                _scanned_at = time.monotonic()
+
+
+def _refresh_total_bytes() -> None:
+    """从磁盘重新统计目录总大小（扫描时不持有锁）"""
+    global _total_bytes, _scanned_at
+    total = _scan_total_bytes()
+    with _lock:
+        _total_bytes = total
+        _scanned_at = time.monotonic()
+
+
+def lookup(scope: str, file_token: str) -> Optional[CachedMedia]:
+    """
+    查找缓存文件，命中时刷新访问时间（用于 LRU）
+
+    Args:
+        scope: 缓存隔离范围（表单 ID），只命中同一表单取到并缓存的文件
+        file_token: 飞书文件 token
+
+    Returns:
+        CachedMedia，未命中返回 None
+    """
+    _ensure_initialized()
+    key = _key(scope, file_token)
+    path = _data_path(key)
+    try:
+        with open(_meta_path(key), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        size = os.path.getsize(path)
+        os.utime(path, None)
+    except (OSError, ValueError):
+        _stats["misses"] += 1
+        return None
+
+    _stats["hits"] += 1
+    return CachedMedia(path=path, content_type=meta.get("content_type") or "application/octet-stream", size=size)
+
+
+async def stream_and_store(scope: str, file_token: str, chunks: AsyncIterator[bytes], content_type: str) -> AsyncIterator[bytes]:
+    """
+    透传上游数据块给客户端，同时写入临时文件；完整读取后原子替换为缓存文件
+
+    客户端中途断开或上游出错时删除临时文件，不会留下不完整的缓存
+    """
+    await run_in_threadpool(_ensure_initialized)
+    key = _key(scope, file_token)
+    tmp_path = os.path.join(MEDIA_CACHE_DIR, f"{key}.{uuid.uuid4().hex}.tmp")
+    size = 0
+    completed = False
+    f = await run_in_threadpool(open, tmp_path, "wb")
+    try:
+        async for chunk in chunks:
+            await run_in_threadpool(f.write, chunk)
+            size += len(chunk)
+            yield chunk
+        completed = True
+    finally:
+        if completed:
+            await run_in_threadpool(f.close)
+            await run_in_threadpool(_commit, key, tmp_path, content_type, size)
+        else:
+            # 客户端断开时任务可能正在取消，清理只做不等待线程池的本地操作
+            f.close()
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+def _commit(key: str, tmp_path: str, content_type: str, size: int) -> None:
+    """将写完的临时文件放入缓存并按需淘汰"""
+    global _total_bytes
+    data_path = _data_path(key)
+    try:
+        old_size = os.path.getsize(data_path) if os.path.exists(data_path) else 0
+        with open(_meta_path(key), "w", encoding="utf-8") as f:
+            json.dump({"content_type": content_type, "size": size}, f)
+        os.replace(tmp_path, data_path)
+    except OSError as e:
+        logger.warning(f"Failed to store media cache {key}: {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return
+
+    with _lock:
+        _total_bytes += size - old_size
+        _stats["stores"] += 1
+        stale = time.monotonic() - _scanned_at >= MEDIA_CACHE_RESCAN_SECONDS
+    if stale:
+        _refresh_total_bytes()
+    if _total_bytes > MEDIA_CACHE_MAX_BYTES:
+        _evict()
+
+
+def _evict() -> None:
+    """
+    按最近访问时间淘汰，直到目录总大小降到上限的 90%
+
+    在线程池中执行（见 stream_and_store）；扫描和删除文件时不持有 _lock，不阻塞缓存查询和写入。
+    总大小以本次扫描结果为准，其他 worker 写入的文件也计算在内
+    """
+    global _total_bytes, _scanned_at
+    if not _evict_lock.acquire(blocking=False):
+        return
+    try:
+        entries = []
+        for entry in os.scandir(MEDIA_CACHE_DIR):
+            if entry.name.endswith(".bin"):
+                try:
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.name[:-len(".bin")]))
+                except OSError:
+                    pass
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        target = MEDIA_CACHE_MAX_BYTES * MEDIA_CACHE_EVICT_TARGET
+        evicted = 0
+        for _, size, key in entries:
+            if total <= target:
+                break
+            for path in (_meta_path(key), _data_path(key)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+            evicted += 1
+
+        with _lock:
+            _total_bytes = total
+            _scanned_at = time.monotonic()
+            _stats["evictions"] += evicted
+        logger.info(f"Media cache evicted {evicted} files, {total} bytes remain")
+    finally:
+        _evict_lock.release()
+
+
+def get_stats() -> Dict[str, Any]:
+    """缓存统计信息"""
+    return {
+        **_stats,
+        "bytes": _total_bytes or 0,
+        "max_bytes": MEDIA_CACHE_MAX_BYTES,
+        "dir": MEDIA_CACHE_DIR,
+    }
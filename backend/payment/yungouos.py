@@ -9,12 +9,13 @@ YunGouOS 支付宝支付服务
 import hashlib
 import time
 import uuid
-import requests
 import base64
 from typing import Dict, Any, Optional
 import os
 from dotenv import load_dotenv
 
+import feishu_client
+
 load_dotenv()
 
 
@@ -104,7 +105,7 @@ class YunGouOSPayment:
         logger.info(f"Connecting to YunGouOS Native: {url} with params: {params}")
         
         try:
-            response = requests.post(url, data=params, timeout=30)
+            response = feishu_client.post(url, data=params, timeout=30)
             result = response.json()
             logger.info(f"YunGouOS Native Response: {result}")
             
@@ -113,7 +114,7 @@ class YunGouOSPayment:
                 # 核心修复：后端代理下载图片并转为 Base64
                 # 这样可以解决飞书安全域名限制和 HTTP/HTTPS 协议冲突问题
                 try:
-                    img_resp = requests.get(qr_url, timeout=10)
+                    img_resp = feishu_client.get(qr_url, timeout=10)
                     if img_resp.status_code == 200:
                         base64_data = base64.b64encode(img_resp.content).decode('utf-8')
                         # 返回完整的 Data URI 格式
@@ -181,7 +182,7 @@ class YunGouOSPayment:
         logger.info(f"Connecting to YunGouOS H5: {url} with params: {params}")
         
         try:
-            response = requests.post(url, data=params, timeout=30)
+            response = feishu_client.post(url, data=params, timeout=30)
             result = response.json()
             logger.info(f"YunGouOS H5 Response: {result}")
             
@@ -221,7 +222,7 @@ class YunGouOSPayment:
         logger.info(f"Query parameters: {params}")
         
         try:
-            response = requests.get(url, params=params, timeout=30)
+            response = feishu_client.get(url, params=params, timeout=30)
             result = response.json()
             logger.info(f"YunGouOS Query Response: {result}")
             
@@ -4,16 +4,19 @@
 
 约定（混合模式）：
 - 套餐/订单/邀请码/定价等仍使用共享库（Base）
-- 用户剩余签字次数等配额状态，存放在每用户独立数据库的 user_profile（UserProfile）中
+- 用户剩余签字次数等配额状态，存放在每用户独立数据库的 user_profile（UserProfile）中；
+  consolidated 模式下存放在主库 user_profiles（ConsolidatedUserProfile）
 """
 import uuid
 from datetime import datetime, timedelta
 from typing import Dict, Any
 
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from dateutil.relativedelta import relativedelta
 
 from database import InviteCode, Order, SignatureLog, PricingPlan, UserProfile
+from user_db_manager import get_profile_model
 
 # 新用户初始免费次数
 FREE_TRIAL_QUOTA = 20
@@ -97,17 +100,19 @@ def get_or_create_user_profile(user_db: Session, open_id: str, tenant_key: str)
     """
     在用户独立库中获取或创建 user_profile
     
-    注意：每个用户独立数据库应该只有一条记录，因为数据库本身就是按用户隔离的
+    注意：每个用户独立数据库应该只有一条记录，因为数据库本身就是按用户隔离的；
+    consolidated 模式下 user_db 会话只能看到该用户的记录（见 user_db_manager.get_user_session）
     """
+    profile_model = get_profile_model()
     # 先尝试根据 open_id 和 tenant_key 精确查询
-    user = user_db.query(UserProfile).filter(
-        UserProfile.open_id == open_id,
-        UserProfile.tenant_key == tenant_key
+    user = user_db.query(profile_model).filter(
+        profile_model.open_id == open_id,
+        profile_model.tenant_key == tenant_key
     ).first()
     
     if not user:
         # 如果没找到，检查是否有其他记录（可能是旧数据）
-        existing = user_db.query(UserProfile).first()
+        existing = user_db.query(profile_model).first()
         if existing:
             # 发现不匹配的记录，这不应该发生
             import logging
@@ -125,7 +130,7 @@ def get_or_create_user_profile(user_db: Session, open_id: str, tenant_key: str)
             return existing
         
         # 创建新记录
-        user = UserProfile(
+        user = profile_model(
             open_id=open_id,
             tenant_key=tenant_key,
             remaining_quota=FREE_TRIAL_QUOTA,
@@ -139,7 +144,15 @@ def get_or_create_user_profile(user_db: Session, open_id: str, tenant_key: str)
             invite_expire_at=None,
         )
         user_db.add(user)
-        user_db.commit()
+        try:
+            user_db.commit()
+        except IntegrityError:
+            # consolidated 模式下 user_key 唯一，并发创建时以先写入的记录为准
+            user_db.rollback()
+            return user_db.query(profile_model).filter(
+                profile_model.open_id == open_id,
+                profile_model.tenant_key == tenant_key
+            ).one()
         user_db.refresh(user)
     
     return user
@@ -0,0 +1,225 @@
+"""
+在线迁移工具：拆分哈希碰撞的用户数据库
+- 旧命名规则 feishu_user_<md5 前 8 位> 在用户量大时会碰撞，多个用户共用同一个库，
+  quota_service 会把 user_profile 改写为最后访问的用户，导致额度数据错乱
+- 本工具在主库 user_databases 中查找登记到同一个库（同一分片上的同名库）的多个用户：
+  库中 user_profile 记录的用户（没有 profile 时取最早登记的用户）保留原库，
+  其余用户分配新命名规则的库（feishu_user_<sha256 前 24 位>），建库建表后修改登记
+- 修改登记前，把被迁出用户的数据复制到新库：
+  user_profile 按 open_id/tenant_key 归属；用户库 orders 表没有用户字段，按共享库 orders.user_key 查出订单号归属
+- 签名记录、表单配置等表无法区分归属，留在原库；原库中没有该用户 profile 的用户会被列出，
+  其 profile 会在下次访问时重新生成，请人工核对
+- 服务不需要停机：各 worker 的库名缓存最迟 USER_DB_NAME_CACHE_TTL 秒后过期，之后切换到新库；
+  脚本等待缓存过期后再从原库删除已复制的记录（这段时间内按旧库名写入原库的变化不会同步到新库）
+
+执行方式：
+cd backend
+python scripts/migrate_colliding_user_databases.py            # 只列出碰撞情况，不做修改
+python scripts/migrate_colliding_user_databases.py --apply    # 执行迁移
+"""
+import os
+import sys
+import time
+import argparse
+import logging
+
+# 添加项目根目录到 Python 路径
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from sqlalchemy import create_engine, text
+from database import Order, SessionLocal, UserBase, UserOrder, UserProfile
+from user_db_manager import (
+    DEFAULT_SHARD, USER_DB_NAME_CACHE_TTL, get_master_engine, new_user_db_name, shard_server_url, _split_user_key,
+)
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def find_collisions(conn):
+    """返回 {(db_name, 分片): [user_key, ...]}，只包含同一分片上登记了多个用户的库（不同分片上的同名库互不相干）"""
+    rows = conn.execute(text("""
+        SELECT d.db_name, COALESCE(d.db_host, :default_shard) AS shard, d.user_key
+        FROM user_databases d
+        JOIN (
+            SELECT db_name, COALESCE(db_host, :default_shard) AS shard FROM user_databases
+            GROUP BY db_name, COALESCE(db_host, :default_shard) HAVING COUNT(*) > 1
+        ) c ON c.db_name = d.db_name AND c.shard = COALESCE(d.db_host, :default_shard)
+        ORDER BY d.db_name, shard, d.created_at, d.id
+    """), {"default_shard": DEFAULT_SHARD}).fetchall()
+    groups = {}
+    for db_name, shard, user_key in rows:
+        groups.setdefault((db_name, shard), []).append(user_key)
+    return groups
+
+
+def pick_owner(db_name, shard, user_keys):
+    """库中 user_profile 记录的用户保留原库；没有 profile 或不在登记用户中时取最早登记的用户"""
+    engine = create_engine(shard_server_url(shard, db_name), echo=False)
+    try:
+        with engine.connect() as conn:
+            row = conn.execute(text("SELECT open_id, tenant_key FROM user_profile ORDER BY id LIMIT 1")).fetchone()
+    except Exception:
+        row = None
+    finally:
+        engine.dispose()
+    if row:
+        for user_key in user_keys:
+            if _split_user_key(user_key) == (row[0], row[1]):
+                return user_key
+    return user_keys[0]
+
+
+def create_database(db_name, shard):
+    """在分片上创建用户库并初始化表结构（已存在时只补建缺失的表）"""
+    server_engine = create_engine(shard_server_url(shard), echo=False)
+    try:
+        with server_engine.connect() as conn:
+            conn.execute(text(f"CREATE DATABASE IF NOT EXISTS `{db_name}` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci"))
+            conn.commit()
+    finally:
+        server_engine.dispose()
+
+    db_engine = create_engine(shard_server_url(shard, db_name), echo=False)
+    try:
+        UserBase.metadata.create_all(bind=db_engine)
+    finally:
+        db_engine.dispose()
+
+
+def user_order_ids(user_key):
+    """共享库 orders 中属于该用户的订单号（用户库的 orders 表没有用户字段，按订单号归属）"""
+    db = SessionLocal()
+    try:
+        return [row[0] for row in db.query(Order.order_id).filter(Order.user_key == user_key).all()]
+    finally:
+        db.close()
+
+
+def _user_filters(user_key, order_ids):
+    open_id, tenant_key = _split_user_key(user_key)
+    profiles = UserProfile.__table__
+    orders = UserOrder.__table__
+    return (
+        (profiles.c.open_id == open_id) & (profiles.c.tenant_key == tenant_key),
+        orders.c.order_id.in_(order_ids),
+    )
+
+
+def copy_user_data(user_key, shard, source_db, target_db, order_ids):
+    """把用户的 profile 和订单从原库复制到新库，返回 (profile 条数, 订单条数)"""
+    profiles = UserProfile.__table__
+    orders = UserOrder.__table__
+    profile_filter, order_filter = _user_filters(user_key, order_ids)
+
+    source_engine = create_engine(shard_server_url(shard, source_db), echo=False)
+    target_engine = create_engine(shard_server_url(shard, target_db), echo=False)
+    try:
+        with source_engine.connect() as src:
+            profile_rows = [
+                dict(row) for row in
+                src.execute(profiles.select().where(profile_filter).order_by(profiles.c.id).limit(1)).mappings()
+            ]
+            order_rows = []
+            if order_ids:
+                order_rows = [dict(row) for row in src.execute(orders.select().where(order_filter)).mappings()]
+        # 新库刚建好、登记尚未指向它，不会有其他写入
+        with target_engine.begin() as dst:
+            if profile_rows:
+                dst.execute(profiles.insert(), profile_rows)
+            if order_rows:
+                dst.execute(orders.insert(), order_rows)
+    finally:
+        source_engine.dispose()
+        target_engine.dispose()
+    return len(profile_rows), len(order_rows)
+
+
+def delete_user_data(user_key, shard, db_name, order_ids):
+    """从原库删除已复制到新库的 profile 和订单"""
+    profile_filter, order_filter = _user_filters(user_key, order_ids)
+    engine = create_engine(shard_server_url(shard, db_name), echo=False)
+    try:
+        with engine.begin() as conn:
+            conn.execute(UserProfile.__table__.delete().where(profile_filter))
+            if order_ids:
+                conn.execute(UserOrder.__table__.delete().where(order_filter))
+    finally:
+        engine.dispose()
+
+
+def migrate(apply: bool):
+    master_engine = get_master_engine()
+    with master_engine.connect() as conn:
+        groups = find_collisions(conn)
+        if not groups:
+            logger.info("✅ 没有发生碰撞的用户数据库")
+            return
+
+        logger.info(f"发现 {len(groups)} 个碰撞的用户数据库，涉及 {sum(len(v) for v in groups.values())} 个用户")
+        moved = []
+        for (db_name, shard), user_keys in groups.items():
+            owner = pick_owner(db_name, shard, user_keys)
+            logger.info(f"{db_name}（{shard}）: 保留给 {owner}")
+
+            for user_key in user_keys:
+                if user_key == owner:
+                    continue
+                target = new_user_db_name(user_key)
+                logger.info(f"  {user_key}: {db_name} -> {target}")
+                if not apply:
+                    continue
+
+                # 新库与原库在同一分片
+                create_database(target, shard)
+                order_ids = user_order_ids(user_key)
+                profile_count, order_count = copy_user_data(user_key, shard, db_name, target, order_ids)
+                # 只在登记仍指向原库时修改，避免覆盖并发的其他变更
+                result = conn.execute(
+                    text("""
+                        UPDATE user_databases SET db_name = :target, db_created = TRUE
+                        WHERE user_key = :user_key AND db_name = :db_name AND COALESCE(db_host, :default_shard) = :shard
+                    """),
+                    {"target": target, "user_key": user_key, "db_name": db_name, "shard": shard, "default_shard": DEFAULT_SHARD},
+                )
+                conn.commit()
+                if result.rowcount != 1:
+                    logger.warning(f"  {user_key}: 登记已变化，跳过（新库 {target} 未启用）")
+                    continue
+                logger.info(f"  {user_key}: 已复制 {profile_count} 条 profile、{order_count} 条订单")
+                moved.append((user_key, shard, db_name, target, order_ids, profile_count))
+
+        if not apply:
+            logger.info("以上为预览，未做修改；确认后加 --apply 执行")
+            return
+
+        logger.info(f"✅ 迁移完成，共迁出 {len(moved)} 个用户")
+        missing = [m for m in moved if m[5] == 0]
+        if missing:
+            logger.warning("以下用户在原库中没有自己的 profile，新库中的 profile 会在下次访问时重新生成，请人工核对：")
+            for user_key, _, db_name, target, _, _ in missing:
+                logger.warning(f"  {user_key}: 原库 {db_name}，新库 {target}")
+
+    if moved:
+        # 等各 worker 的库名缓存过期、不再按旧库名访问这些用户后，再清理原库中的记录
+        logger.info(f"等待 {USER_DB_NAME_CACHE_TTL} 秒（库名缓存过期）后从原库删除已迁出用户的记录")
+        time.sleep(USER_DB_NAME_CACHE_TTL)
+        for user_key, shard, db_name, _, order_ids, _ in moved:
+            delete_user_data(user_key, shard, db_name, order_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="拆分哈希碰撞的用户数据库")
+    parser.add_argument("--apply", action="store_true", help="执行迁移（默认只预览）")
+    args = parser.parse_args()
+    migrate(args.apply)
+
+
+if __name__ == "__main__":
+    main()
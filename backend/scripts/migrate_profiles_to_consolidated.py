@@ -0,0 +1,160 @@
+"""
+数据迁移脚本：把每用户独立数据库中的 user_profile 迁移到主库 user_profiles 表（consolidated 模式）
+- 按主库 user_databases 的 id 分批读取登记的用户库，按登记分片（db_host）分组，
+  从各分片读取 profile 后写入主库 user_profiles（可从中断处继续）
+- 只复制 open_id/tenant_key 与登记用户一致的记录，发生过哈希碰撞的库不会把别人的额度迁过来
+- 用户库不存在或没有 user_profile 表时跳过
+- 独立库中的 invite_codes/orders/signature_logs/sign_forms 表未被使用，不迁移
+
+切换步骤（最后一次复制必须在停写期间、以 --overwrite 执行，之后才能以 consolidated 模式对外服务）：
+1. 保持 USER_PROFILE_STORAGE=per_user_db 正常服务，执行本脚本做预复制（可反复执行，缩短第 3 步耗时）
+2. 进入维护窗口：停止所有服务进程（或前端挂维护页），确保不再有请求写入用户独立库
+3. 带 --overwrite 执行最后一次，以独立库为准覆盖第 1 步之后发生变化的额度
+4. 设置 USER_PROFILE_STORAGE=consolidated 后启动服务，结束维护窗口
+注意：不能先切换到 consolidated 再补迁移。切换后用户首次访问会在 user_profiles 生成默认记录，
+不带 --overwrite 时该记录被视为已存在而跳过，独立库中的剩余额度会丢失；
+带 --overwrite 时又会覆盖切换后产生的新消耗
+
+执行方式：
+cd backend
+python scripts/migrate_profiles_to_consolidated.py
+python scripts/migrate_profiles_to_consolidated.py --overwrite --batch-size 500 --start-id 10000
+"""
+import os
+import sys
+import argparse
+import logging
+
+# 添加项目根目录到 Python 路径
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from user_db_manager import DEFAULT_SHARD, USER_PROFILE_STORAGE, get_master_engine, init_consolidated_profile_table, shard_server_url
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PROFILE_COLUMNS = [
+    "open_id", "tenant_key", "remaining_quota", "total_used", "current_plan_id",
+    "plan_expires_at", "plan_quota_reset_at", "is_unlimited", "invite_code_used",
+    "invite_expire_at", "total_paid", "created_at", "updated_at",
+]
+
+
+def read_profile_sql(db_name: str) -> str:
+    return f"""
+        SELECT {", ".join(PROFILE_COLUMNS)} FROM `{db_name}`.user_profile
+        WHERE open_id = :open_id AND tenant_key = :tenant_key
+        ORDER BY id LIMIT 1
+    """
+
+
+def upsert_profile_sql(overwrite: bool) -> str:
+    columns = ", ".join(PROFILE_COLUMNS)
+    values = ", ".join(f":{c}" for c in PROFILE_COLUMNS)
+    if overwrite:
+        on_duplicate = ", ".join(f"{c} = VALUES({c})" for c in PROFILE_COLUMNS)
+    else:
+        on_duplicate = "user_key = user_key"
+    return f"""
+        INSERT INTO user_profiles (user_key, {columns})
+        VALUES (:user_key, {values})
+        ON DUPLICATE KEY UPDATE {on_duplicate}
+    """
+
+
+def migrate_one(conn, src, user_key, open_id, tenant_key, db_name, overwrite, counts):
+    """把一个用户的 profile 从分片连接 src 读出，写入主库连接 conn（随批次提交）"""
+    # pymysql 连接带 CLIENT_FOUND_ROWS，ON DUPLICATE KEY UPDATE 的 rowcount 无法区分新插入和未变化，先查一次
+    exists = conn.execute(
+        text("SELECT 1 FROM user_profiles WHERE user_key = :user_key"), {"user_key": user_key}
+    ).fetchone()
+    if exists and not overwrite:
+        counts["existing"] += 1
+        return
+
+    # 读取在分片连接上进行，出错只影响该用户，不会撤销主库中本批已写入的记录
+    try:
+        profile = src.execute(
+            text(read_profile_sql(db_name)), {"open_id": open_id, "tenant_key": tenant_key}
+        ).mappings().first()
+    except (OperationalError, ProgrammingError) as e:
+        # 1049: 库不存在；1146: 表不存在
+        src.rollback()
+        logger.warning(f"跳过 {user_key}（{db_name}）: {e.orig}")
+        counts["missing_db"] += 1
+        return
+
+    if profile is None:
+        counts["no_profile"] += 1
+        return
+    conn.execute(text(upsert_profile_sql(overwrite)), {"user_key": user_key, **profile})
+    counts["updated" if exists else "copied"] += 1
+
+
+def migrate_profiles(batch_size: int, start_id: int, overwrite: bool):
+    if USER_PROFILE_STORAGE == "consolidated":
+        logger.warning("当前 USER_PROFILE_STORAGE=consolidated：服务若已在该模式下运行，user_profiles 中可能已有新数据，"
+                       "请确认已按文件头的步骤在停写期间执行")
+    master_engine = get_master_engine()
+    shard_engines = {}
+    counts = {"copied": 0, "updated": 0, "existing": 0, "no_profile": 0, "missing_db": 0}
+
+    try:
+        with master_engine.connect() as conn:
+            init_consolidated_profile_table(conn)
+
+            last_id = start_id
+            while True:
+                rows = conn.execute(
+                    text("""
+                        SELECT id, user_key, open_id, tenant_key, db_name, db_host FROM user_databases
+                        WHERE id > :last_id AND db_created = TRUE
+                        ORDER BY id LIMIT :limit
+                    """),
+                    {"last_id": last_id, "limit": batch_size},
+                ).fetchall()
+                if not rows:
+                    break
+
+                # 用户库可能在不同分片上，按登记分片分组，从对应分片读取
+                by_shard = {}
+                for row in rows:
+                    by_shard.setdefault(row[5] or DEFAULT_SHARD, []).append(row)
+
+                for shard, shard_rows in by_shard.items():
+                    if shard not in shard_engines:
+                        shard_engines[shard] = create_engine(shard_server_url(shard), pool_pre_ping=True, echo=False)
+                    with shard_engines[shard].connect() as src:
+                        for _, user_key, open_id, tenant_key, db_name, _ in shard_rows:
+                            migrate_one(conn, src, user_key, open_id, tenant_key, db_name, overwrite, counts)
+
+                conn.commit()
+                last_id = rows[-1][0]
+                logger.info(f"已处理到 user_databases.id={last_id}: {counts}")
+    finally:
+        for engine in shard_engines.values():
+            engine.dispose()
+
+    logger.info(f"✅ 迁移完成: {counts}")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把用户独立库的 user_profile 迁移到主库 user_profiles")
+    parser.add_argument("--batch-size", type=int, default=200, help="每批处理的用户数")
+    parser.add_argument("--start-id", type=int, default=0, help="从 user_databases.id 大于该值处开始（用于中断后继续）")
+    parser.add_argument("--overwrite", action="store_true", help="user_profiles 中已有记录时以独立库为准覆盖")
+    args = parser.parse_args()
+    migrate_profiles(args.batch_size, args.start_id, args.overwrite)
+
+
+if __name__ == "__main__":
+    main()
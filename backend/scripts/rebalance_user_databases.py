@@ -0,0 +1,206 @@
+"""
+在线迁移工具：在分片之间移动用户数据库
+- --plan：按当前 USER_DB_SHARDS 的一致性哈希环，列出登记分片（user_databases.db_host）与应在分片不一致的用户
+- --apply：逐个移动这些用户；--user-key/--to：把单个用户移动到指定分片
+
+移动单个用户库的步骤：
+1. 在目标分片建库建表并复制全部数据（源库仍可读写）
+2. 把源库设为只读（ALTER SCHEMA ... READ ONLY = 1，需要 MySQL 8.0.22+）；
+   仍按旧位置访问的 worker 写入会失败，并清除库名缓存、下次请求重新解析位置
+3. 再复制一次（源库不再变化，以此为准），然后修改主库登记的 db_host
+4. 源库保留为只读；加 --drop-source 时等待 USER_DB_NAME_CACHE_TTL 秒（各 worker 缓存过期）后删除
+用户库只有少量数据，单个用户的只读窗口很短；consolidated 模式下没有用户库，无需执行
+
+执行方式：
+cd backend
+python scripts/rebalance_user_databases.py --plan
+python scripts/rebalance_user_databases.py --apply --limit 100
+python scripts/rebalance_user_databases.py --apply --drop-source
+python scripts/rebalance_user_databases.py --user-key "ou_xxx::tenant_xxx" --to shard1
+"""
+import os
+import sys
+import time
+import argparse
+import logging
+
+# 添加项目根目录到 Python 路径
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from sqlalchemy import create_engine, inspect, text
+from database import UserBase
+from user_db_manager import (
+    DEFAULT_SHARD, USER_DB_NAME_CACHE_TTL, USER_PROFILE_STORAGE,
+    get_master_engine, get_shard_address, shard_for_user, shard_server_url,
+)
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def plan_moves(conn, batch_size=500):
+    """按 id 分批扫描已创建的用户库，返回 [(user_key, db_name, 当前分片, 目标分片)]"""
+    moves = []
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            text("""
+                SELECT id, user_key, db_name, db_host FROM user_databases
+                WHERE id > :last_id AND db_created = TRUE
+                ORDER BY id LIMIT :limit
+            """),
+            {"last_id": last_id, "limit": batch_size},
+        ).fetchall()
+        if not rows:
+            return moves
+        for _, user_key, db_name, db_host in rows:
+            source = db_host or DEFAULT_SHARD
+            target = shard_for_user(user_key)
+            if source != target:
+                moves.append((user_key, db_name, source, target))
+        last_id = rows[-1][0]
+
+
+def copy_database(db_name, source, target):
+    """把源分片上的用户库完整复制到目标分片（目标库中已有的数据先清空）"""
+    server_engine = create_engine(shard_server_url(target), echo=False)
+    try:
+        with server_engine.connect() as conn:
+            conn.execute(text(f"CREATE DATABASE IF NOT EXISTS `{db_name}` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci"))
+            conn.commit()
+    finally:
+        server_engine.dispose()
+
+    source_engine = create_engine(shard_server_url(source, db_name), echo=False)
+    target_engine = create_engine(shard_server_url(target, db_name), echo=False)
+    try:
+        UserBase.metadata.create_all(bind=target_engine)
+        source_tables = set(inspect(source_engine).get_table_names())
+        with source_engine.connect() as src, target_engine.begin() as dst:
+            for table in UserBase.metadata.sorted_tables:
+                dst.execute(table.delete())
+                if table.name not in source_tables:
+                    continue
+                rows = [dict(row) for row in src.execute(table.select()).mappings()]
+                if rows:
+                    dst.execute(table.insert(), rows)
+    finally:
+        source_engine.dispose()
+        target_engine.dispose()
+
+
+def set_read_only(shard, db_name, read_only: bool):
+    engine = create_engine(shard_server_url(shard), echo=False)
+    try:
+        with engine.connect() as conn:
+            conn.execute(text(f"ALTER SCHEMA `{db_name}` READ ONLY = {1 if read_only else 0}"))
+            conn.commit()
+    finally:
+        engine.dispose()
+
+
+def drop_database(shard, db_name):
+    engine = create_engine(shard_server_url(shard), echo=False)
+    try:
+        with engine.connect() as conn:
+            # 只读库不能直接删除，先解除只读
+            conn.execute(text(f"ALTER SCHEMA `{db_name}` READ ONLY = 0"))
+            conn.execute(text(f"DROP DATABASE IF EXISTS `{db_name}`"))
+            conn.commit()
+    finally:
+        engine.dispose()
+
+
+def move_user(conn, user_key, db_name, source, target) -> bool:
+    """把一个用户库从 source 分片移动到 target 分片，返回是否已切换登记"""
+    get_shard_address(target)  # 目标分片未配置时直接报错
+
+    copy_database(db_name, source, target)
+    set_read_only(source, db_name, True)
+    try:
+        copy_database(db_name, source, target)
+        result = conn.execute(
+            text("""
+                UPDATE user_databases SET db_host = :target
+                WHERE user_key = :user_key AND db_name = :db_name AND COALESCE(db_host, :default_shard) = :source
+            """),
+            {"target": target, "user_key": user_key, "db_name": db_name, "source": source, "default_shard": DEFAULT_SHARD},
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        set_read_only(source, db_name, False)
+        raise
+
+    if result.rowcount != 1:
+        # 登记已被其他操作修改，放弃本次移动
+        set_read_only(source, db_name, False)
+        logger.warning(f"  {user_key}: 登记已变化，跳过")
+        return False
+    logger.info(f"  {user_key}: {db_name} {source} -> {target}")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在分片之间移动用户数据库")
+    parser.add_argument("--plan", action="store_true", help="只列出需要移动的用户")
+    parser.add_argument("--apply", action="store_true", help="移动所有不在应在分片上的用户")
+    parser.add_argument("--limit", type=int, default=0, help="本次最多移动的用户数（0 不限）")
+    parser.add_argument("--user-key", help="只移动指定用户")
+    parser.add_argument("--to", help="配合 --user-key 指定目标分片")
+    parser.add_argument("--drop-source", action="store_true", help="等待库名缓存过期后删除源库")
+    args = parser.parse_args()
+
+    if USER_PROFILE_STORAGE == "consolidated":
+        logger.info("consolidated 模式下没有用户独立库，无需移动")
+        return
+
+    master_engine = get_master_engine()
+    with master_engine.connect() as conn:
+        if args.user_key:
+            row = conn.execute(
+                text("SELECT db_name, db_host FROM user_databases WHERE user_key = :user_key"),
+                {"user_key": args.user_key},
+            ).fetchone()
+            if not row:
+                logger.error(f"❌ 用户未登记: {args.user_key}")
+                return
+            target = args.to or shard_for_user(args.user_key)
+            moves = [(args.user_key, row[0], row[1] or DEFAULT_SHARD, target)]
+            moves = [m for m in moves if m[2] != m[3]]
+        else:
+            moves = plan_moves(conn)
+
+        logger.info(f"需要移动 {len(moves)} 个用户库")
+        if args.plan or not (args.apply or args.user_key):
+            for user_key, db_name, source, target in moves:
+                logger.info(f"  {user_key}: {db_name} {source} -> {target}")
+            return
+
+        if args.limit:
+            moves = moves[:args.limit]
+        moved = []
+        for user_key, db_name, source, target in moves:
+            try:
+                if move_user(conn, user_key, db_name, source, target):
+                    moved.append((db_name, source))
+            except Exception as e:
+                logger.error(f"❌ {user_key} 移动失败: {e}")
+
+    logger.info(f"✅ 已移动 {len(moved)} 个用户库")
+    if args.drop_source and moved:
+        logger.info(f"等待 {USER_DB_NAME_CACHE_TTL} 秒（库名缓存过期）后删除源库")
+        time.sleep(USER_DB_NAME_CACHE_TTL)
+        for db_name, source in moved:
+            drop_database(source, db_name)
+            logger.info(f"  已删除 {source} 上的 {db_name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,14 @@
+"""
+把旧共享库 users 表中的用户登记到主库 user_databases
+
+- 已登记的用户不做修改（登记的库名和分片以主库为准，可能已被迁移脚本调整过）
+- 未登记的用户按首次访问时相同的规则分配并登记（user_db_manager.get_user_db_location）：
+  属于该用户的旧库沿用并登记在 default 分片，否则按一致性哈希选分片、领取空闲库或使用新命名
+
+执行方式：
+cd backend
+python scripts/sync_user_databases_from_shared_users.py
+"""
 import logging
 import os
 import sys
@@ -10,7 +21,7 @@ BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
 if BACKEND_DIR not in sys.path:
     sys.path.insert(0, BACKEND_DIR)
 
-from user_db_manager import init_master_database, get_master_engine, get_user_db_name  # noqa: E402
+from user_db_manager import init_master_database, get_master_engine, get_user_db_location  # noqa: E402
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -40,43 +51,23 @@ def main():
         return
 
     master_engine = get_master_engine()
-    inserted = 0
-    updated = 0
+    registered = 0
+    existing = 0
 
     with master_engine.connect() as conn:
         for user_key, open_id, tenant_key in rows:
-            db_name = get_user_db_name(user_key)
-
-            # upsert（MySQL）
-            res = conn.execute(
-                text(
-                    """
-                    INSERT INTO user_databases (user_key, open_id, tenant_key, db_name, db_created, created_at, last_active_at)
-                    VALUES (:user_key, :open_id, :tenant_key, :db_name, FALSE, NOW(), NOW())
-                    ON DUPLICATE KEY UPDATE
-                        open_id = VALUES(open_id),
-                        tenant_key = VALUES(tenant_key),
-                        db_name = VALUES(db_name),
-                        last_active_at = NOW()
-                    """
-                ),
-                {
-                    "user_key": user_key,
-                    "open_id": open_id,
-                    "tenant_key": tenant_key,
-                    "db_name": db_name,
-                },
-            )
-
-            # rowcount 在不同驱动上可能不精确，这里只做粗略统计
-            if res.rowcount == 1:
-                inserted += 1
-            else:
-                updated += 1
-
-        conn.commit()
-
-    logger.info(f"同步完成：插入约 {inserted} 条，更新约 {updated} 条（总用户 {len(rows)}）")
+            found = conn.execute(
+                text("SELECT 1 FROM user_databases WHERE user_key = :user_key"), {"user_key": user_key}
+            ).fetchone()
+            if found:
+                existing += 1
+                continue
+            # 显式登记：分配库名和分片（与首次访问时相同），写入 user_databases
+            db_name, shard = get_user_db_location(user_key)
+            logger.info(f"登记 {user_key}: {db_name}（{shard}）")
+            registered += 1
+
+    logger.info(f"同步完成：新登记 {registered} 个，已登记 {existing} 个（总用户 {len(rows)}）")
 
 
 if __name__ == "__main__":
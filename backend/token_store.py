@@ -0,0 +1,170 @@
+"""
+共享令牌存储模块
+- 多个 uvicorn worker 共享 tenant_access_token，避免每个 worker 各自刷新
+- 默认使用本地文件存储（fcntl 文件锁），同一台机器上的 worker 共享
+- 可选 Redis 存储（多机部署时使用，需安装 redis 包）
+- 通过 FEISHU_TOKEN_STORE 环境变量选择：file / redis / memory
+"""
+import os
+import json
+import time
+import uuid
+import logging
+from contextlib import contextmanager
+from threading import Lock
+from typing import Any, Dict, Iterator, Optional
+
+from dotenv import load_dotenv
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，退化为进程内锁
+    fcntl = None
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# 存储类型：file（默认）/ redis / memory
+FEISHU_TOKEN_STORE = os.getenv("FEISHU_TOKEN_STORE", "file").lower()
+# 文件存储路径
+FEISHU_TOKEN_STORE_PATH = os.getenv("FEISHU_TOKEN_STORE_PATH") or os.path.join(
+    os.path.dirname(__file__), "cache", "feishu_token.json"
+)
+# Redis 连接地址和键前缀
+FEISHU_TOKEN_REDIS_URL = os.getenv("FEISHU_TOKEN_REDIS_URL", "redis://localhost:6379/0")
+FEISHU_TOKEN_REDIS_PREFIX = os.getenv("FEISHU_TOKEN_REDIS_PREFIX", "feishu:")
+# 跨进程刷新锁的最长持有时间（秒），防止持锁进程异常退出后死锁
+FEISHU_TOKEN_LOCK_TIMEOUT = int(os.getenv("FEISHU_TOKEN_LOCK_TIMEOUT", "30"))
+
+
+class TokenStore:
+    """令牌存储基类（进程内存储，不跨 worker 共享）"""
+
+    name = "memory"
+
+    def __init__(self):
+        self._data: Dict[str, Dict[str, Any]] = {}
+        self._lock = Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取令牌信息，不存在返回 None"""
+        return self._data.get(key)
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        """写入令牌信息"""
+        self._data[key] = value
+
+    @contextmanager
+    def lock(self, key: str) -> Iterator[None]:
+        """刷新锁：同一时间只有一个持有者刷新令牌"""
+        with self._lock:
+            yield
+
+
+class FileTokenStore(TokenStore):
+    """
+    本地文件令牌存储
+    - 读写整个 JSON 文件，写入时原子替换
+    - 刷新锁使用 fcntl.flock 独占锁（同机多 worker 生效）
+    """
+
+    name = "file"
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def _read_all(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+                return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self._read_all().get(key)
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        data = self._read_all()
+        data[key] = value
+        tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Failed to write token store {self.path}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    @contextmanager
+    def lock(self, key: str) -> Iterator[None]:
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.lock_path, "a") as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class RedisTokenStore(TokenStore):
+    """Redis 令牌存储（多机共享），刷新锁使用 Redis 分布式锁"""
+
+    name = "redis"
+
+    def __init__(self, url: str, prefix: str = FEISHU_TOKEN_REDIS_PREFIX):
+        super().__init__()
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("FEISHU_TOKEN_STORE=redis 需要安装 redis 包：pip install redis")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return None
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return None
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        expire = value.get("expire")
+        ttl = None
+        if expire:
+            ttl = max(int(expire - time.time()), 1)
+        self.client.set(self.prefix + key, json.dumps(value), ex=ttl)
+
+    @contextmanager
+    def lock(self, key: str) -> Iterator[None]:
+        with self._lock:
+            with self.client.lock(
+                f"{self.prefix}{key}:lock",
+                timeout=FEISHU_TOKEN_LOCK_TIMEOUT,
+                blocking_timeout=FEISHU_TOKEN_LOCK_TIMEOUT,
+            ):
+                yield
+
+
+def create_token_store() -> TokenStore:
+    """按 FEISHU_TOKEN_STORE 配置创建令牌存储"""
+    if FEISHU_TOKEN_STORE == "redis":
+        store: TokenStore = RedisTokenStore(FEISHU_TOKEN_REDIS_URL)
+    elif FEISHU_TOKEN_STORE == "memory":
+        store = TokenStore()
+    else:
+        store = FileTokenStore(FEISHU_TOKEN_STORE_PATH)
+    logger.info(f"Using {store.name} token store")
+    return store
@@ -3,16 +3,19 @@
 实现每用户独立数据库的动态创建和连接
 """
 import os
+import time
+import uuid
+import bisect
 import hashlib
 import logging
-from typing import Optional, Dict
-from functools import lru_cache
+from typing import Any, Dict, List, Optional, Set, Tuple
 from collections import OrderedDict
-from threading import Lock
+from threading import Event, Lock, Thread
 
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import sessionmaker, Session, with_loader_criteria
 from sqlalchemy.engine import Engine
 
 load_dotenv()
@@ -25,36 +28,396 @@ MYSQL_USER = os.getenv("MYSQL_USER", "root")
 MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD", "")
 MASTER_DB_NAME = "feishu_master"
 
-# 使用 LRU 缓存限制连接池数量
+# 用户库连接模式：
+# - per_user（默认）：每个用户库一个引擎和连接池，连接数随活跃用户数增长
+# - shared：所有用户库共用一个连接池（连接不指定库），通过 schema_translate_map
+#   把表名限定为 `用户库.表名`，连接数只随并发增长
+USER_DB_POOL_MODE = os.getenv("USER_DB_POOL_MODE", "per_user").lower()
+USER_DB_SHARED_POOL_SIZE = int(os.getenv("USER_DB_SHARED_POOL_SIZE", "20"))
+USER_DB_SHARED_MAX_OVERFLOW = int(os.getenv("USER_DB_SHARED_MAX_OVERFLOW", "20"))
+
+# 用户库分片：USER_DB_SHARDS=shard0=10.0.0.1:3306,shard1=10.0.0.2:3306（账号密码与 MYSQL_USER/MYSQL_PASSWORD 相同）
+# - 新用户按 user_key 一致性哈希分配到配置的分片，分片名登记在主库 user_databases.db_host
+# - default 分片始终是 MYSQL_HOST:MYSQL_PORT；db_host 为空的旧登记属于 default 分片
+# - 未配置时所有用户库都在 default 分片；要让 MYSQL_HOST 继续接收新用户，在配置中列出 default=MYSQL_HOST:MYSQL_PORT
+DEFAULT_SHARD = "default"
+USER_DB_SHARD_VNODES = int(os.getenv("USER_DB_SHARD_VNODES", "100"))
+
+
+def _parse_shards(spec: str) -> Dict[str, Tuple[str, str]]:
+    """解析 USER_DB_SHARDS：name=host:port,name=host:port"""
+    shards = {}
+    for item in spec.split(","):
+        name, _, address = item.strip().partition("=")
+        if name and address:
+            host, _, port = address.partition(":")
+            shards[name.strip()] = (host.strip(), port.strip() or "3306")
+    return shards
+
+
+USER_DB_SHARDS = _parse_shards(os.getenv("USER_DB_SHARDS", ""))
+_shard_addresses: Dict[str, Tuple[str, str]] = {**USER_DB_SHARDS, DEFAULT_SHARD: (MYSQL_HOST, MYSQL_PORT)}
+_ring_points: List[int] = []
+_ring_owners: List[str] = []
+
+# 使用 LRU 缓存限制连接池数量；会话工厂随引擎一起缓存和淘汰
 MAX_CACHED_ENGINES = 100
 _user_engines: OrderedDict[str, Engine] = OrderedDict()
 _user_session_factories: Dict[str, sessionmaker] = {}
 _engines_lock = Lock()
+_engine_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_shared_user_engines: Dict[str, Engine] = {}
 
+# 用户库位置解析缓存（user_key -> (db_name, 分片, 过期时间)，以主库 user_databases 为准）
+USER_DB_NAME_HASH_LENGTH = 24
+USER_DB_NAME_CACHE_SIZE = int(os.getenv("USER_DB_NAME_CACHE_SIZE", "100000"))
+# 缓存有效期（秒）：迁移工具修改登记后，各 worker 最迟在该时间后切换到新库
+USER_DB_NAME_CACHE_TTL = int(os.getenv("USER_DB_NAME_CACHE_TTL", "300"))
+_db_name_cache: OrderedDict[str, Tuple[str, str, float]] = OrderedDict()
+_db_name_lock = Lock()
+_db_name_stats = {"hits": 0, "misses": 0}
 
-def get_user_db_name(user_key: str) -> str:
+# 主库（feishu_master）连接池
+MASTER_DB_POOL_SIZE = int(os.getenv("MASTER_DB_POOL_SIZE", "5"))
+MASTER_DB_MAX_OVERFLOW = int(os.getenv("MASTER_DB_MAX_OVERFLOW", "10"))
+_master_engine: Optional[Engine] = None
+_master_session_factory: Optional[sessionmaker] = None
+_master_lock = Lock()
+
+# 用户配置存储方式：
+# - per_user_db（默认）：database.UserProfile，存放在每用户独立数据库的 user_profile 表
+# - consolidated：database.ConsolidatedUserProfile，存放在主库 user_profiles 表（按 user_key 分区），不再为每个用户建库
+USER_PROFILE_STORAGE = os.getenv("USER_PROFILE_STORAGE", "per_user_db").lower()
+USER_PROFILE_PARTITIONS = int(os.getenv("USER_PROFILE_PARTITIONS", "16"))
+_profile_session_factory: Optional[sessionmaker] = None
+_profile_table_ready = False
+
+# 预建的空闲用户库（主库 user_database_pool 表）：后台线程在每个分片上保持 USER_DB_SPARE_POOL_SIZE 个
+# 已建好表的空闲库，新用户直接领取并登记，不再同步建库建表；为 0 时关闭
+USER_DB_SPARE_POOL_SIZE = int(os.getenv("USER_DB_SPARE_POOL_SIZE", "0"))
+USER_DB_SPARE_CHECK_SECONDS = float(os.getenv("USER_DB_SPARE_CHECK_SECONDS", "10"))
+SPARE_PROVISIONER_LOCK = "feishu_user_db_provisioner"
+_spare_stats = {"claimed": 0, "misses": 0, "provisioned": 0, "errors": 0}
+_spare_lock = Lock()
+_spare_stop = Event()
+_spare_thread: Optional[Thread] = None
+
+# 已确认存在的用户数据库（进程内登记），命中时 ensure_user_database 不再探测连接
+# 首次使用时从主库 user_databases 表加载；连接时报库不存在或连接失效则移除，下次重新探测
+KNOWN_DB_SEED_RETRY_SECONDS = int(os.getenv("KNOWN_DB_SEED_RETRY_SECONDS", "60"))
+MYSQL_UNKNOWN_DATABASE = 1049  # MySQL 错误码：Unknown database
+MYSQL_SCHEMA_READ_ONLY = 3989  # MySQL 错误码：库为只读（分片迁移中）
+_known_databases: Set[str] = set()
+_known_lock = Lock()
+_known_seeded = False
+_known_seed_retry_at = 0.0
+_known_stats = {"hits": 0, "probes": 0, "created": 0, "invalidated": 0, "seeded": 0}
+
+
+def _hash_point(value: str) -> int:
+    return int.from_bytes(hashlib.sha256(value.encode()).digest()[:8], "big")
+
+
+def _build_ring() -> None:
+    """一致性哈希环：每个分片 USER_DB_SHARD_VNODES 个虚拟节点"""
+    shards = list(USER_DB_SHARDS) or [DEFAULT_SHARD]
+    points = sorted((_hash_point(f"{shard}#{i}"), shard) for shard in shards for i in range(USER_DB_SHARD_VNODES))
+    _ring_points[:] = [point for point, _ in points]
+    _ring_owners[:] = [shard for _, shard in points]
+
+
+_build_ring()
+
+
+def shard_for_user(user_key: str) -> str:
+    """按一致性哈希计算 user_key 应在的分片（分配新用户时使用，已登记用户以 user_databases.db_host 为准）"""
+    index = bisect.bisect(_ring_points, _hash_point(user_key)) % len(_ring_points)
+    return _ring_owners[index]
+
+
+def get_shard_address(shard: Optional[str]) -> Tuple[str, str]:
+    """分片名 -> (host, port)；为空时为 default 分片"""
+    address = _shard_addresses.get(shard or DEFAULT_SHARD)
+    if address is None:
+        raise KeyError(f"Unknown user database shard: {shard}")
+    return address
+
+
+def shard_server_url(shard: Optional[str], db_name: str = "") -> str:
+    """分片 MySQL 服务的连接地址（db_name 为空时不指定库）"""
+    host, port = get_shard_address(shard)
+    return f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{host}:{port}/{db_name}?charset=utf8mb4"
+
+
+def legacy_user_db_name(user_key: str) -> str:
+    """旧命名规则：feishu_user_<md5 前 8 位>（32 位哈希，用户量大时会碰撞）"""
+    hash_value = hashlib.md5(user_key.encode()).hexdigest()[:8]
+    return f"feishu_user_{hash_value}"
+
+
+def new_user_db_name(user_key: str) -> str:
+    """新命名规则：feishu_user_<sha256 前 24 位>（96 位哈希）"""
+    hash_value = hashlib.sha256(user_key.encode()).hexdigest()[:USER_DB_NAME_HASH_LENGTH]
+    return f"feishu_user_{hash_value}"
+
+
+def _split_user_key(user_key: str) -> Tuple[str, str]:
+    parts = user_key.split("::")
+    open_id = parts[0] if len(parts) > 0 else ""
+    tenant_key = parts[1] if len(parts) > 1 else ""
+    return open_id, tenant_key
+
+
+def _legacy_database_belongs_to(conn, db_name: str, user_key: str) -> bool:
+    """
+    未登记的旧库是否属于该用户：库存在，且 user_profile 为空或记录的就是该用户
+
+    库中是其他用户的 profile 时说明发生了哈希碰撞，不能复用
+    """
+    exists = conn.execute(
+        text("SELECT SCHEMA_NAME FROM information_schema.SCHEMATA WHERE SCHEMA_NAME = :db_name"),
+        {"db_name": db_name},
+    ).fetchone()
+    if not exists:
+        return False
+    try:
+        row = conn.execute(text(f"SELECT open_id, tenant_key FROM `{db_name}`.user_profile LIMIT 1")).fetchone()
+    except Exception:
+        conn.rollback()
+        return True  # 表还没建好，视为空库
+    return row is None or (row[0], row[1]) == _split_user_key(user_key)
+
+
+def _resolve_user_db_location(user_key: str) -> Tuple[str, str]:
+    """
+    从主库 user_databases 查找用户库名和分片
+
+    未登记时分配并登记：旧库属于该用户则沿用（在 default 分片），否则使用新命名、按一致性哈希选分片
+    """
+    master_engine = get_master_engine()
+    with master_engine.connect() as conn:
+        row = conn.execute(
+            text("SELECT db_name, db_host FROM user_databases WHERE user_key = :user_key"),
+            {"user_key": user_key},
+        ).fetchone()
+        if row:
+            return row[0], row[1] or DEFAULT_SHARD
+
+        legacy_name = legacy_user_db_name(user_key)
+        owner = conn.execute(
+            text("SELECT user_key FROM user_databases WHERE db_name = :db_name LIMIT 1"),
+            {"db_name": legacy_name},
+        ).fetchone()
+        db_created = owner is None and _legacy_database_belongs_to(conn, legacy_name, user_key)
+        open_id, tenant_key = _split_user_key(user_key)
+        if db_created:
+            db_name, shard = legacy_name, DEFAULT_SHARD
+        else:
+            shard = shard_for_user(user_key)
+            spare = _claim_spare_database(conn, user_key, open_id, tenant_key, shard)
+            if spare is not None:
+                return spare, shard
+            db_name = new_user_db_name(user_key)
+
+        # 先登记（新库 db_created = FALSE，创建后更新），多个 worker 同时分配时以先写入的为准
+        conn.execute(
+            text("""
+                INSERT INTO user_databases (user_key, open_id, tenant_key, db_name, db_host, db_created, created_at, last_active_at)
+                VALUES (:user_key, :open_id, :tenant_key, :db_name, :db_host, :db_created, NOW(), NOW())
+                ON DUPLICATE KEY UPDATE user_key = user_key
+            """),
+            {
+                "user_key": user_key, "open_id": open_id, "tenant_key": tenant_key,
+                "db_name": db_name, "db_host": shard, "db_created": db_created,
+            },
+        )
+        conn.commit()
+        row = conn.execute(
+            text("SELECT db_name, db_host FROM user_databases WHERE user_key = :user_key"),
+            {"user_key": user_key},
+        ).fetchone()
+        logger.info(f"Assigned user database {row[0]} on shard {row[1]} to {user_key}")
+        return row[0], row[1] or DEFAULT_SHARD
+
+
+def _supports_skip_locked(conn) -> bool:
+    """数据库是否支持 SELECT ... FOR UPDATE SKIP LOCKED"""
+    version = conn.dialect.server_version_info or ()
+    if getattr(conn.dialect, "is_mariadb", False):
+        return version >= (10, 6)
+    return version >= (8, 0, 1)
+
+
+def _claim_spare_database(conn, user_key: str, open_id: str, tenant_key: str, shard: str) -> Optional[str]:
+    """
+    从空闲库池领取一个库并登记给用户（同一事务），返回库名；池为空或出错时返回 None（回退为现场建库）
+
+    多个 worker 同时为同一用户领取时，登记的唯一键冲突，后到的回滚，领取的库留在池中
+    """
+    if USER_DB_SPARE_POOL_SIZE <= 0:
+        return None
+    # SKIP LOCKED 需要 MySQL 8.0.1+ / MariaDB 10.6+；旧版本退化为 FOR UPDATE（并发领取时排队等待行锁）
+    lock_clause = "FOR UPDATE SKIP LOCKED" if _supports_skip_locked(conn) else "FOR UPDATE"
+    try:
+        conn.commit()  # 结束前面查询开启的事务，领取在独立事务中进行
+        row = conn.execute(
+            text(f"""
+                SELECT id, db_name FROM user_database_pool
+                WHERE db_host = :shard AND claimed_by IS NULL
+                ORDER BY id LIMIT 1
+                {lock_clause}
+            """),
+            {"shard": shard},
+        ).fetchone()
+        if row is None:
+            conn.rollback()
+            with _spare_lock:
+                _spare_stats["misses"] += 1
+            return None
+
+        spare_id, db_name = row
+        conn.execute(
+            text("UPDATE user_database_pool SET claimed_by = :user_key, claimed_at = NOW() WHERE id = :id"),
+            {"user_key": user_key, "id": spare_id},
+        )
+        conn.execute(
+            text("""
+                INSERT INTO user_databases (user_key, open_id, tenant_key, db_name, db_host, db_created, created_at, last_active_at)
+                VALUES (:user_key, :open_id, :tenant_key, :db_name, :db_host, TRUE, NOW(), NOW())
+            """),
+            {"user_key": user_key, "open_id": open_id, "tenant_key": tenant_key, "db_name": db_name, "db_host": shard},
+        )
+        conn.commit()
+    except IntegrityError:
+        conn.rollback()
+        return None
+    except Exception as e:
+        conn.rollback()
+        with _spare_lock:
+            _spare_stats["errors"] += 1
+        logger.warning(f"领取空闲用户库失败，改为现场建库: {e}")
+        return None
+
+    with _spare_lock:
+        _spare_stats["claimed"] += 1
+    _mark_known(db_name)
+    logger.info(f"Claimed spare user database {db_name} on shard {shard} for {user_key}")
+    return db_name
+
+
+def get_user_db_location(user_key: str) -> Tuple[str, str]:
     """
-    根据 user_key 生成用户数据库名称
+    获取用户数据库名称和所在分片
+
+    以主库 user_databases 中登记的库名和分片为准（进程内缓存）；未登记的用户在此分配并登记：
+    已有且属于该用户的旧库沿用 feishu_user_<md5 前 8 位>，其余使用 feishu_user_<sha256 前 24 位>
     
     Args:
         user_key: 用户唯一标识，格式为 open_id::tenant_key
     
     Returns:
-        数据库名称，格式为 feishu_user_<hash前8位>
+        (数据库名称, 分片名)
+
+    Raises:
+        主库不可用时抛出数据库异常（不回退到按哈希推算，避免写入错误的库）
     """
-    hash_value = hashlib.md5(user_key.encode()).hexdigest()[:8]
-    return f"feishu_user_{hash_value}"
+    now = time.monotonic()
+    with _db_name_lock:
+        entry = _db_name_cache.get(user_key)
+        if entry is not None and entry[2] > now:
+            _db_name_cache.move_to_end(user_key)
+            _db_name_stats["hits"] += 1
+            return entry[0], entry[1]
+        _db_name_stats["misses"] += 1
+
+    db_name, shard = _resolve_user_db_location(user_key)
+    with _db_name_lock:
+        _db_name_cache[user_key] = (db_name, shard, now + USER_DB_NAME_CACHE_TTL)
+        _db_name_cache.move_to_end(user_key)
+        while len(_db_name_cache) > USER_DB_NAME_CACHE_SIZE:
+            _db_name_cache.popitem(last=False)
+    return db_name, shard
+
+
+def get_user_db_name(user_key: str) -> str:
+    """获取用户数据库名称（见 get_user_db_location）"""
+    return get_user_db_location(user_key)[0]
+
+
+def forget_user_db_name(user_key: str) -> None:
+    """清除用户库名缓存（迁移用户库后调用）"""
+    with _db_name_lock:
+        _db_name_cache.pop(user_key, None)
+
+
+def _forget_db_name_entries(db_name: str) -> None:
+    """清除指向某个库的所有缓存（该库在分片迁移中被设为只读时调用）"""
+    with _db_name_lock:
+        stale = [user_key for user_key, entry in _db_name_cache.items() if entry[0] == db_name]
+        for user_key in stale:
+            del _db_name_cache[user_key]
 
 
 def get_master_engine() -> Engine:
-    """获取主数据库引擎"""
-    url = f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MASTER_DB_NAME}?charset=utf8mb4"
-    return create_engine(url, pool_pre_ping=True, echo=False)
+    """
+    获取主数据库引擎（进程内只创建一次）
+
+    与共享库 database.engine 的连接地址相同时直接复用，不再单独建连接池
+    """
+    global _master_engine
+    if _master_engine is not None:
+        return _master_engine
+
+    with _master_lock:
+        if _master_engine is None:
+            import database
+
+            url = f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MASTER_DB_NAME}?charset=utf8mb4"
+            if url == database.DATABASE_URL:
+                _master_engine = database.engine
+                logger.info("Master database shares the legacy database engine")
+            else:
+                _master_engine = create_engine(
+                    url,
+                    pool_pre_ping=True,
+                    echo=False,
+                    pool_size=MASTER_DB_POOL_SIZE,
+                    max_overflow=MASTER_DB_MAX_OVERFLOW,
+                    pool_recycle=3600,
+                )
+        return _master_engine
+
+
+def _get_shared_user_engine(shard: str) -> Engine:
+    """shared 模式下分片内所有用户库共用的引擎（调用方需持有 _engines_lock）"""
+    engine = _shared_user_engines.get(shard)
+    if engine is None:
+        engine = create_engine(
+            shard_server_url(shard),
+            pool_pre_ping=True,
+            echo=False,
+            pool_size=USER_DB_SHARED_POOL_SIZE,
+            max_overflow=USER_DB_SHARED_MAX_OVERFLOW,
+            pool_recycle=3600,
+        )
+        event.listen(engine, "handle_error", _on_user_engine_error)
+        _shared_user_engines[shard] = engine
+        logger.info(f"Created shared user database engine for shard {shard} (pool_size={USER_DB_SHARED_POOL_SIZE})")
+    return engine
+
+
+def _engine_location(engine: Engine) -> Tuple[Optional[str], Optional[str], str]:
+    """引擎对应的 (用户库名, host, port)；shared 模式的库名取 schema_translate_map"""
+    translate_map = engine.get_execution_options().get("schema_translate_map")
+    db_name = translate_map.get(None) if translate_map else engine.url.database
+    return db_name, engine.url.host, str(engine.url.port)
 
 
 def get_user_engine(user_key: str) -> Engine:
     """
     获取用户数据库引擎（带 LRU 缓存）
+
+    shared 模式下返回共享引擎的带 schema_translate_map 的视图，不单独建连接池
     
     Args:
         user_key: 用户唯一标识
@@ -62,40 +425,148 @@ def get_user_engine(user_key: str) -> Engine:
     Returns:
         SQLAlchemy Engine 实例
     """
+    # 库名解析可能查询主库，不在锁内进行（通常命中缓存）
+    db_name, shard = get_user_db_location(user_key)
+    host, port = get_shard_address(shard)
+
     with _engines_lock:
-        # 如果已存在，移到末尾（最近使用）
-        if user_key in _user_engines:
+        # 如果已存在，移到末尾（最近使用）；用户库被迁移（改名或换分片）后重建引擎
+        engine = _user_engines.get(user_key)
+        if engine is not None and _engine_location(engine) == (db_name, host, str(port)):
             _user_engines.move_to_end(user_key)
-            return _user_engines[user_key]
+            _engine_cache_stats["hits"] += 1
+            return engine
+        _engine_cache_stats["misses"] += 1
+        if engine is not None:
+            del _user_engines[user_key]
+            _user_session_factories.pop(user_key, None)
+            if USER_DB_POOL_MODE != "shared":
+                engine.dispose()
         
-        # 如果缓存已满，移除最旧的
+        # 如果缓存已满，移除最旧的（连同会话工厂）
         if len(_user_engines) >= MAX_CACHED_ENGINES:
             oldest_key, oldest_engine = _user_engines.popitem(last=False)
-            try:
-                oldest_engine.dispose()
-                logger.info(f"Disposed engine for {oldest_key} (cache full)")
-            except Exception as e:
-                logger.warning(f"Failed to dispose engine for {oldest_key}: {e}")
+            _user_session_factories.pop(oldest_key, None)
+            _engine_cache_stats["evictions"] += 1
+            # shared 模式下缓存的是共享引擎的视图，不能 dispose
+            if USER_DB_POOL_MODE != "shared":
+                try:
+                    oldest_engine.dispose()
+                    logger.info(f"Disposed engine for {oldest_key} (cache full)")
+                except Exception as e:
+                    logger.warning(f"Failed to dispose engine for {oldest_key}: {e}")
         
+        if USER_DB_POOL_MODE == "shared":
+            # 未指定 schema 的表都翻译为用户库下的表
+            engine = _get_shared_user_engine(shard).execution_options(schema_translate_map={None: db_name})
+            _user_engines[user_key] = engine
+            return engine
+
         # 创建新引擎
-        db_name = get_user_db_name(user_key)
-        url = f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{db_name}?charset=utf8mb4"
         engine = create_engine(
-            url, 
+            shard_server_url(shard, db_name), 
             pool_pre_ping=True, 
             echo=False, 
             pool_size=5,  # 每个引擎5个连接
             max_overflow=10,
             pool_recycle=3600  # 1小时回收连接
         )
+        event.listen(engine, "handle_error", _on_user_engine_error)
         _user_engines[user_key] = engine
         logger.info(f"Created new engine for {user_key} (cache size: {len(_user_engines)})")
         return engine
 
 
+def init_consolidated_profile_table(conn) -> None:
+    """
+    在主库创建 consolidated 模式的 user_profiles 表
+
+    按 user_key 做 KEY 分区；MySQL 要求唯一键包含分区列，因此主键为 (id, user_key)
+    """
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS user_profiles (
+            id INT NOT NULL AUTO_INCREMENT,
+            user_key VARCHAR(256) NOT NULL,
+            open_id VARCHAR(128) NOT NULL,
+            tenant_key VARCHAR(128) NOT NULL,
+            remaining_quota INT NOT NULL DEFAULT 20,
+            total_used INT NOT NULL DEFAULT 0,
+            current_plan_id VARCHAR(32),
+            plan_expires_at DATETIME,
+            plan_quota_reset_at DATETIME,
+            is_unlimited BOOLEAN NOT NULL DEFAULT FALSE,
+            invite_code_used VARCHAR(64),
+            invite_expire_at DATETIME,
+            total_paid INT NOT NULL DEFAULT 0,
+            created_at DATETIME NOT NULL,
+            updated_at DATETIME NOT NULL,
+            PRIMARY KEY (id, user_key),
+            UNIQUE KEY uk_user_key (user_key)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        PARTITION BY KEY (user_key) PARTITIONS {USER_PROFILE_PARTITIONS}
+    """))
+    conn.commit()
+
+
+def _ensure_profile_table() -> None:
+    global _profile_table_ready
+    if _profile_table_ready:
+        return
+    with get_master_engine().connect() as conn:
+        init_consolidated_profile_table(conn)
+    _profile_table_ready = True
+
+
+def get_profile_model():
+    """当前存储方式下用户会话中使用的用户配置模型（UserProfile 或 ConsolidatedUserProfile）"""
+    from database import ConsolidatedUserProfile, UserProfile
+
+    return ConsolidatedUserProfile if USER_PROFILE_STORAGE == "consolidated" else UserProfile
+
+
+def _scope_profile_queries(orm_execute_state) -> None:
+    """consolidated 模式：会话中对用户配置的查询/更新/删除只作用于 session.info["user_key"] 对应的行"""
+    from database import ConsolidatedUserProfile
+
+    user_key = orm_execute_state.session.info.get("user_key")
+    if user_key is None:
+        return
+    if orm_execute_state.is_select or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.statement = orm_execute_state.statement.options(
+            with_loader_criteria(ConsolidatedUserProfile, ConsolidatedUserProfile.user_key == user_key)
+        )
+
+
+def _fill_profile_user_key(session, flush_context, instances) -> None:
+    """consolidated 模式：新建的用户配置自动填入会话对应的 user_key"""
+    from database import ConsolidatedUserProfile
+
+    user_key = session.info.get("user_key")
+    for obj in session.new:
+        if isinstance(obj, ConsolidatedUserProfile) and obj.user_key is None:
+            obj.user_key = user_key
+
+
+def _get_profile_session(user_key: str) -> Session:
+    """consolidated 模式下的用户会话：连接主库，ConsolidatedUserProfile 按 user_key 过滤"""
+    global _profile_session_factory
+    if _profile_session_factory is None:
+        master_engine = get_master_engine()
+        with _master_lock:
+            if _profile_session_factory is None:
+                factory = sessionmaker(autocommit=False, autoflush=False, bind=master_engine)
+                event.listen(factory, "do_orm_execute", _scope_profile_queries)
+                event.listen(factory, "before_flush", _fill_profile_user_key)
+                _profile_session_factory = factory
+    return _profile_session_factory(info={"user_key": user_key})
+
+
 def get_user_session(user_key: str) -> Session:
     """
     获取用户数据库会话
+
+    consolidated 模式下返回主库会话，会话内的用户配置只包含该用户的记录；
+    会话中使用的用户配置模型见 get_profile_model()
     
     Args:
         user_key: 用户唯一标识
@@ -103,18 +574,27 @@ def get_user_session(user_key: str) -> Session:
     Returns:
         SQLAlchemy Session 实例
     """
-    if user_key not in _user_session_factories:
-        engine = get_user_engine(user_key)
-        _user_session_factories[user_key] = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    if USER_PROFILE_STORAGE == "consolidated":
+        return _get_profile_session(user_key)
+
+    engine = get_user_engine(user_key)
+    with _engines_lock:
+        factory = _user_session_factories.get(user_key)
+        if factory is None or factory.kw.get("bind") is not engine:
+            factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+            # 只缓存引擎仍在 LRU 中的工厂，淘汰时一并移除
+            if _user_engines.get(user_key) is engine:
+                _user_session_factories[user_key] = factory
     
-    return _user_session_factories[user_key]()
+    return factory()
 
 
 def get_master_session() -> Session:
     """获取主数据库会话"""
-    engine = get_master_engine()
-    SessionMaster = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    return SessionMaster()
+    global _master_session_factory
+    if _master_session_factory is None:
+        _master_session_factory = sessionmaker(autocommit=False, autoflush=False, bind=get_master_engine())
+    return _master_session_factory()
 
 
 def create_user_database(user_key: str) -> bool:
@@ -127,11 +607,10 @@ def create_user_database(user_key: str) -> bool:
     Returns:
         是否创建成功
     """
-    db_name = get_user_db_name(user_key)
+    db_name, shard = get_user_db_location(user_key)
     
-    # 连接不指定数据库的 MySQL 服务
-    server_url = f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/?charset=utf8mb4"
-    server_engine = create_engine(server_url, echo=False)
+    # 连接用户库所在分片的 MySQL 服务（不指定数据库）
+    server_engine = create_engine(shard_server_url(shard), echo=False)
     
     try:
         with server_engine.connect() as conn:
@@ -150,7 +629,7 @@ def create_user_database(user_key: str) -> bool:
         _init_user_tables(user_key)
         
         # 在主库中记录用户数据库信息
-        _register_user_database(user_key, db_name)
+        _register_user_database(user_key, db_name, shard)
         
         return True
     except Exception as e:
@@ -169,15 +648,13 @@ def _init_user_tables(user_key: str):
     logger.info(f"用户数据库表结构初始化完成: {get_user_db_name(user_key)}")
 
 
-def _register_user_database(user_key: str, db_name: str):
+def _register_user_database(user_key: str, db_name: str, shard: str = DEFAULT_SHARD):
     """在主库中注册用户数据库信息"""
     try:
         master_engine = get_master_engine()
         with master_engine.connect() as conn:
             # 解析 user_key
-            parts = user_key.split("::")
-            open_id = parts[0] if len(parts) > 0 else ""
-            tenant_key = parts[1] if len(parts) > 1 else ""
+            open_id, tenant_key = _split_user_key(user_key)
             
             # 检查是否已注册
             result = conn.execute(
@@ -185,28 +662,254 @@ def _register_user_database(user_key: str, db_name: str):
                 {"user_key": user_key}
             )
             if result.fetchone():
-                # 已注册，更新最后活跃时间
+                # 已注册（包括 get_user_db_name 预先登记的），标记已创建并更新最后活跃时间
                 conn.execute(
-                    text("UPDATE user_databases SET last_active_at = NOW() WHERE user_key = :user_key"),
+                    text("UPDATE user_databases SET db_created = TRUE, last_active_at = NOW() WHERE user_key = :user_key"),
                     {"user_key": user_key}
                 )
             else:
                 # 新注册
                 conn.execute(
                     text("""
-                        INSERT INTO user_databases (user_key, open_id, tenant_key, db_name, db_created, created_at, last_active_at)
-                        VALUES (:user_key, :open_id, :tenant_key, :db_name, TRUE, NOW(), NOW())
+                        INSERT INTO user_databases (user_key, open_id, tenant_key, db_name, db_host, db_created, created_at, last_active_at)
+                        VALUES (:user_key, :open_id, :tenant_key, :db_name, :db_host, TRUE, NOW(), NOW())
                     """),
-                    {"user_key": user_key, "open_id": open_id, "tenant_key": tenant_key, "db_name": db_name}
+                    {"user_key": user_key, "open_id": open_id, "tenant_key": tenant_key, "db_name": db_name, "db_host": shard}
                 )
             conn.commit()
     except Exception as e:
         logger.warning(f"注册用户数据库信息失败: {e}")
 
 
+def _seed_known_databases() -> None:
+    """从主库 user_databases 表加载已创建的用户数据库（失败时隔一段时间再试）"""
+    global _known_seeded, _known_seed_retry_at
+
+    now = time.monotonic()
+    with _known_lock:
+        if _known_seeded or now < _known_seed_retry_at:
+            return
+        _known_seed_retry_at = now + KNOWN_DB_SEED_RETRY_SECONDS
+
+    master_engine = get_master_engine()
+    try:
+        with master_engine.connect() as conn:
+            rows = conn.execute(text("SELECT db_name FROM user_databases WHERE db_created = TRUE")).fetchall()
+    except Exception as e:
+        logger.warning(f"加载已知用户数据库失败，稍后重试: {e}")
+        return
+
+    with _known_lock:
+        _known_databases.update(row[0] for row in rows)
+        _known_seeded = True
+        _known_stats["seeded"] = len(rows)
+    logger.info(f"Loaded {len(rows)} known user databases")
+
+
+def _mark_known(db_name: str) -> None:
+    with _known_lock:
+        _known_databases.add(db_name)
+
+
+def forget_user_database(db_name: str) -> None:
+    """从已知数据库登记中移除（库被删除或连接失败时调用），下次访问重新探测"""
+    with _known_lock:
+        if db_name in _known_databases:
+            _known_databases.discard(db_name)
+            _known_stats["invalidated"] += 1
+            logger.info(f"Forgot known user database {db_name}")
+
+
+def _on_user_engine_error(context) -> None:
+    """
+    用户库引擎出错时：
+    - 库不存在或连接失效，移出已知登记
+    - 库为只读（正在迁移到其他分片），清除指向该库的库名缓存，下次请求重新解析位置
+    """
+    orig = context.original_exception
+    code = orig.args[0] if getattr(orig, "args", None) else None
+    if code not in (MYSQL_UNKNOWN_DATABASE, MYSQL_SCHEMA_READ_ONLY) and not context.is_disconnect:
+        return
+
+    db_name = None
+    if context.connection is not None:
+        # shared 模式：库名在 schema_translate_map 中
+        db_name = (context.connection.get_execution_options().get("schema_translate_map") or {}).get(None)
+    if db_name is None and context.engine is not None:
+        db_name = context.engine.url.database
+    if not db_name:
+        return
+    if code == MYSQL_SCHEMA_READ_ONLY:
+        _forget_db_name_entries(db_name)
+    else:
+        forget_user_database(db_name)
+
+
+def _probe_user_database(user_key: str) -> None:
+    """探测用户库是否可用，不可用时抛出异常"""
+    engine = get_user_engine(user_key)
+    with engine.connect() as conn:
+        if USER_DB_POOL_MODE == "shared":
+            # 共享连接不指定库，SELECT 1 总会成功，改为查询库是否存在
+            db_name = get_user_db_name(user_key)
+            found = conn.execute(
+                text("SELECT SCHEMA_NAME FROM information_schema.SCHEMATA WHERE SCHEMA_NAME = :db_name"),
+                {"db_name": db_name},
+            ).fetchone()
+            if not found:
+                raise LookupError(f"Unknown database {db_name}")
+        else:
+            conn.execute(text("SELECT 1"))
+
+
+def _provision_spare_database(shard: str) -> str:
+    """在分片上建一个空闲库（建好用户库表结构）并放入池中"""
+    from database import UserBase
+
+    db_name = f"feishu_user_{uuid.uuid4().hex[:USER_DB_NAME_HASH_LENGTH]}"
+    server_engine = create_engine(shard_server_url(shard), echo=False)
+    try:
+        with server_engine.connect() as conn:
+            conn.execute(text(f"CREATE DATABASE `{db_name}` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci"))
+            conn.commit()
+    finally:
+        server_engine.dispose()
+
+    try:
+        db_engine = create_engine(shard_server_url(shard, db_name), echo=False)
+        try:
+            UserBase.metadata.create_all(bind=db_engine)
+        finally:
+            db_engine.dispose()
+
+        with get_master_engine().connect() as conn:
+            conn.execute(
+                text("INSERT INTO user_database_pool (db_name, db_host, created_at) VALUES (:db_name, :db_host, NOW())"),
+                {"db_name": db_name, "db_host": shard},
+            )
+            conn.commit()
+    except Exception:
+        # 建表或入池失败时删除刚建的库，避免留下不在池中、永远不会被使用的库
+        _drop_spare_database(shard, db_name)
+        raise
+    return db_name
+
+
+def _drop_spare_database(shard: str, db_name: str) -> None:
+    server_engine = create_engine(shard_server_url(shard), echo=False)
+    try:
+        with server_engine.connect() as conn:
+            conn.execute(text(f"DROP DATABASE IF EXISTS `{db_name}`"))
+            conn.commit()
+    except Exception as e:
+        logger.error(f"删除未入池的空闲用户库 {db_name}（{shard}）失败，需要手动清理: {e}")
+    finally:
+        server_engine.dispose()
+
+
+def provision_spare_databases() -> int:
+    """
+    把每个分片的空闲库补足到 USER_DB_SPARE_POOL_SIZE，返回本次新建的数量
+
+    用 MySQL GET_LOCK 保证多个 worker 中同时只有一个在补充
+    """
+    created = 0
+    with get_master_engine().connect() as lock_conn:
+        acquired = lock_conn.execute(text("SELECT GET_LOCK(:name, 0)"), {"name": SPARE_PROVISIONER_LOCK}).scalar()
+        if not acquired:
+            return 0
+        try:
+            for shard in sorted(set(_ring_owners)):
+                ready = lock_conn.execute(
+                    text("SELECT COUNT(*) FROM user_database_pool WHERE db_host = :shard AND claimed_by IS NULL"),
+                    {"shard": shard},
+                ).scalar()
+                lock_conn.commit()
+                for _ in range(USER_DB_SPARE_POOL_SIZE - ready):
+                    if _spare_stop.is_set():
+                        return created
+                    db_name = _provision_spare_database(shard)
+                    created += 1
+                    with _spare_lock:
+                        _spare_stats["provisioned"] += 1
+                    logger.info(f"Provisioned spare user database {db_name} on shard {shard}")
+        finally:
+            lock_conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": SPARE_PROVISIONER_LOCK})
+            lock_conn.commit()
+    return created
+
+
+def _spare_provisioner_loop() -> None:
+    while not _spare_stop.is_set():
+        try:
+            provision_spare_databases()
+        except Exception as e:
+            with _spare_lock:
+                _spare_stats["errors"] += 1
+            logger.warning(f"补充空闲用户库失败: {e}")
+        _spare_stop.wait(USER_DB_SPARE_CHECK_SECONDS)
+
+
+def start_spare_provisioner() -> None:
+    """启动后台补充空闲用户库的线程（USER_DB_SPARE_POOL_SIZE 为 0 或 consolidated 模式下不启动）"""
+    global _spare_thread
+    if USER_DB_SPARE_POOL_SIZE <= 0 or USER_PROFILE_STORAGE == "consolidated":
+        return
+    if _spare_thread is not None and _spare_thread.is_alive():
+        return
+    _spare_stop.clear()
+    _spare_thread = Thread(target=_spare_provisioner_loop, name="user-db-provisioner", daemon=True)
+    _spare_thread.start()
+    logger.info(f"Started spare user database provisioner (pool size {USER_DB_SPARE_POOL_SIZE} per shard)")
+
+
+def stop_spare_provisioner() -> None:
+    """停止后台补充线程（正在建的库建完后退出）"""
+    global _spare_thread
+    _spare_stop.set()
+    if _spare_thread is not None:
+        _spare_thread.join(timeout=30)
+        _spare_thread = None
+
+
+def _pool_status(pool) -> Dict[str, int]:
+    return {"size": pool.size(), "checked_out": pool.checkedout(), "overflow": pool.overflow()}
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """用户库连接模式、引擎缓存命中/未命中/淘汰次数和连接池状态"""
+    with _engines_lock:
+        stats: Dict[str, Any] = {
+            "mode": USER_DB_POOL_MODE,
+            "profile_storage": USER_PROFILE_STORAGE,
+            "shards": sorted(set(_ring_owners)),
+            "capacity": MAX_CACHED_ENGINES,
+            "cached_engines": len(_user_engines),
+            "cached_session_factories": len(_user_session_factories),
+            **_engine_cache_stats,
+        }
+        with _db_name_lock:
+            stats["db_name_cache"] = {**_db_name_stats, "size": len(_db_name_cache)}
+        with _spare_lock:
+            stats["spare_pool"] = {**_spare_stats, "target_per_shard": USER_DB_SPARE_POOL_SIZE}
+        if _master_engine is not None:
+            stats["master_pool"] = _pool_status(_master_engine.pool)
+        if USER_DB_POOL_MODE == "shared":
+            stats["shared_pools"] = {shard: _pool_status(engine.pool) for shard, engine in _shared_user_engines.items()}
+        return stats
+
+
+def get_known_database_stats() -> Dict[str, Any]:
+    """已知数据库登记统计：命中、探测、新建、失效次数"""
+    with _known_lock:
+        return {**_known_stats, "known": len(_known_databases), "seed_loaded": _known_seeded}
+
+
 def ensure_user_database(user_key: str) -> bool:
     """
     确保用户数据库存在，如果不存在则创建
+
+    已登记为存在的数据库直接返回，不再探测连接；consolidated 模式下只需确保主库 user_profiles 表存在
     
     Args:
         user_key: 用户唯一标识
@@ -214,17 +917,76 @@ def ensure_user_database(user_key: str) -> bool:
     Returns:
         数据库是否可用
     """
+    if USER_PROFILE_STORAGE == "consolidated":
+        _ensure_profile_table()
+        return True
+
     db_name = get_user_db_name(user_key)
+
+    _seed_known_databases()
+    with _known_lock:
+        if db_name in _known_databases:
+            _known_stats["hits"] += 1
+            return True
+        _known_stats["probes"] += 1
     
     # 快速检查：尝试连接
     try:
-        engine = get_user_engine(user_key)
-        with engine.connect() as conn:
-            conn.execute(text("SELECT 1"))
+        _probe_user_database(user_key)
+        _mark_known(db_name)
         return True
     except Exception:
         # 数据库不存在，创建它
-        return create_user_database(user_key)
+        created = create_user_database(user_key)
+        if created:
+            with _known_lock:
+                _known_stats["created"] += 1
+            _mark_known(db_name)
+        return created
+
+
+def upgrade_master_schema(conn) -> None:
+    """
+    补齐旧版本主库缺少的列和表（幂等，服务启动时和 init_master_database 中执行）
+    - user_databases.db_host：分片名，旧登记为空（属于 default 分片）
+    - user_database_pool：预建的空闲用户库
+    """
+    # 预建的空闲用户库，claimed_by 非空表示已分配给用户
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS user_database_pool (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            db_name VARCHAR(64) UNIQUE NOT NULL,
+            db_host VARCHAR(64) NOT NULL,
+            claimed_by VARCHAR(256),
+            created_at DATETIME DEFAULT NOW(),
+            claimed_at DATETIME,
+            INDEX idx_host_claimed (db_host, claimed_by)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """))
+    # 旧版本的 user_databases 没有 db_host（分片名）列，补上
+    has_db_host = conn.execute(
+        text("""
+            SELECT 1 FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = :schema AND TABLE_NAME = 'user_databases' AND COLUMN_NAME = 'db_host'
+        """),
+        {"schema": MASTER_DB_NAME},
+    ).fetchone()
+    if not has_db_host:
+        try:
+            conn.execute(text("ALTER TABLE user_databases ADD COLUMN db_host VARCHAR(64) AFTER db_name"))
+        except OperationalError as e:
+            # 1060: 列已存在（多个 worker 同时启动，其他 worker 已添加）
+            if e.orig.args[0] != 1060:
+                raise
+            conn.rollback()
+    conn.commit()
+
+
+def ensure_master_schema() -> None:
+    """服务启动时调用：主库 user_databases 已存在时，补齐新版本需要的列和表"""
+    with get_master_engine().connect() as conn:
+        upgrade_master_schema(conn)
+    logger.info("Master database schema is up to date")
 
 
 def init_master_database():
@@ -249,13 +1011,16 @@ def init_master_database():
                     open_id VARCHAR(128) NOT NULL,
                     tenant_key VARCHAR(128) NOT NULL,
                     db_name VARCHAR(64) NOT NULL,
+                    db_host VARCHAR(64),
                     db_created BOOLEAN DEFAULT FALSE,
                     created_at DATETIME DEFAULT NOW(),
                     last_active_at DATETIME,
                     INDEX idx_open_id (open_id),
-                    INDEX idx_tenant_key (tenant_key)
+                    INDEX idx_tenant_key (tenant_key),
+                    INDEX idx_db_name (db_name)
                 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
             """))
+            upgrade_master_schema(conn)
             
             # 全局套餐定价表（从旧库迁移）
             conn.execute(text("""
@@ -279,6 +1044,9 @@ def init_master_database():
                 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
             """))
             conn.commit()
+
+            if USER_PROFILE_STORAGE == "consolidated":
+                init_consolidated_profile_table(conn)
         
         logger.info("主数据库初始化完成")
         return True
@@ -2,7 +2,6 @@
 统一的用户标识模块
 提供一致的用户识别和管理
 """
-import hashlib
 from dataclasses import dataclass
 from typing import Optional
 
@@ -31,14 +30,14 @@ class UserIdentity:
         """
         return f"{self.open_id}::{self.tenant_key}"
     
-    @property
-    def db_name(self) -> str:
+    def resolve_db_name(self) -> str:
         """
-        生成用户数据库名称
-        格式: feishu_user_<hash前8位>
+        解析用户数据库名称（见 user_db_manager.get_user_db_name）
+
+        会查询主库 user_databases，未登记的用户会在此分配库并登记，因此不是普通属性，只在确实需要库名时调用
         """
-        hash_value = hashlib.md5(self.user_key.encode()).hexdigest()[:8]
-        return f"feishu_user_{hash_value}"
+        from user_db_manager import get_user_db_name
+        return get_user_db_name(self.user_key)
     
     def to_dict(self) -> dict:
         """转换为字典"""
@@ -47,7 +46,6 @@ class UserIdentity:
             'tenant_key': self.tenant_key,
             'user_id': self.user_id,
             'user_key': self.user_key,
-            'db_name': self.db_name
         }
     
     def to_jwt_payload(self) -> dict: